@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Bulk content generation through the OpenAI Batch API
+
+Writes a JSONL job of chat completion requests built by
+ContentGenerator._create_prompt, submits it, polls until the batch
+finishes and ingests the results into the post store, where the content
+queue picks them up before paying for live completions. A job is cut to
+what the overall spend caps can still cover, counting batches submitted
+but not yet ingested, before anything is uploaded.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from channels import load_channels
+from config import Config
+from content_generator import ContentGenerator
+from content_queue import shared_topic_requests
+from logging_setup import setup_logging
+from post_store import prompt_hash
+from storage import read_json, write_json_atomic
+from stream_guard import StreamRejected
+from token_budget import BATCH_PRICE_FACTOR, completion_cost, count_message_tokens
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+# Batches finish within their 24h window; older un-ingested ones no longer hold budget
+PENDING_BATCH_HOURS = 48
+
+class BatchGenerator:
+    """Plans, submits and ingests OpenAI Batch API jobs for scheduled content"""
+
+    def __init__(self, content_generator: ContentGenerator, batch_dir: str = None):
+        self.content_generator = content_generator
+        self.client = content_generator.async_client
+        self.batch_dir = batch_dir or Config.BATCH_DIR
+        self._job_costs: Dict[str, float] = {}
+
+    def plan_topics(self, days: int) -> List[str]:
+        """Topics for `days` of posting across all channels, shared where channels overlap"""
+        channels = load_channels(known_topics=self.content_generator.content_topics,
+                                 known_languages=list(self.content_generator.catalog.languages))
+        plans = {}
+        for channel in channels:
+            if channel.language != Config.DEFAULT_LANGUAGE:
+                # Batch requests produce default-language posts; localized channels generate live
+                logger.info(f"Skipping {channel.name}: batch posts are {Config.DEFAULT_LANGUAGE}, "
+                            f"channel posts in {channel.language}")
+                continue
+            pool = channel.topics or self.content_generator.content_topics
+            count = days * len(channel.posting_hours)
+            plans[channel.channel_id] = self.content_generator._pick_batch_topics(count, pool=pool)
+        return shared_topic_requests(plans)
+
+    def write_job(self, topics: List[str]) -> Optional[str]:
+        """Write one chat completion request per topic to a JSONL file and return its path
+
+        Requests past what the spend caps allow are left out; returns None
+        when not even one fits.
+        """
+        lines = []
+        for index, topic in enumerate(topics):
+            post_type = random.choice(self.content_generator.post_types)
+            body = self.content_generator._completion_kwargs(
+                self.content_generator._create_prompt(topic, post_type), topic
+            )
+            lines.append({
+                "custom_id": f"{index}|{topic}|{post_type}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": body
+            })
+        lines, cost = self._affordable(lines)
+        if not lines:
+            return None
+
+        os.makedirs(self.batch_dir, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        path = os.path.join(self.batch_dir, f"job-{stamp}.jsonl")
+        with open(path, 'w', encoding='utf-8') as f:
+            for line in lines:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        self._job_costs[path] = cost
+        logger.info(f"Wrote {len(lines)} batch requests to {path} (at most ${cost:.4f})")
+        return path
+
+    @staticmethod
+    def estimate_cost(body: Dict) -> float:
+        """Worst-case USD of one batch request: its prompt plus a full `max_tokens` reply, at batch prices"""
+        prompt_tokens = count_message_tokens(body["messages"], body.get("model"))
+        return completion_cost(prompt_tokens, body["max_tokens"]) * BATCH_PRICE_FACTOR
+
+    def pending_cost(self) -> float:
+        """Estimated USD of recent batches whose results are not in the spend ledger yet"""
+        if not os.path.isdir(self.batch_dir):
+            return 0.0
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=PENDING_BATCH_HOURS)
+        total = 0.0
+        for name in os.listdir(self.batch_dir):
+            if not name.endswith(".json"):
+                continue
+            meta = read_json(os.path.join(self.batch_dir, name), {})
+            if meta.get("ingested") or "estimated_cost" not in meta:
+                continue
+            if datetime.fromisoformat(meta["submitted_at"]) >= cutoff:
+                total += meta["estimated_cost"]
+        return total
+
+    def _affordable(self, lines: List[Dict]) -> tuple:
+        """The leading requests the overall caps can cover, and their estimated cost"""
+        headroom = self.content_generator.budget.headroom() - self.pending_cost()
+        kept, cost = [], 0.0
+        for line in lines:
+            line_cost = self.estimate_cost(line["body"])
+            if cost + line_cost > headroom:
+                break
+            kept.append(line)
+            cost += line_cost
+        if len(kept) < len(lines):
+            logger.warning(f"Spend caps cover {len(kept)} of {len(lines)} batch requests "
+                           f"(${max(headroom, 0.0):.4f} left after pending batches)")
+        return kept, cost
+
+    async def submit(self, path: str) -> str:
+        """Upload a JSONL job and start the batch; returns the batch id"""
+        with open(path, 'rb') as f:
+            input_file = await self.client.files.create(file=f, purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        write_json_atomic(os.path.join(self.batch_dir, f"{batch.id}.json"), {
+            "batch_id": batch.id,
+            "input_file_id": input_file.id,
+            "job_path": path,
+            "submitted_at": datetime.now(timezone.utc).isoformat(),
+            # Held against the caps until the results are ingested and charged
+            "estimated_cost": self._job_costs.get(path, 0.0),
+            "ingested": False
+        })
+        logger.info(f"Submitted batch {batch.id} from {path}")
+        return batch.id
+
+    async def wait(self, batch_id: str, poll_interval: float = None):
+        """Poll a batch until it reaches a terminal status and return it"""
+        poll_interval = poll_interval or Config.BATCH_POLL_INTERVAL
+        while True:
+            batch = await self.client.batches.retrieve(batch_id)
+            if batch.status in TERMINAL_STATUSES:
+                logger.info(f"Batch {batch_id} finished with status {batch.status}")
+                return batch
+            counts = batch.request_counts
+            progress = f"{counts.completed}/{counts.total}" if counts else "?"
+            logger.info(f"Batch {batch_id} is {batch.status} ({progress}), checking again in {poll_interval}s")
+            await asyncio.sleep(poll_interval)
+
+    async def ingest(self, batch) -> List[Dict[str, str]]:
+        """Store every usable completion of a finished batch as a post"""
+        meta_path = os.path.join(self.batch_dir, f"{batch.id}.json")
+        meta = read_json(meta_path, {})
+        if meta.get("ingested"):
+            logger.info(f"Batch {batch.id} was already ingested")
+            return []
+        if not batch.output_file_id:
+            logger.error(f"Batch {batch.id} has no output file (status {batch.status})")
+            # Nothing will be charged, so stop holding its estimate
+            meta.update({"ingested": True, "ingested_posts": 0, "status": batch.status})
+            write_json_atomic(meta_path, meta)
+            return []
+
+        output = await self.client.files.content(batch.output_file_id)
+        posts = []
+        rejected = 0
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            post = self._ingest_result(result)
+            if post:
+                posts.append(post)
+            else:
+                rejected += 1
+
+        meta.update({"ingested": True, "ingested_posts": len(posts), "rejected": rejected})
+        write_json_atomic(meta_path, meta)
+        logger.info(f"Ingested {len(posts)} posts from batch {batch.id} ({rejected} rejected)")
+        return posts
+
+    def _ingest_result(self, result: Dict):
+        """Turn one batch output line into a stored post, or None if unusable"""
+        _, topic, post_type = result["custom_id"].split("|", 2)
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            logger.warning(f"Batch request {result['custom_id']} failed: {result.get('error') or response}")
+            return None
+        usage = response["body"].get("usage")
+        if usage:
+            # Paid whether or not the post is kept; not tied to a channel until the queue serves it
+            self.content_generator.budget.record([], topic, SimpleNamespace(**usage), price_factor=BATCH_PRICE_FACTOR)
+
+        try:
+            content = self.content_generator._validate_content(
+                response["body"]["choices"][0]["message"]["content"], topic
+            )
+        except StreamRejected as e:
+            logger.warning(f"Batch request {result['custom_id']} rejected: {e}")
+            return None
+        if not self.content_generator._accept_content(content, topic, 0):
+            return None
+
+        request = self.content_generator._completion_kwargs(self.content_generator._create_prompt(topic, post_type), topic)
+        post = self.content_generator._assemble_post(content, topic, post_type, source="batch")
+        return self.content_generator._store_post(post, prompt_hash(request))
+
+    async def run(self, days: int, poll_interval: float = None) -> List[Dict[str, str]]:
+        """Plan, submit, wait for and ingest a batch covering `days` of posting"""
+        path = self.write_job(self.plan_topics(days))
+        if path is None:
+            logger.error("Spend caps leave no room for a batch, nothing submitted")
+            return []
+        batch_id = await self.submit(path)
+        batch = await self.wait(batch_id, poll_interval)
+        return await self.ingest(batch)
+
+    async def resume(self, batch_id: str, poll_interval: float = None) -> List[Dict[str, str]]:
+        """Wait for and ingest a batch submitted earlier"""
+        batch = await self.wait(batch_id, poll_interval)
+        return await self.ingest(batch)
+
+async def main():
+    parser = argparse.ArgumentParser(description="Bulk-generate scheduled posts with the OpenAI Batch API")
+    parser.add_argument('--days', type=int, default=7, help="days of posting to generate for every channel")
+    parser.add_argument('--resume', metavar='BATCH_ID', help="wait for and ingest an already submitted batch")
+    parser.add_argument('--poll-interval', type=float, default=None, help="seconds between status checks")
+    args = parser.parse_args()
+
+    generator = ContentGenerator()
+    batch_generator = BatchGenerator(generator)
+    try:
+        if args.resume:
+            posts = await batch_generator.resume(args.resume, args.poll_interval)
+        else:
+            posts = await batch_generator.run(args.days, args.poll_interval)
+        print(f"Stored {len(posts)} posts")
+    finally:
+        await generator.aclose()
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(main())
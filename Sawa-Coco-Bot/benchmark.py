@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Load test for content generation and delivery against local stand-in servers
+
+Starts MockOpenAIServer and MockTelegramServer with the requested latency
+and fault rates, points the bot at them through the environment and
+drives TelegramContentBot through posting rounds across many channels:
+every round fires one slot for every channel at once, as the scheduler
+does. Reports throughput, end-to-end latency percentiles, event loop lag
+(how late timers such as schedule slots fire under load), slot-to-delivery
+drift and peak memory.
+
+    python benchmark.py --channels 200 --posts 2000 --openai-latency 0.3 --rate-limit-rate 0.02
+
+`--mode queued` pre-generates through the content queue first and times
+generation and delivery separately. `--baseline report.json` fails the
+run if throughput or p99 latency regressed by more than `--max-regression`.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from mock_servers import MockOpenAIServer, MockTelegramServer
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+class LoopLagProbe:
+    """Measures how late asyncio timers fire while the benchmark runs"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.lags: List[float] = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, loop.time() - expected))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+def write_channels_file(path: str, count: int):
+    """Channels with staggered topic subsets so shared generation is exercised"""
+    from catalog import get_catalog
+    topics = list(get_catalog().topics)
+    channels = []
+    for index in range(count):
+        offset = (index * 3) % len(topics)
+        channels.append({
+            "id": f"@bench_channel_{index:04d}",
+            "name": f"Bench {index}",
+            "topics": (topics[offset:] + topics[:offset])[:6],
+            "posting_hours": ["09:00", "18:00"],
+            "timezone": "UTC"
+        })
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"channels": channels}, f)
+
+def configure_environment(args, workdir: str, openai_url: str, telegram_url: str):
+    """Point Config at the mock servers and a scratch data directory (before config is imported)"""
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': '123456:benchmark',
+        'TELEGRAM_BASE_URL': telegram_url,
+        'OPENAI_API_KEY': 'sk-benchmark',
+        'OPENAI_BASE_URL': openai_url,
+        'DATA_DIR': workdir,
+        'CHANNELS_FILE': os.path.join(workdir, 'channels.json'),
+        'METRICS_PORT': '0',
+        'QUEUE_HIGH_WATERMARK': str(args.rounds),
+        'OPENAI_MAX_CONNECTIONS': str(args.openai_connections),
+        'TELEGRAM_MAX_CONNECTIONS': str(args.telegram_connections),
+        'GENERATION_CONCURRENCY': str(args.generation_concurrency),
+        'SEND_BACKOFF_BASE': '0.1',
+        'SEND_BACKOFF_MAX': '1',
+        'LOG_FILE': '',
+        'LOG_LEVEL': 'INFO' if args.verbose else 'ERROR',
+    })
+    if args.global_rate:
+        os.environ['TELEGRAM_GLOBAL_RATE'] = str(args.global_rate)
+    if args.chat_rate:
+        os.environ['TELEGRAM_CHAT_RATE_PER_MINUTE'] = str(args.chat_rate)
+        os.environ['TELEGRAM_CHAT_BURST'] = str(max(1, args.rounds))
+
+async def run_rounds(bot, rounds: int) -> Dict:
+    """Fire `rounds` posting slots for every channel and time each post"""
+    latencies, drifts = [], []
+    delivered = failed = 0
+    channel_ids = list(bot.channels)
+
+    async def post(channel_id: str, slot: datetime, started: float):
+        success = await bot._send_channel_post(channel_id, slot)
+        latencies.append(time.perf_counter() - started)
+        drifts.append((datetime.now(timezone.utc) - slot).total_seconds())
+        return success
+
+    started_at = time.perf_counter()
+    for _ in range(rounds):
+        slot = datetime.now(timezone.utc)
+        started = time.perf_counter()
+        results = await asyncio.gather(*(post(c, slot, started) for c in channel_ids), return_exceptions=True)
+        for result in results:
+            if result is True:
+                delivered += 1
+            else:
+                failed += 1
+    elapsed = time.perf_counter() - started_at
+    return {
+        "posts": delivered + failed,
+        "delivered": delivered,
+        "failed": failed,
+        "seconds": round(elapsed, 3),
+        "posts_per_sec": round((delivered + failed) / elapsed, 2) if elapsed else 0.0,
+        "latency_p50": round(percentile(latencies, 50), 4),
+        "latency_p99": round(percentile(latencies, 99), 4),
+        "latency_max": round(max(latencies, default=0.0), 4),
+        "drift_p99": round(percentile(drifts, 99), 4),
+    }
+
+async def run_benchmark(args, openai_server: MockOpenAIServer, telegram_server: MockTelegramServer) -> Dict:
+    import metrics
+    from telegram_bot import TelegramContentBot
+
+    bot = TelegramContentBot()
+    await bot.content_generator.warm_up()
+    probe = LoopLagProbe()
+    probe.start()
+    report = {"channels": len(bot.channels), "rounds": args.rounds, "mode": args.mode}
+    try:
+        if args.mode == 'queued':
+            started = time.perf_counter()
+            added = await bot.content_queue.refill_many(list(bot.channels))
+            elapsed = time.perf_counter() - started
+            report["generation"] = {
+                "posts_queued": sum(added.values()),
+                "completions": openai_server.requests,
+                "seconds": round(elapsed, 3),
+                "posts_per_sec": round(sum(added.values()) / elapsed, 2) if elapsed else 0.0,
+            }
+        report["delivery"] = await run_rounds(bot, args.rounds)
+    finally:
+        await probe.stop()
+        bot.stop_scheduler()
+        await bot.content_generator.aclose()
+        await bot.bot.shutdown()
+
+    report["loop_lag_p99"] = round(percentile(probe.lags, 99), 4)
+    report["loop_lag_max"] = round(max(probe.lags, default=0.0), 4)
+    report["fallbacks"] = metrics.FALLBACKS.total()
+    report["circuit_rejected"] = metrics.CIRCUIT_REJECTED.total()
+    report["retry_queue"] = len(bot.send_pipeline.retry_queue)
+    report["openai"] = openai_server.stats()
+    report["telegram"] = telegram_server.stats()
+    report["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    return report
+
+def print_report(report: Dict):
+    delivery = report["delivery"]
+    print(f"Channels: {report['channels']}  rounds: {report['rounds']}  mode: {report['mode']}")
+    if "generation" in report:
+        generation = report["generation"]
+        print(f"Generation: {generation['posts_queued']} posts from {generation['completions']} completions "
+              f"in {generation['seconds']}s ({generation['posts_per_sec']} posts/sec)")
+    print(f"Delivery: {delivery['delivered']}/{delivery['posts']} delivered in {delivery['seconds']}s "
+          f"({delivery['posts_per_sec']} posts/sec)")
+    print(f"End-to-end latency: p50 {delivery['latency_p50']}s  p99 {delivery['latency_p99']}s  "
+          f"max {delivery['latency_max']}s")
+    print(f"Slot drift p99: {delivery['drift_p99']}s  event loop lag p99: {report['loop_lag_p99']}s  "
+          f"max {report['loop_lag_max']}s")
+    print(f"Fallbacks: {report['fallbacks']} ({report['circuit_rejected']} with the circuit open)  "
+          f"retry queue: {report['retry_queue']}")
+    print(f"OpenAI: {report['openai']}")
+    print(f"Telegram: {report['telegram']}")
+    print(f"Peak RSS: {report['peak_rss_mb']} MB")
+
+def compare_to_baseline(report: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """Regressions beyond the allowed fraction, as messages"""
+    regressions = []
+    current, previous = report["delivery"], baseline["delivery"]
+    if current["posts_per_sec"] < previous["posts_per_sec"] * (1 - max_regression):
+        regressions.append(f"throughput {current['posts_per_sec']} < baseline {previous['posts_per_sec']} posts/sec")
+    if current["latency_p99"] > previous["latency_p99"] * (1 + max_regression):
+        regressions.append(f"p99 latency {current['latency_p99']}s > baseline {previous['latency_p99']}s")
+    if report["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + max_regression):
+        regressions.append(f"peak RSS {report['peak_rss_mb']} MB > baseline {baseline['peak_rss_mb']} MB")
+    return regressions
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark generation and delivery against mock APIs")
+    parser.add_argument('--channels', type=int, default=200)
+    parser.add_argument('--posts', type=int, default=2000, help="total posts (rounded to whole rounds)")
+    parser.add_argument('--mode', choices=('live', 'queued'), default='live',
+                        help="live: generate at send time; queued: refill the content queue first")
+    parser.add_argument('--openai-latency', type=float, default=0.2)
+    parser.add_argument('--openai-jitter', type=float, default=0.1)
+    parser.add_argument('--openai-error-rate', type=float, default=0.0)
+    parser.add_argument('--openai-rate-limit-rate', type=float, default=0.0)
+    parser.add_argument('--telegram-latency', type=float, default=0.05)
+    parser.add_argument('--telegram-jitter', type=float, default=0.02)
+    parser.add_argument('--telegram-error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help="share of sends answered with 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="retry_after seconds in injected 429s")
+    parser.add_argument('--global-rate', type=float, default=None, help="override TELEGRAM_GLOBAL_RATE")
+    parser.add_argument('--chat-rate', type=float, default=None, help="override TELEGRAM_CHAT_RATE_PER_MINUTE")
+    parser.add_argument('--openai-connections', type=int, default=20)
+    parser.add_argument('--telegram-connections', type=int, default=16)
+    parser.add_argument('--generation-concurrency', type=int, default=16)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', metavar='PATH', help="also write the report as JSON")
+    parser.add_argument('--baseline', metavar='PATH', help="compare against a previous JSON report")
+    parser.add_argument('--max-regression', type=float, default=0.2)
+    parser.add_argument('--verbose', action='store_true', help="show the bot's own logging")
+    args = parser.parse_args()
+    args.rounds = max(1, args.posts // max(1, args.channels))
+
+    openai_server = MockOpenAIServer(
+        latency=args.openai_latency, jitter=args.openai_jitter, error_rate=args.openai_error_rate,
+        rate_limit_rate=args.openai_rate_limit_rate, retry_after=args.retry_after, seed=args.seed,
+        stream_delay=0
+    ).start()
+    telegram_server = MockTelegramServer(
+        latency=args.telegram_latency, jitter=args.telegram_jitter, error_rate=args.telegram_error_rate,
+        rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after, seed=args.seed + 1
+    ).start()
+
+    try:
+        with tempfile.TemporaryDirectory(prefix='sawacoco-bench-') as workdir:
+            configure_environment(args, workdir, openai_server.base_url, telegram_server.base_url)
+            from logging_setup import setup_logging
+            setup_logging()
+            write_channels_file(os.environ['CHANNELS_FILE'], args.channels)
+            report = asyncio.run(run_benchmark(args, openai_server, telegram_server))
+    finally:
+        openai_server.stop()
+        telegram_server.stop()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare_to_baseline(report, json.load(f), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,234 @@
+import json
+import logging
+import os
+from string import Formatter
+from typing import Dict, List, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_TOPIC_FIELDS = ("prompt", "hashtags", "cta")
+COVERAGE_FIELDS = ("prompt", "hashtags", "cta", "fallback")
+LANGUAGE_FIELDS = ("cta", "fallback")
+PROMPT_FIELDS = {"post_type"}
+FOOTER_FIELDS = {"company", "product", "location"}
+
+class CatalogError(ValueError):
+    """Raised when the content catalog is malformed"""
+
+class TopicRecord:
+    """Compiled, immutable content definition for one topic
+
+    The prompt template already carries the shared suffix, and the footer
+    (hashtags, company lines, CTA, URL) is rendered once at load time, so
+    building a prompt or a post is one format call or concatenation.
+    """
+
+    __slots__ = ("topic", "group", "prompt_template", "hashtags", "cta", "fallback", "footer", "has_fallback")
+
+    def __init__(self, topic: str, group: str, prompt_template: str, hashtags: str, cta: str,
+                 fallback: str, footer: str, has_fallback: bool):
+        object.__setattr__(self, "topic", topic)
+        object.__setattr__(self, "group", group)
+        object.__setattr__(self, "prompt_template", prompt_template)
+        object.__setattr__(self, "hashtags", hashtags)
+        object.__setattr__(self, "cta", cta)
+        object.__setattr__(self, "fallback", fallback)
+        object.__setattr__(self, "footer", footer)
+        object.__setattr__(self, "has_fallback", has_fallback)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"TopicRecord is immutable (tried to set {name})")
+
+    def prompt(self, post_type: str) -> str:
+        return self.prompt_template.format(post_type=post_type)
+
+    def __repr__(self):
+        return f"TopicRecord({self.topic!r}, group={self.group!r})"
+
+def _check_template(where: str, template: str, allowed: set = PROMPT_FIELDS) -> List[str]:
+    """Report placeholders other than `allowed` ({post_type} by default) or unbalanced braces"""
+    try:
+        fields = {name for _, name, _, _ in Formatter().parse(template) if name is not None}
+    except ValueError as e:
+        return [f"{where}: invalid template ({e})"]
+    unknown = fields - allowed
+    return [f"{where}: unknown placeholder(s) {', '.join(sorted(unknown))}"] if unknown else []
+
+def validate_catalog_data(data: Dict) -> Tuple[List[str], List[str]]:
+    """Return (errors, coverage warnings) for raw catalog data"""
+    errors = []
+    warnings = []
+    for key in ("system_prompt", "prompt_suffix", "post_types", "base_hashtags", "defaults", "topics"):
+        if key not in data:
+            errors.append(f"missing top-level key '{key}'")
+    if errors:
+        return errors, warnings
+
+    defaults = data["defaults"]
+    for field in COVERAGE_FIELDS:
+        if not defaults.get(field):
+            errors.append(f"defaults: missing '{field}'")
+    errors += _check_template("defaults.prompt", defaults.get("prompt", ""))
+    if not data["post_types"]:
+        errors.append("post_types is empty")
+    if not data["topics"]:
+        errors.append("topics is empty")
+
+    for topic, entry in data["topics"].items():
+        if not isinstance(entry, dict):
+            errors.append(f"{topic}: expected an object")
+            continue
+        for field in REQUIRED_TOPIC_FIELDS:
+            if not entry.get(field):
+                errors.append(f"{topic}: missing '{field}'")
+        if entry.get("hashtags") and not all(isinstance(t, str) and t.startswith("#") for t in entry["hashtags"]):
+            errors.append(f"{topic}: hashtags must be strings starting with '#'")
+        errors += _check_template(f"{topic}.prompt", entry.get("prompt", ""))
+        missing = [field for field in COVERAGE_FIELDS if not entry.get(field)]
+        if missing:
+            warnings.append(f"{topic}: no {', '.join(missing)} (defaults will be used)")
+
+    for code, language in data.get("languages", {}).items():
+        if not isinstance(language, dict):
+            errors.append(f"languages.{code}: expected an object")
+            continue
+        if not language.get("name"):
+            errors.append(f"languages.{code}: missing 'name'")
+        if language.get("footer"):
+            errors += _check_template(f"languages.{code}.footer", language["footer"], FOOTER_FIELDS)
+        for topic, entry in language.get("topics", {}).items():
+            if topic not in data["topics"]:
+                errors.append(f"languages.{code}.topics: unknown topic '{topic}'")
+            elif entry.get("hashtags") and not all(isinstance(t, str) and t.startswith("#") for t in entry["hashtags"]):
+                errors.append(f"languages.{code}.{topic}: hashtags must be strings starting with '#'")
+        if code == Config.DEFAULT_LANGUAGE:
+            continue
+        for field in LANGUAGE_FIELDS:
+            if language.get("defaults", {}).get(field):
+                continue
+            untranslated = [t for t in data["topics"] if not language.get("topics", {}).get(t, {}).get(field)]
+            if untranslated:
+                warnings.append(f"languages.{code}: no '{field}' for {len(untranslated)} topics and no default "
+                                f"(the {Config.DEFAULT_LANGUAGE} text will be used)")
+    return errors, warnings
+
+class Catalog:
+    """Topic catalog loaded from JSON, validated and compiled into TopicRecords
+
+    The topic entries are written in Config.DEFAULT_LANGUAGE. An optional
+    `languages` section adds per-language hashtags, CTAs, fallbacks and
+    footer lines; `get(topic, language)` returns the record for a language.
+    """
+
+    def __init__(self, data: Dict, path: str = None):
+        errors, self.warnings = validate_catalog_data(data)
+        if errors:
+            raise CatalogError(f"Invalid catalog {path or ''}: " + "; ".join(errors))
+
+        self.path = path
+        self.system_prompt = data["system_prompt"]
+        self.post_types = tuple(data["post_types"])
+        self.topics = tuple(data["topics"])
+        max_hashtags = data.get("max_hashtags", 8)
+        base_hashtags = data["base_hashtags"]
+        suffix = data["prompt_suffix"]
+        defaults = data["defaults"]
+
+        self.language = Config.DEFAULT_LANGUAGE
+        languages = data.get("languages", {})
+        self.languages: Dict[str, str] = {self.language: languages.get(self.language, {}).get("name", self.language)}
+        self.languages.update({code: language["name"] for code, language in languages.items()})
+        # Completion tokens per language relative to the default one (scripts like Thai tokenize longer)
+        self.token_factors: Dict[str, float] = {code: languages.get(code, {}).get("token_factor", 1.0)
+                                                for code in self.languages}
+        self.company_lines: Dict[str, str] = {
+            code: languages.get(code, {}).get("footer") or self.DEFAULT_COMPANY_LINES for code in self.languages
+        }
+
+        def compile_record(topic: str, entry: Dict, language: str = None) -> TopicRecord:
+            language = language or self.language
+            translated = languages.get(language, {})
+            override = translated.get("topics", {}).get(topic, {})
+            local_defaults = translated.get("defaults", {})
+            hashtags = " ".join((base_hashtags + translated.get("hashtags", []) +
+                                 (override.get("hashtags") or entry.get("hashtags") or defaults["hashtags"]))
+                                [:max_hashtags])
+            cta = override.get("cta") or local_defaults.get("cta") or entry.get("cta") or defaults["cta"]
+            fallback = override.get("fallback") or local_defaults.get("fallback") or entry.get("fallback") or \
+                defaults["fallback"]
+            return TopicRecord(
+                topic=topic,
+                group=entry.get("group", "general"),
+                prompt_template=(entry.get("prompt") or defaults["prompt"]) + suffix,
+                hashtags=hashtags,
+                cta=cta,
+                fallback=fallback,
+                footer=self.render_footer(hashtags, cta, language),
+                has_fallback=bool(entry.get("fallback"))
+            )
+
+        self.records: Dict[str, TopicRecord] = {
+            topic: compile_record(topic, entry) for topic, entry in data["topics"].items()
+        }
+        self.default_record = compile_record("default", {})
+        self.localized: Dict[Tuple[str, str], TopicRecord] = {
+            (code, topic): compile_record(topic, entry, code)
+            for code in self.languages if code != self.language
+            for topic, entry in list(data["topics"].items()) + [("default", {})]
+        }
+
+    DEFAULT_COMPANY_LINES = "🥥 {company} - {product}\n🌍 Sustainable sourcing from {location}"
+
+    def render_footer(self, hashtags: str, cta: str, language: str = None) -> str:
+        """Hashtags, company mention and CTA appended below every post, in the given language"""
+        lines = self.company_lines.get(language or self.language, self.DEFAULT_COMPANY_LINES).format(
+            company=Config.COMPANY_NAME, product=Config.MAIN_PRODUCT, location=Config.COMPANY_LOCATION)
+        return f"{hashtags}\n\n{lines}\n\n{cta}\n{Config.WEBSITE_URL}"
+
+    def get(self, topic: str, language: str = None) -> TopicRecord:
+        """Record for a topic in a language, or the default record for unknown topics
+
+        Unknown languages get the default-language record.
+        """
+        if language and language != self.language and (language, "default") in self.localized:
+            return self.localized.get((language, topic), self.localized[(language, "default")])
+        return self.records.get(topic, self.default_record)
+
+    def coverage_report(self) -> List[str]:
+        """Human-readable lines listing topics that rely on defaults"""
+        # Topic warnings start with the topic name, language warnings with "languages."
+        topic_warnings = [w for w in self.warnings if w.split(":", 1)[0] in self.topics]
+        language_warnings = [w for w in self.warnings if w not in topic_warnings]
+        if not topic_warnings:
+            lines = [f"All {len(self.topics)} topics have prompt, hashtags, CTA and fallback coverage"]
+        else:
+            lines = [f"{len(topic_warnings)} of {len(self.topics)} topics are missing coverage:"] + \
+                    [f"  - {warning}" for warning in topic_warnings]
+        if language_warnings:
+            lines += [f"{len(language_warnings)} language warnings:"] + \
+                     [f"  - {warning}" for warning in language_warnings]
+        return lines
+
+    @classmethod
+    def load(cls, path: str = None) -> "Catalog":
+        path = path or Config.CATALOG_FILE
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CatalogError(f"Cannot read catalog {path}: {e}")
+        return cls(data, path)
+
+_loaded: Dict[str, Catalog] = {}
+
+def get_catalog(path: str = None) -> Catalog:
+    """Load a catalog once per process and reuse it"""
+    path = os.path.abspath(path or Config.CATALOG_FILE)
+    if path not in _loaded:
+        catalog = _loaded[path] = Catalog.load(path)
+        logger.info(f"Loaded catalog {path}: {len(catalog.topics)} topics")
+        for warning in catalog.warnings:
+            logger.warning(f"Catalog coverage: {warning}")
+    return _loaded[path]
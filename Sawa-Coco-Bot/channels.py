@@ -0,0 +1,83 @@
+import json
+import logging
+import os
+from typing import Dict, List
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class ChannelConfig:
+    """Per-channel posting settings: topic subset, posting hours, language, CTA overrides and spend caps"""
+
+    def __init__(self, channel_id: str, name: str = None, topics: List[str] = None,
+                 posting_hours: List[str] = None, timezone: str = None, ctas: Dict[str, str] = None,
+                 daily_budget_usd: float = None, monthly_budget_usd: float = None, language: str = None):
+        self.channel_id = str(channel_id)
+        self.name = name or self.channel_id
+        self.topics = topics or []
+        self.posting_hours = posting_hours or Config.POSTING_HOURS
+        self.timezone = timezone or Config.TIMEZONE
+        self.ctas = ctas or {}
+        self.language = language or Config.DEFAULT_LANGUAGE
+        # OpenAI spend caps for this channel; 0 means no cap
+        self.daily_budget_usd = Config.BUDGET_CHANNEL_DAILY_USD if daily_budget_usd is None else daily_budget_usd
+        self.monthly_budget_usd = Config.BUDGET_CHANNEL_MONTHLY_USD if monthly_budget_usd is None else monthly_budget_usd
+
+    def cta_for(self, topic: str):
+        """Channel CTA for a topic, or None to use the generator's default"""
+        return self.ctas.get(topic) or self.ctas.get('default')
+
+    def schedule_key(self):
+        """Channels sharing this key can share one scheduler"""
+        return (tuple(h.strip() for h in self.posting_hours), self.timezone)
+
+    def __repr__(self):
+        return f"ChannelConfig({self.channel_id!r}, topics={len(self.topics) or 'all'}, hours={self.posting_hours})"
+
+def load_channels(path: str = None, known_topics: List[str] = None,
+                  known_languages: List[str] = None) -> List[ChannelConfig]:
+    """Load channel definitions from CHANNELS_FILE, or fall back to TELEGRAM_CHANNEL_ID"""
+    path = path or Config.CHANNELS_FILE
+    if not path or not os.path.exists(path):
+        if not Config.TELEGRAM_CHANNEL_ID:
+            raise ValueError("No channels configured: set TELEGRAM_CHANNEL_ID or provide CHANNELS_FILE")
+        return [ChannelConfig(Config.TELEGRAM_CHANNEL_ID)]
+
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    channels = []
+    seen = set()
+    for entry in data.get('channels', []):
+        if 'id' not in entry:
+            raise ValueError(f"Channel entry without 'id' in {path}: {entry}")
+        channel = ChannelConfig(
+            entry['id'],
+            name=entry.get('name'),
+            topics=entry.get('topics'),
+            posting_hours=entry.get('posting_hours'),
+            timezone=entry.get('timezone'),
+            ctas=entry.get('ctas'),
+            daily_budget_usd=entry.get('daily_budget_usd'),
+            monthly_budget_usd=entry.get('monthly_budget_usd'),
+            language=entry.get('language')
+        )
+        if channel.channel_id in seen:
+            raise ValueError(f"Duplicate channel id in {path}: {channel.channel_id}")
+        seen.add(channel.channel_id)
+
+        if known_topics:
+            unknown = [t for t in channel.topics if t not in known_topics]
+            if unknown:
+                raise ValueError(f"Unknown topics for channel {channel.name}: {', '.join(unknown)}")
+        if known_languages and channel.language not in known_languages:
+            raise ValueError(f"Unknown language '{channel.language}' for channel {channel.name}; "
+                             f"add it to the catalog's languages ({', '.join(known_languages)})")
+        channels.append(channel)
+
+    if not channels:
+        raise ValueError(f"No channels defined in {path}")
+
+    logger.info(f"Loaded {len(channels)} channels from {path}")
+    return channels
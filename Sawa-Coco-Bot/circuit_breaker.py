@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over a sliding window of call outcomes
+
+    While closed every call is allowed and its outcome recorded; calls
+    slower than `slow_call_seconds` count as failures. Once at least
+    `min_calls` outcomes are in the window and the failure rate reaches
+    `failure_rate`, the breaker opens and `allow` refuses calls for
+    `open_seconds`. It then half-opens and lets `half_open_probes` calls
+    through: if they all succeed it closes, any failure re-opens it.
+    Safe to use from threads and the event loop.
+    """
+
+    def __init__(self, name: str, failure_rate: float = None, window: int = None, min_calls: int = None,
+                 slow_call_seconds: float = None, open_seconds: float = None, half_open_probes: int = None):
+        self.name = name
+        self.failure_rate = failure_rate or Config.CIRCUIT_FAILURE_RATE
+        self.min_calls = min_calls or Config.CIRCUIT_MIN_CALLS
+        self.slow_call_seconds = slow_call_seconds or Config.CIRCUIT_SLOW_CALL_SECONDS
+        self.open_seconds = open_seconds or Config.CIRCUIT_OPEN_SECONDS
+        self.half_open_probes = half_open_probes or Config.CIRCUIT_HALF_OPEN_PROBES
+        self.outcomes = deque(maxlen=window or Config.CIRCUIT_WINDOW)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+        metrics.CIRCUIT_STATE.set(STATE_VALUES[CLOSED], name=name)
+
+    def _transition(self, state: str, reason: str = ""):
+        previous, self.state = self.state, state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        if state in (HALF_OPEN, OPEN):
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        if state == CLOSED:
+            self.outcomes.clear()
+        metrics.CIRCUIT_STATE.set(STATE_VALUES[state], name=self.name)
+        metrics.CIRCUIT_TRANSITIONS.inc(name=self.name, state=state)
+        log = logger.warning if state == OPEN else logger.info
+        log(f"Circuit {self.name}: {previous} -> {state}{f' ({reason})' if reason else ''}")
+
+    def is_open(self) -> bool:
+        """True while calls are being refused outright"""
+        with self._lock:
+            return self.state == OPEN and time.monotonic() - self.opened_at < self.open_seconds
+
+    def allow(self) -> bool:
+        """Whether a call may go out now; a refused call should fail fast"""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    metrics.CIRCUIT_REJECTED.inc(name=self.name)
+                    return False
+                self._transition(HALF_OPEN, f"after {self.open_seconds:.0f}s")
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    metrics.CIRCUIT_REJECTED.inc(name=self.name)
+                    return False
+                self._probes_in_flight += 1
+            return True
+
+    def record_success(self, duration: float = 0.0):
+        """Record a completed call; slow calls count as failures"""
+        if duration > self.slow_call_seconds:
+            self.record_failure(f"slow call {duration:.1f}s")
+            return
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self._transition(CLOSED, "probes succeeded")
+            elif self.state == CLOSED:
+                self.outcomes.append(True)
+
+    def record_failure(self, reason: str = "error"):
+        """Record a failed call, opening the circuit if the failure rate is too high"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._transition(OPEN, f"probe failed: {reason}")
+            elif self.state == CLOSED:
+                self.outcomes.append(False)
+                failures = self.outcomes.count(False)
+                if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.failure_rate:
+                    self._transition(OPEN, f"{failures}/{len(self.outcomes)} recent calls failed, last: {reason}")
+
+    def release(self):
+        """Give back a half-open probe slot for a call that ended without an outcome (e.g. cancelled)"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,9 +8,43 @@ class Config:
     # Telegram Configuration
     TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
     TELEGRAM_CHANNEL_ID = os.getenv('TELEGRAM_CHANNEL_ID')
+    CHANNELS_FILE = os.getenv('CHANNELS_FILE', 'channels.json')
+    TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL', 'https://api.telegram.org/bot')
+    TELEGRAM_MAX_CONNECTIONS = int(os.getenv('TELEGRAM_MAX_CONNECTIONS', '8'))
+    # lazy: trust the identity cache and check uncached channels on their first send; eager: check all at startup
+    STARTUP_CHECK = os.getenv('STARTUP_CHECK', 'lazy')
+    IDENTITY_CACHE_TTL_HOURS = float(os.getenv('IDENTITY_CACHE_TTL_HOURS', '24'))
     
     # OpenAI Configuration
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+    OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')
+    OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-3.5-turbo')
+    OPENAI_FALLBACK_MODELS = [m.strip() for m in os.getenv('OPENAI_FALLBACK_MODELS', '').split(',') if m.strip()]
+    PROVIDERS_FILE = os.getenv('PROVIDERS_FILE', 'providers.json')
+    OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '30'))
+    OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '10'))
+    GENERATION_CONCURRENCY = int(os.getenv('GENERATION_CONCURRENCY', '4'))
+    OPENAI_STREAMING = os.getenv('OPENAI_STREAMING', 'false').lower() == 'true'
+    STREAM_MAX_WORDS = int(os.getenv('STREAM_MAX_WORDS', '250'))
+    FOOTER_RESERVE = int(os.getenv('FOOTER_RESERVE', '120'))
+    OPENAI_PROMPT_PRICE_PER_1K = float(os.getenv('OPENAI_PROMPT_PRICE_PER_1K', '0.0005'))
+    OPENAI_COMPLETION_PRICE_PER_1K = float(os.getenv('OPENAI_COMPLETION_PRICE_PER_1K', '0.0015'))
+    
+    # Hedged requests (second request after the target's p95 latency, capped share of requests)
+    HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', 'true').lower() == 'true'
+    HEDGE_QUANTILE = float(os.getenv('HEDGE_QUANTILE', '0.95'))
+    HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', '1'))
+    HEDGE_MAX_DELAY = float(os.getenv('HEDGE_MAX_DELAY', '10'))
+    HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '20'))
+    HEDGE_MAX_RATIO = float(os.getenv('HEDGE_MAX_RATIO', '0.1'))
+    
+    # Circuit breaker around OpenAI (fail fast to fallback content during outages)
+    CIRCUIT_FAILURE_RATE = float(os.getenv('CIRCUIT_FAILURE_RATE', '0.5'))
+    CIRCUIT_WINDOW = int(os.getenv('CIRCUIT_WINDOW', '20'))
+    CIRCUIT_MIN_CALLS = int(os.getenv('CIRCUIT_MIN_CALLS', '5'))
+    CIRCUIT_SLOW_CALL_SECONDS = float(os.getenv('CIRCUIT_SLOW_CALL_SECONDS', '15'))
+    CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', '60'))
+    CIRCUIT_HALF_OPEN_PROBES = int(os.getenv('CIRCUIT_HALF_OPEN_PROBES', '2'))
     
     # Company Information
     COMPANY_NAME = os.getenv('COMPANY_NAME', 'Sawa Coco')
@@ -21,10 +56,108 @@ class Config:
     # Posting Configuration
     POSTING_HOURS = os.getenv('POSTING_HOURS', '10:15,17:30').split(',')
     TIMEZONE = os.getenv('TIMEZONE', 'UTC')
+    CATCHUP_POLICY = os.getenv('CATCHUP_POLICY', 'latest')
+    CATCHUP_WINDOW_MINUTES = float(os.getenv('CATCHUP_WINDOW_MINUTES', '60'))
+    SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '30'))
     POSTS_PER_DAY = int(os.getenv('POSTS_PER_DAY', '4'))
     
     # Content Settings
     CONTENT_VARIETY = os.getenv('CONTENT_VARIETY', 'high')
+    CATALOG_FILE = os.getenv('CATALOG_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'catalog.json'))
+    # Language the catalog topics are written in and channels post in unless channels.json says otherwise
+    DEFAULT_LANGUAGE = os.getenv('DEFAULT_LANGUAGE', 'en')
+    
+    # Content Queue (pre-generated posts per channel)
+    DATA_DIR = os.getenv('DATA_DIR', 'data')
+    # Queue, retry queue and scheduler state belong to one replica; replicas sharing DATA_DIR keep them apart.
+    # Named like the replica id minus its pid so a restart finds its state; a lock stops two live processes sharing it
+    REPLICA_DATA_DIR = os.getenv('REPLICA_DATA_DIR', os.path.join(
+        DATA_DIR, 'replicas', os.getenv('REPLICA_ID') or os.getenv('RAILWAY_REPLICA_ID') or socket.gethostname()))
+    CONTENT_QUEUE_FILE = os.getenv('CONTENT_QUEUE_FILE', os.path.join(REPLICA_DATA_DIR, 'content_queue.json'))
+    QUEUE_LOW_WATERMARK = int(os.getenv('QUEUE_LOW_WATERMARK', '2'))
+    QUEUE_HIGH_WATERMARK = int(os.getenv('QUEUE_HIGH_WATERMARK', '6'))
+    QUEUE_REFILL_QUIET_MINUTES = int(os.getenv('QUEUE_REFILL_QUIET_MINUTES', '10'))
+    QUEUE_CHECK_INTERVAL = int(os.getenv('QUEUE_CHECK_INTERVAL', '900'))
+    SCHEDULER_STATE_FILE = os.getenv('SCHEDULER_STATE_FILE', os.path.join(REPLICA_DATA_DIR, 'scheduler_state.json'))
+    # Seconds content queue, retry queue and scheduler state changes are batched before being written to disk
+    STATE_SAVE_DELAY = float(os.getenv('STATE_SAVE_DELAY', '2'))
+    IDENTITY_CACHE_FILE = os.getenv('IDENTITY_CACHE_FILE', os.path.join(DATA_DIR, 'bot_identity.json'))
+    
+    # Post Store (completion cache + near-duplicate detection)
+    POST_STORE_FILE = os.getenv('POST_STORE_FILE', os.path.join(DATA_DIR, 'posts.sqlite3'))
+    POST_STORE_TTL_HOURS = float(os.getenv('POST_STORE_TTL_HOURS', '72'))
+    POST_STORE_MAX_ENTRIES = int(os.getenv('POST_STORE_MAX_ENTRIES', '5000'))
+    DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', '0.6'))
+    DEDUP_WINDOW = int(os.getenv('DEDUP_WINDOW', '200'))
+    DEDUP_MAX_RETRIES = int(os.getenv('DEDUP_MAX_RETRIES', '2'))
+    
+    # Batch API (bulk offline generation)
+    BATCH_DIR = os.getenv('BATCH_DIR', os.path.join(DATA_DIR, 'batches'))
+    BATCH_POLL_INTERVAL = float(os.getenv('BATCH_POLL_INTERVAL', '60'))
+    
+    # Token budget (USD caps per UTC day/month; 0 means no cap; channels.json can override the channel caps)
+    BUDGET_LEDGER_FILE = os.getenv('BUDGET_LEDGER_FILE', os.path.join(DATA_DIR, 'spend.sqlite3'))
+    BUDGET_DAILY_USD = float(os.getenv('BUDGET_DAILY_USD', '0'))
+    BUDGET_MONTHLY_USD = float(os.getenv('BUDGET_MONTHLY_USD', '0'))
+    BUDGET_CHANNEL_DAILY_USD = float(os.getenv('BUDGET_CHANNEL_DAILY_USD', '0'))
+    BUDGET_CHANNEL_MONTHLY_USD = float(os.getenv('BUDGET_CHANNEL_MONTHLY_USD', '0'))
+    BUDGET_MIN_COMPLETION_TOKENS = int(os.getenv('BUDGET_MIN_COMPLETION_TOKENS', '150'))
+    
+    # Telegram Delivery (rate limits, retries)
+    TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '30'))
+    TELEGRAM_CHAT_RATE_PER_MINUTE = float(os.getenv('TELEGRAM_CHAT_RATE_PER_MINUTE', '20'))
+    TELEGRAM_CHAT_BURST = float(os.getenv('TELEGRAM_CHAT_BURST', '3'))
+    SEND_MAX_ATTEMPTS = int(os.getenv('SEND_MAX_ATTEMPTS', '5'))
+    SEND_BACKOFF_BASE = float(os.getenv('SEND_BACKOFF_BASE', '1'))
+    SEND_BACKOFF_MAX = float(os.getenv('SEND_BACKOFF_MAX', '60'))
+    RETRY_QUEUE_FILE = os.getenv('RETRY_QUEUE_FILE', os.path.join(REPLICA_DATA_DIR, 'retry_queue.json'))
+    RETRY_QUEUE_INTERVAL = int(os.getenv('RETRY_QUEUE_INTERVAL', '300'))
+    RETRY_QUEUE_MAX_AGE_HOURS = float(os.getenv('RETRY_QUEUE_MAX_AGE_HOURS', '12'))
+    
+    # Media posts (images from MEDIA_SOURCE_DIR/<topic>/, prepared by `python media_library.py ingest`)
+    MEDIA_SOURCE_DIR = os.getenv('MEDIA_SOURCE_DIR', 'media')
+    MEDIA_DIR = os.getenv('MEDIA_DIR', os.path.join(DATA_DIR, 'media'))
+    MEDIA_INDEX_FILE = os.getenv('MEDIA_INDEX_FILE', os.path.join(DATA_DIR, 'media_index.json'))
+    MEDIA_MAX_SIDE = int(os.getenv('MEDIA_MAX_SIDE', '1280'))
+    MEDIA_JPEG_QUALITY = int(os.getenv('MEDIA_JPEG_QUALITY', '85'))
+    MEDIA_PER_POST = int(os.getenv('MEDIA_PER_POST', '1'))
+    
+    # Replicas (slot leases so each post goes out once; channels sharded across live replicas)
+    LEASE_STORE_URL = os.getenv('LEASE_STORE_URL', '')
+    LEASE_STORE_FILE = os.getenv('LEASE_STORE_FILE', os.path.join(DATA_DIR, 'leases.sqlite3'))
+    REPLICA_ID = os.getenv('REPLICA_ID', '')
+    POST_LEASE_SECONDS = float(os.getenv('POST_LEASE_SECONDS', '600'))
+    STANDBY_DELAY_SECONDS = float(os.getenv('STANDBY_DELAY_SECONDS', '30'))
+    REPLICA_HEARTBEAT_SECONDS = float(os.getenv('REPLICA_HEARTBEAT_SECONDS', '15'))
+    
+    # Admin commands over a Telegram webhook (/post, /queue, /skip, /stats); port 0 disables the server
+    # Loopback for use behind a reverse proxy; 0.0.0.0 when Telegram reaches the bot directly
+    WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+    WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '0'))
+    WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+    # Public HTTPS URL of WEBHOOK_PATH; registered with Telegram on startup when set
+    WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+    # Required: 1-256 of A-Z, a-z, 0-9, _ and -; Telegram sends it with every update
+    WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN', '')
+    WEBHOOK_CONCURRENCY = int(os.getenv('WEBHOOK_CONCURRENCY', '4'))
+    WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', '100'))
+    WEBHOOK_DEDUP_SIZE = int(os.getenv('WEBHOOK_DEDUP_SIZE', '1000'))
+    # Telegram user ids allowed to run admin commands; nobody when empty
+    ADMIN_USER_IDS = [int(u) for u in os.getenv('ADMIN_USER_IDS', '').split(',') if u.strip()]
+    
+    # Logging (written by a background thread; LOG_FILE='' logs to the console only)
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+    LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '7'))
+    LOG_COMPRESS = os.getenv('LOG_COMPRESS', 'true').lower() == 'true'
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+    
+    # Metrics (Prometheus text format; port 0 disables the endpoint)
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
     
     @classmethod
     def validate_config(cls):
@@ -35,6 +168,10 @@ class Config:
             'OPENAI_API_KEY'
         ]
         
+        # A channels file replaces the single TELEGRAM_CHANNEL_ID
+        if cls.CHANNELS_FILE and os.path.exists(cls.CHANNELS_FILE):
+            required_vars.remove('TELEGRAM_CHANNEL_ID')
+        
         missing_vars = []
         for var in required_vars:
             if not getattr(cls, var):
@@ -1,238 +1,585 @@
-import openai
+import asyncio
+import logging
 import random
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
 from typing import List, Dict
+import metrics
+from catalog import Catalog, get_catalog
 from config import Config
+from model_router import ModelRouter, NoProviderAvailable
+from post_store import PostStore, prompt_hash
+from stream_guard import TELEGRAM_MESSAGE_LIMIT, StreamGuard, StreamRejected, telegram_length
+from token_budget import BudgetHold, TokenBudget, max_tokens_for
+
+logger = logging.getLogger(__name__)
+
+# Completion tokens per language for its JSON key, quotes and escapes in a localized reply
+LOCALIZED_KEY_TOKENS = 8
 
 class ContentGenerator:
-    def __init__(self):
-        openai.api_key = Config.OPENAI_API_KEY
+    def __init__(self, post_store: PostStore = None, catalog: Catalog = None, router: ModelRouter = None,
+                 budget: TokenBudget = None):
+        # Providers, per-topic models and fallback chains; the default target also serves the Batch API
+        self.router = router or ModelRouter.load()
+        self.model = self.router.default_target.model
+        self.concurrency = Config.GENERATION_CONCURRENCY
+        self.post_store = post_store or PostStore()
+        self.budget = budget or TokenBudget()
+        self.dedup_retries = Config.DEDUP_MAX_RETRIES
+        self.streaming = Config.OPENAI_STREAMING
         self.company_name = Config.COMPANY_NAME
         self.main_product = Config.MAIN_PRODUCT
         self.website_url = Config.WEBSITE_URL
         self.company_location = Config.COMPANY_LOCATION
         self.company_focus = Config.COMPANY_FOCUS
         
-        # Content templates and topics for Sawa Coco products
-        self.content_topics = [
-            # MCT Oil & Powder topics
-            "health_benefits",
-            "usage_tips",
-            "science_facts",
-            "recipes",
-            "fitness_performance",
-            "weight_management",
-            "brain_health",
-            "energy_boost",
-            "ketogenic_diet",
-            "product_features",
-            # Charcoal topics
-            "charcoal_benefits",
-            "charcoal_applications",
-            "charcoal_quality",
-            "bbq_grilling",
-            "shisha_hookah",
-            "industrial_uses",
-            # General topics
-            "sustainability",
-            "palm_free_benefits",
-            "coconut_sourcing",
-            "b2b_applications",
-            "clean_farming",
-            "zero_waste"
-        ]
-        
-        self.post_types = [
-            "educational",
-            "testimonial",
-            "tip",
-            "fact",
-            "recipe",
-            "motivation",
-            "comparison",
-            "how_to"
-        ]
-
-    def generate_post_content(self, topic: str = None, post_type: str = None) -> Dict[str, str]:
-        """Generate a single post about MCT Oil"""
-        if not topic:
-            topic = random.choice(self.content_topics)
-        if not post_type:
-            post_type = random.choice(self.post_types)
-        
+        # Topics, prompts, hashtags, CTAs and fallbacks come from the compiled catalog
+        self.catalog = catalog or get_catalog()
+        self.system_prompt = self.catalog.system_prompt
+        self.content_topics = list(self.catalog.topics)
+        self.post_types = list(self.catalog.post_types)
+
+    def generate_post_content(self, topic: str = None, post_type: str = None,
+                              channel_id: str = None, charge_to: List[str] = None) -> Dict[str, str]:
+        """Generate a single post about MCT Oil
+
+        Spend is charged to `charge_to` (default: `channel_id`).
+        """
+        topic, post_type = self._pick_topic_and_type(topic, post_type)
+        charge_to = self._charge_to(channel_id, charge_to)
         prompt = self._create_prompt(topic, post_type)
+        request = self._completion_kwargs(prompt, topic)
+        key_hash = prompt_hash(request)
         
+        cached = self._get_cached(topic, post_type, key_hash, channel_id)
+        if cached:
+            return cached
+        
+        started = time.perf_counter()
+        chain = self._route(topic)
+        if self.router.unavailable(chain):
+            return self._finish(self._get_fallback_content(topic, post_type, reason="circuit_open"), started)
         try:
-            response = openai.ChatCompletion.create(
-                model="gpt-3.5-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a health and wellness content creator specializing in MCT Oil products. Create engaging, informative social media posts."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=300,
-                temperature=0.7
-            )
-            
-            content = response.choices[0].message.content.strip()
-            
-            # Add hashtags and company mention with CTA
-            hashtags = self._generate_hashtags(topic)
-            cta = self._get_call_to_action(topic)
-            final_content = f"{content}\n\n{hashtags}\n\n🥥 {self.company_name} - {self.main_product}\n🌍 Sustainable sourcing from {self.company_location}\n\n{cta}\n{self.website_url}"
-            
-            return {
-                "content": final_content,
-                "topic": topic,
-                "post_type": post_type,
-                "hashtags": hashtags
-            }
+            for attempt in range(self.dedup_retries + 1):
+                hold = self.budget.reserve(charge_to, topic, self._retry_request(request, attempt))
+                if hold is None:
+                    return self._over_budget(topic, post_type, started, channel_id, charge_to)
+                try:
+                    response, _ = self.router.complete(hold.request, chain)
+                    self._record_usage(response.usage, hold)
+                finally:
+                    hold.release()
+                content = self._validate_content(response.choices[0].message.content, topic)
+                if self._accept_content(content, topic, attempt):
+                    post = self._store_post(self._assemble_post(content, topic, post_type), key_hash, channel_id)
+                    return self._finish(post, started, response.usage)
+            return self._finish(self._get_fallback_content(topic, post_type, reason="duplicate"), started)
             
         except Exception as e:
             # Fallback content if API fails
-            return self._get_fallback_content(topic, post_type)
+            logger.warning(f"Generation failed for {topic}/{post_type}, using fallback: {e}")
+            return self._finish(self._get_fallback_content(topic, post_type, reason=self._fallback_reason(e)), started)
 
-    def _create_prompt(self, topic: str, post_type: str) -> str:
-        """Create a prompt for content generation"""
-        prompts = {
-            "health_benefits": f"Write a {post_type} post about the health benefits of premium coconut-based MCT Oil. Focus on scientific benefits and practical applications.",
-            "usage_tips": f"Create a {post_type} post with practical tips on how to use MCT Oil effectively in daily routine for optimal results.",
-            "science_facts": f"Write a {post_type} post sharing interesting scientific facts about MCT Oil and medium-chain triglycerides from coconut sources.",
-            "recipes": f"Create a {post_type} post featuring a simple recipe that incorporates premium MCT Oil or MCT powder.",
-            "fitness_performance": f"Write a {post_type} post about how coconut-based MCT Oil can enhance athletic performance and workout results.",
-            "weight_management": f"Create a {post_type} post about MCT Oil's role in healthy weight management and metabolism support.",
-            "brain_health": f"Write a {post_type} post about MCT Oil's cognitive benefits and brain health support from pure coconut sources.",
-            "energy_boost": f"Create a {post_type} post about how premium MCT Oil provides clean, sustained energy throughout the day.",
-            "ketogenic_diet": f"Write a {post_type} post about MCT Oil's importance in ketogenic and low-carb diets, focusing on C8/C10 benefits.",
-            "product_features": f"Create a {post_type} post highlighting the quality and features of Sawa Coco's premium MCT Oil products (60/40 blend and C8/98).",
-            # Charcoal content prompts
-            "charcoal_benefits": f"Write a {post_type} post about the benefits of premium coconut shell charcoal over regular charcoal - clean burn, minimal ash, long-lasting.",
-            "charcoal_applications": f"Create a {post_type} post about the various applications of coconut shell charcoal: shisha, BBQ, industrial uses.",
-            "charcoal_quality": f"Write a {post_type} post about Sawa Coco's high-grade coconut shell charcoal quality standards and production process in Thailand.",
-            "bbq_grilling": f"Create a {post_type} post about using coconut shell charcoal for BBQ and grilling - superior heat, clean taste, eco-friendly.",
-            "shisha_hookah": f"Write a {post_type} post about premium coconut shell charcoal for shisha/hookah - minimal smoke, long burn time, pure flavor.",
-            "industrial_uses": f"Create a {post_type} post about industrial applications of coconut shell charcoal and its export quality standards.",
-            # General topics
-            "sustainability": f"Write a {post_type} post about sustainable coconut sourcing and environmental responsibility across all Sawa Coco products.",
-            "palm_free_benefits": f"Create a {post_type} post about the benefits of 100% palm-free production and why coconut-based is superior.",
-            "coconut_sourcing": f"Write a {post_type} post about single-origin coconut sourcing from Thailand and clean farming practices.",
-            "b2b_applications": f"Create a {post_type} post about Sawa Coco's B2B applications for food brands, supplement manufacturers, and industrial clients.",
-            "clean_farming": f"Write a {post_type} post about chemical-free, pesticide-free coconut farming and its impact on product purity.",
-            "zero_waste": f"Write a {post_type} post about Sawa Coco's zero-waste approach - using coconuts for MCT oil AND shells for premium charcoal."
-        }
-        
-        base_prompt = prompts.get(topic, f"Write a {post_type} post about premium coconut-based MCT Oil.")
-        return f"{base_prompt} Keep it engaging, informative, and under 250 words. Include emojis where appropriate. Mention that this is from Thailand's sustainable coconut farms when relevant."
+    async def agenerate_post_content(self, topic: str = None, post_type: str = None,
+                                     timeout: float = None, channel_id: str = None,
+                                     stream: bool = None, charge_to: List[str] = None) -> Dict[str, str]:
+        """Generate a single post without blocking the event loop
 
-    def _generate_hashtags(self, topic: str) -> str:
-        """Generate relevant hashtags for the post"""
-        base_hashtags = ["#MCTOil", "#SawaCoco", "#CoconutBased", "#Thailand"]
-        
-        topic_hashtags = {
-            "health_benefits": ["#HealthBenefits", "#NaturalHealth", "#Wellness"],
-            "usage_tips": ["#HealthTips", "#WellnessTips", "#MCTTips"],
-            "science_facts": ["#HealthScience", "#MCTScience", "#Nutrition"],
-            "recipes": ["#HealthyRecipes", "#MCTRecipes", "#Cooking"],
-            "fitness_performance": ["#Fitness", "#Performance", "#WorkoutFuel"],
-            "weight_management": ["#WeightLoss", "#Metabolism", "#HealthyWeight"],
-            "brain_health": ["#BrainHealth", "#Cognitive", "#MentalWellness"],
-            "energy_boost": ["#Energy", "#NaturalEnergy", "#CleanEnergy"],
-            "ketogenic_diet": ["#Keto", "#KetogenicDiet", "#LowCarb"],
-            "product_features": ["#PremiumMCT", "#QualityProducts", "#C8C10"],
-            "sustainability": ["#Sustainable", "#EcoFriendly", "#ResponsibleSourcing"],
-            "palm_free_benefits": ["#PalmFree", "#CoconutOnly", "#CleanProducts"],
-            "coconut_sourcing": ["#SingleOrigin", "#ThailandCoconuts", "#QualitySourcing"],
-            "b2b_applications": ["#B2B", "#BulkSupplier", "#FoodIndustry"],
-            "clean_farming": ["#CleanFarming", "#NoPesticides", "#OrganicFarming"],
-            # Charcoal hashtags
-            "charcoal_benefits": ["#CoconutCharcoal", "#PremiumCharcoal", "#CleanBurn"],
-            "charcoal_applications": ["#Charcoal", "#BBQ", "#Shisha"],
-            "charcoal_quality": ["#HighGrade", "#QualityControl", "#ExportQuality"],
-            "bbq_grilling": ["#BBQ", "#Grilling", "#EcoFriendly"],
-            "shisha_hookah": ["#Shisha", "#Hookah", "#MinimalSmoke"],
-            "industrial_uses": ["#Industrial", "#Export", "#B2BCharcoal"],
-            "zero_waste": ["#ZeroWaste", "#Sustainable", "#CircularEconomy"]
-        }
+        Cancelling the awaiting task aborts the in-flight HTTP request. With
+        `stream` the completion is validated as tokens arrive and cut off
+        as soon as it is complete, too long or off-policy. Spend is charged
+        to `charge_to` (default: `channel_id`).
+        """
+        stream = self.streaming if stream is None else stream
+        topic, post_type = self._pick_topic_and_type(topic, post_type)
+        charge_to = self._charge_to(channel_id, charge_to)
+        prompt = self._create_prompt(topic, post_type)
+        request = self._completion_kwargs(prompt, topic)
+        key_hash = prompt_hash(request)
         
-        specific_hashtags = topic_hashtags.get(topic, ["#Health"])
-        all_hashtags = base_hashtags + specific_hashtags
+        # The store is SQLite; keep its reads and writes off the event loop
+        cached = await asyncio.to_thread(self._get_cached, topic, post_type, key_hash, channel_id)
+        if cached:
+            return cached
         
-        return " ".join(all_hashtags[:8])  # Limit to 8 hashtags
-
-    def _get_call_to_action(self, topic: str) -> str:
-        """Generate topic-specific call-to-action"""
-        cta_options = {
-            # MCT Oil CTAs
-            "health_benefits": "💪 Ready to boost your energy? Contact us for bulk MCT oil pricing!",
-            "usage_tips": "☕ Want to try premium MCT oil? Get wholesale rates for your business!",
-            "science_facts": "🧠 Interested in our C8/98 ultra-pure MCT oil? Request samples today!",
-            "recipes": "👨‍🍳 Perfect for food brands! Get bulk MCT oil & powder pricing!",
-            "fitness_performance": "🏋️ Fuel your customers' performance! Wholesale MCT oil available!",
-            "weight_management": "⚖️ Help your clients succeed! Partner with us for premium MCT products!",
-            "brain_health": "🧠 Boost your product line! Contact us for MCT oil & powder solutions!",
-            "energy_boost": "⚡ Power up your brand! Get competitive bulk MCT oil rates!",
-            "ketogenic_diet": "🥑 Perfect for keto brands! Wholesale C8/C10 & C8/98 MCT oils available!",
-            "product_features": "✨ Ready to source premium MCT products? Contact our B2B team!",
-            
-            # Charcoal CTAs  
-            "charcoal_benefits": "🔥 Upgrade your charcoal supply! Export-quality coconut shell charcoal available!",
-            "charcoal_applications": "🍖 Perfect for your business! Bulk coconut shell charcoal - contact us!",
-            "charcoal_quality": "🏆 Need premium charcoal? Get Thailand export-quality pricing today!",
-            "bbq_grilling": "🔥 Stock the best! Wholesale coconut shell charcoal for retailers!",
-            "shisha_hookah": "💨 Premium shisha charcoal supplier! Contact us for bulk orders!",
-            "industrial_uses": "🏭 Industrial charcoal needs? We supply export-quality coconut shell charcoal!",
+        started = time.perf_counter()
+        chain = self._route(topic)
+        if self.router.unavailable(chain):
+            return self._finish(self._get_fallback_content(topic, post_type, reason="circuit_open"), started)
+        try:
+            for attempt in range(self.dedup_retries + 1):
+                hold = self.budget.reserve(charge_to, topic, self._retry_request(request, attempt))
+                if hold is None:
+                    return await asyncio.to_thread(self._over_budget, topic, post_type, started, channel_id,
+                                                   charge_to)
+                try:
+                    if stream:
+                        content, usage = await self._astream_content(hold.request, topic, chain, timeout, hold)
+                    else:
+                        response, _ = await self.router.acomplete(hold.request, chain, timeout)
+                        usage = response.usage
+                        self._record_usage(usage, hold)
+                finally:
+                    hold.release()
+                if not stream:
+                    content = self._validate_content(response.choices[0].message.content, topic)
+                if self._accept_content(content, topic, attempt):
+                    post = await asyncio.to_thread(self._store_post, self._assemble_post(content, topic, post_type),
+                                                   key_hash, channel_id)
+                    return self._finish(post, started, usage)
+            return self._finish(self._get_fallback_content(topic, post_type, reason="duplicate"), started)
             
-            # General CTAs
-            "sustainability": "🌱 Partner with sustainable suppliers! Contact Sawa Coco B2B team!",
-            "palm_free_benefits": "🌿 Go palm-free! Source 100% coconut-based products with us!",
-            "coconut_sourcing": "🥥 Direct from Thailand farms! Get premium coconut product pricing!",
-            "b2b_applications": "🤝 Ready to partner? Contact our B2B team for custom solutions!",
-            "clean_farming": "🌾 Clean products for clean brands! Get wholesale pricing today!",
-            "zero_waste": "♻️ Complete coconut solutions! MCT oils + charcoal - contact us!"
-        }
-        
-        return cta_options.get(topic, "🌟 Discover premium coconut products! Contact us for B2B pricing!")
+        except Exception as e:
+            # Fallback content if API fails
+            logger.warning(f"Generation failed for {topic}/{post_type}, using fallback: {e}")
+            return self._finish(self._get_fallback_content(topic, post_type, reason=self._fallback_reason(e)), started)
 
-    def _get_fallback_content(self, topic: str, post_type: str) -> Dict[str, str]:
-        """Fallback content when API is unavailable"""
-        fallback_posts = {
-            "health_benefits": "🥥 Premium coconut-based MCT Oil from Thailand delivers rapid energy and metabolism support! Our sustainable sourcing ensures pure, clean nutrition for your wellness journey. ⚡",
-            "usage_tips": "💡 Pro tip: Start with 1 tsp of our premium MCT Oil in coffee or smoothies. Our 60/40 C8/C10 blend provides optimal absorption and sustained energy! ☕",
-            "science_facts": "🧠 Science fact: Our C8/98 MCT Oil converts directly to ketones, bypassing normal digestion for immediate brain fuel! Pure coconut sourcing from Thailand's clean farms. 🔬",
-            "sustainability": "🌍 100% palm-free, sustainably sourced from single-origin Thai coconut farms. Zero chemicals, zero pesticides - just pure, responsible products! 🥥",
-            "product_features": "✨ Sawa Coco offers premium MCT oils: 60/40 blend for versatility, C8/98 for performance. Plus MCT powder for easy mixing! All from Thailand's finest coconuts. 🏆",
-            "charcoal_benefits": "🔥 Premium coconut shell charcoal burns cleaner, longer, and produces minimal ash compared to regular charcoal. Perfect for BBQ, shisha, and industrial use! 🥥",
-            "bbq_grilling": "🍖 Elevate your BBQ game with coconut shell charcoal! Superior heat retention, clean taste, and eco-friendly. Made from Thailand's finest coconut shells. 🔥",
-            "shisha_hookah": "💨 Premium coconut shell charcoal for the perfect shisha experience - minimal smoke, long burn time, pure flavor. Export quality from Thailand! 🥥",
-            "zero_waste": "♻️ From coconut to MCT oil to premium charcoal - Sawa Coco's zero-waste approach maximizes every part of Thailand's sustainable coconuts! 🌱"
+    async def agenerate_localized(self, topic: str = None, post_type: str = None, languages: List[str] = None,
+                                  timeout: float = None, channel_id: str = None,
+                                  charge_to: List[str] = None) -> Dict[str, Dict[str, str]]:
+        """Generate one post in several languages with a single completion; returns {language: post}
+
+        The model answers with a JSON object keyed by language code. Each
+        variant is validated, deduplicated and stored on its own, with the
+        language's hashtags, CTA and footer. Variants that are missing or
+        rejected are asked for again (only those), and fall back to the
+        language's canned text once retries run out.
+        """
+        topic, post_type = self._pick_topic_and_type(topic, post_type)
+        languages = list(dict.fromkeys(languages or [self.catalog.language]))
+        charge_to = self._charge_to(channel_id, charge_to)
+        # Keyed by the single-language request so a variant is found whatever fan-out produced it
+        hashes = {language: prompt_hash(self._localized_request(topic, post_type, [language]))
+                  for language in languages}
+        posts = {}
+        for language in languages:
+            cached = await asyncio.to_thread(self._get_cached, topic, post_type, hashes[language], channel_id)
+            if cached:
+                posts[language] = cached
+        missing = [language for language in languages if language not in posts]
+        if not missing:
+            return posts
+
+        started = time.perf_counter()
+        chain = self._route(topic)
+        if self.router.unavailable(chain):
+            self._fallback_variants(posts, missing, topic, post_type, dict.fromkeys(missing, "circuit_open"), started)
+            return {language: posts[language] for language in languages}
+        reasons = dict.fromkeys(missing, "duplicate")
+        try:
+            for attempt in range(self.dedup_retries + 1):
+                request = self._localized_request(topic, post_type, missing)
+                hold = self.budget.reserve(charge_to, topic, self._retry_request(request, attempt))
+                if hold is None:
+                    for language in missing:
+                        posts[language] = await asyncio.to_thread(self._over_budget, topic, post_type, started,
+                                                                  channel_id, charge_to, language)
+                    break
+                try:
+                    response, _ = await self.router.acomplete(hold.request, chain, timeout)
+                    usage = response.usage
+                    self._record_usage(usage, hold)
+                finally:
+                    hold.release()
+                variants = self._parse_variants(response.choices[0].message.content, topic)
+                for language in list(missing):
+                    try:
+                        content = self._validate_content(variants.get(language, ""), topic, language)
+                    except StreamRejected as e:
+                        logger.warning(f"Rejected {language} variant of {topic} post: {e}")
+                        reasons[language] = "rejected"
+                        continue
+                    if not self._accept_content(content, topic, attempt):
+                        reasons[language] = "duplicate"
+                        continue
+                    post = self._assemble_post(content, topic, post_type, language=language)
+                    post = await asyncio.to_thread(self._store_post, post, hashes[language], channel_id)
+                    posts[language] = self._finish(post, started, usage)
+                    missing.remove(language)
+                if not missing:
+                    break
+            self._fallback_variants(posts, missing, topic, post_type, reasons, started)
+
+        except Exception as e:
+            logger.warning(f"Localized generation failed for {topic}/{post_type}, using fallback: {e}")
+            reasons = dict.fromkeys(missing, self._fallback_reason(e))
+            self._fallback_variants(posts, missing, topic, post_type, reasons, started)
+        return {language: posts[language] for language in languages}
+
+    def _fallback_variants(self, posts: Dict, languages: List[str], topic: str, post_type: str,
+                           reasons: Dict[str, str], started: float):
+        """Fill the languages that have no post yet with their fallback text"""
+        for language in languages:
+            if language not in posts:
+                posts[language] = self._finish(
+                    self._get_fallback_content(topic, post_type, reason=reasons[language], language=language), started
+                )
+
+    @staticmethod
+    def _parse_variants(content: str, topic: str) -> Dict[str, str]:
+        """Language variants from a JSON reply; empty if it is not a JSON object"""
+        try:
+            variants = json.loads(content or "")
+        except ValueError:
+            variants = None
+        if not isinstance(variants, dict):
+            metrics.CONTENT_REJECTED.inc(reason="validation")
+            logger.warning(f"Localized {topic} reply is not a JSON object: {(content or '')[:80]!r}")
+            return {}
+        return {language: text for language, text in variants.items() if isinstance(text, str)}
+
+    @staticmethod
+    def _charge_to(channel_id: str = None, charge_to: List[str] = None) -> List[str]:
+        if charge_to is not None:
+            return list(charge_to)
+        return [str(channel_id)] if channel_id else []
+
+    def _record_usage(self, usage, hold: BudgetHold = None):
+        """Count a completion's tokens in the metrics and, with a hold, in the spend ledger"""
+        metrics.record_usage(usage)
+        if hold is not None:
+            hold.charge(usage)
+
+    def _over_budget(self, topic: str, post_type: str, started: float, channel_id: str = None,
+                     charge_to: List[str] = None, language: str = None) -> Dict:
+        """Post for a channel whose spend cap is reached: an unposted stored post on the topic, else fallback"""
+        logger.warning(f"Spend cap reached for {charge_to or 'all channels'}, not calling OpenAI for {topic}")
+        if channel_id:
+            for source in ('batch', 'openai'):
+                stored = self.post_store.take_unserved(str(channel_id), [topic], 1, source=source,
+                                                       language=language)
+                if stored:
+                    metrics.POSTS_GENERATED.inc(source="cache")
+                    logger.info(f"Serving stored post {stored[0].get('post_id')} ({topic}) to {channel_id} instead")
+                    return stored[0]
+        return self._finish(self._get_fallback_content(topic, post_type, reason="budget", language=language), started)
+
+    def _route(self, topic: str):
+        """Model fallback chain for a topic (by topic, then catalog group)"""
+        return self.router.chain(topic, self.catalog.get(topic).group)
+
+    def _finish(self, post: Dict, started: float, usage=None) -> Dict:
+        """Record how long a post took, where it came from and the tokens of the accepted completion"""
+        duration = time.perf_counter() - started
+        metrics.GENERATION_SECONDS.observe(duration, source=post["source"])
+        metrics.POSTS_GENERATED.inc(source=post["source"])
+        logger.info(
+            f"Generated {post['topic']}/{post['post_type']} post via {post['source']} in {duration:.2f}s",
+            extra={
+                "post_id": post.get("post_id"), "topic": post["topic"], "post_type": post["post_type"],
+                "source": post["source"], "latency_ms": round(duration * 1000),
+                "prompt_tokens": getattr(usage, "prompt_tokens", None),
+                "completion_tokens": getattr(usage, "completion_tokens", None)
+            }
+        )
+        return post
+
+    @property
+    def client(self):
+        return self.router.default_target.provider.client
+
+    @property
+    def async_client(self):
+        return self.router.default_target.provider.async_client
+
+    @staticmethod
+    def _fallback_reason(error: Exception) -> str:
+        import openai
+        if isinstance(error, NoProviderAvailable):
+            return "circuit_open"
+        if isinstance(error, StreamRejected):
+            return "rejected"
+        if isinstance(error, (openai.APITimeoutError, asyncio.TimeoutError)):
+            return "timeout"
+        if isinstance(error, openai.RateLimitError):
+            return "rate_limited"
+        return "error"
+
+    def _available_length(self, topic: str, language: str = None) -> int:
+        """Characters left for the generated body once the topic's footer is appended"""
+        footer_length = telegram_length(self.catalog.get(topic, language).footer) + 2 + Config.FOOTER_RESERVE
+        return TELEGRAM_MESSAGE_LIMIT - footer_length
+
+    def _new_guard(self, topic: str, language: str = None) -> StreamGuard:
+        """Validator sized so content plus footer fits one Telegram message"""
+        return StreamGuard(max_length=self._available_length(topic, language), max_words=Config.STREAM_MAX_WORDS)
+
+    def _validate_content(self, content: str, topic: str, language: str = None) -> str:
+        """Apply the streaming checks to a complete response"""
+        guard = self._new_guard(topic, language)
+        guard.feed(content or "")
+        try:
+            return guard.result()
+        except StreamRejected:
+            metrics.CONTENT_REJECTED.inc(reason="validation")
+            raise
+
+    async def _astream_content(self, request: Dict, topic: str, chain, timeout: float = None,
+                               hold: BudgetHold = None):
+        """Stream a completion along the fallback chain; streams are not hedged. Returns (text, usage)"""
+        error = None
+        for target in chain:
+            if not target.provider.breaker.allow():
+                continue
+            try:
+                return await self._stream_from(target, request, topic, timeout, hold)
+            except Exception as e:
+                if not self.router.is_outage(e):
+                    raise
+                error = e
+                logger.warning(f"{target.key} stream failed ({type(e).__name__}), trying the next target")
+        raise error or NoProviderAvailable(f"No provider available for {[t.key for t in chain]}")
+
+    async def _stream_from(self, target, request: Dict, topic: str, timeout: float = None, hold: BudgetHold = None):
+        """Stream one completion through the guard, closing the stream as soon as it says stop; returns (text, usage)"""
+        guard = self._new_guard(topic)
+        usage = None
+        client = target.provider.async_client
+        if timeout is not None:
+            client = client.with_options(timeout=timeout)
+        with self.router.track(target, "stream"):
+            stream = await client.chat.completions.create(**dict(request, model=target.model), stream=True,
+                                                          stream_options={"include_usage": True})
+            try:
+                async for chunk in stream:
+                    usage = chunk.usage or usage
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if delta and not guard.feed(delta):
+                        logger.info(f"Cut {topic} stream early ({guard.stop_reason}) after {guard.length} chars")
+                        break
+            finally:
+                await stream.close()
+        if usage is None:
+            # Streams closed early never get their usage chunk; estimate at ~4 characters per token
+            prompt_chars = sum(len(m["content"]) for m in request["messages"])
+            usage = SimpleNamespace(prompt_tokens=prompt_chars // 4, completion_tokens=guard.length // 4)
+        self._record_usage(usage, hold)
+        try:
+            return guard.result(), usage
+        except StreamRejected:
+            metrics.CONTENT_REJECTED.inc(reason="validation")
+            raise
+
+    def _get_cached(self, topic: str, post_type: str, key_hash: str, channel_id: str = None):
+        """Reuse a stored completion for this request that the channel has not posted yet"""
+        if not channel_id:
+            return None
+        cached = self.post_store.get_cached(topic, post_type, key_hash, str(channel_id))
+        if cached:
+            logger.info(f"Serving cached post {cached.get('post_id')} ({topic}/{post_type}) to {channel_id}")
+            metrics.POSTS_GENERATED.inc(source="cache")
+        return cached
+
+    def _retry_request(self, request: Dict, attempt: int) -> Dict:
+        """Raise the temperature on regeneration attempts to steer away from repeats"""
+        if attempt == 0:
+            return request
+        return dict(request, temperature=min(1.2, request["temperature"] + 0.15 * attempt))
+
+    def _accept_content(self, content: str, topic: str, attempt: int) -> bool:
+        """Reject content that is a near-duplicate of a recent post"""
+        similarity = self.post_store.find_near_duplicate(content)
+        if similarity is None:
+            return True
+        metrics.CONTENT_REJECTED.inc(reason="duplicate")
+        logger.warning(f"Rejected near-duplicate {topic} post (similarity {similarity:.2f}, "
+                       f"attempt {attempt + 1}/{self.dedup_retries + 1})")
+        return False
+
+    def _store_post(self, post: Dict, key_hash: str, channel_id: str = None) -> Dict:
+        """Record an accepted post in the store"""
+        self.post_store.add(post, key_hash, str(channel_id) if channel_id else None)
+        return post
+
+    async def warm_up(self):
+        """Create the default provider's clients in a worker thread so importing openai never stalls the loop"""
+        await asyncio.to_thread(lambda: self.async_client)
+
+    async def aclose(self):
+        """Close the pooled HTTP connections of every provider and finish pending spend writes"""
+        await self.router.aclose()
+        await self.budget.flush()
+
+    def _pick_topic_and_type(self, topic: str = None, post_type: str = None):
+        """Fill in a random topic and post type when not given"""
+        if not topic:
+            topic = random.choice(self.content_topics)
+        if not post_type:
+            post_type = random.choice(self.post_types)
+        return topic, post_type
+
+    def _completion_kwargs(self, prompt: str, topic: str = None) -> Dict:
+        """Build the chat completion request parameters
+
+        `max_tokens` covers the word budget the prompt asks for, capped so
+        the body still fits one Telegram message next to the topic's footer.
+        """
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "max_tokens": max_tokens_for(self._available_length(topic)),
+            "temperature": 0.7
         }
+
+    def _localized_request(self, topic: str, post_type: str, languages: List[str]) -> Dict:
+        """Completion request for one post in several languages, answered as a JSON object
+
+        `max_tokens` is the single-language budget per language, scaled by the
+        catalog's token factor for scripts that take more tokens per character.
+        """
+        names = ", ".join(f"{self.catalog.languages.get(code, code)} ({code})" for code in languages)
+        skeleton = json.dumps({code: "..." for code in languages}, ensure_ascii=False)
+        prompt = (f"{self._create_prompt(topic, post_type)}\n\nWrite this post for readers in each of these "
+                  f"languages: {names}. Write each version natively rather than translating word for word. "
+                  f"Reply with only a JSON object whose keys are the language codes and whose values are "
+                  f"the posts: {skeleton}")
+        request = self._completion_kwargs(prompt, topic)
+        request["max_tokens"] = sum(
+            int(max_tokens_for(self._available_length(topic, code)) * self.catalog.token_factors.get(code, 1.0))
+            + LOCALIZED_KEY_TOKENS for code in languages
+        )
+        request["response_format"] = {"type": "json_object"}
+        return request
+
+    def _assemble_post(self, content: str, topic: str, post_type: str, source: str = "openai",
+                       cta: str = None, language: str = None) -> Dict[str, str]:
+        """Add hashtags and company mention with CTA to generated content"""
+        language = language or self.catalog.language
+        record = self.catalog.get(topic, language)
+        footer = record.footer if not cta or cta == record.cta else \
+            self.catalog.render_footer(record.hashtags, cta, language)
+        final_content = f"{content}\n\n{footer}"
         
-        content = fallback_posts.get(topic, "🥥 Discover Sawa Coco's premium coconut products from Thailand - MCT Oils, MCT Powders & Coconut Shell Charcoal! 💪")
-        hashtags = self._generate_hashtags(topic)
-        
-        cta = self._get_call_to_action(topic)
         return {
-            "content": f"{content}\n\n{hashtags}\n\n🥥 {self.company_name} - {self.main_product}\n🌍 Sustainable sourcing from {self.company_location}\n\n{cta}\n{self.website_url}",
+            "content": final_content,
+            "body": content,
             "topic": topic,
             "post_type": post_type,
-            "hashtags": hashtags
+            "hashtags": record.hashtags,
+            "source": source,
+            "language": language
         }
 
-    def generate_daily_content_batch(self, count: int = 4) -> List[Dict[str, str]]:
-        """Generate multiple posts for the day"""
-        posts = []
-        used_topics = set()
+    def reassemble_post(self, post: Dict[str, str], cta: str = None) -> Dict[str, str]:
+        """Rebuild a post's footer around its generated body, e.g. with a channel-specific CTA"""
+        reassembled = dict(post)
+        reassembled.update(self._assemble_post(post["body"], post["topic"], post["post_type"],
+                                               source=post.get("source", "openai"), cta=cta,
+                                               language=post.get("language")))
+        return reassembled
+
+    def _create_prompt(self, topic: str, post_type: str) -> str:
+        """Create a prompt for content generation"""
+        return self.catalog.get(topic).prompt(post_type)
+
+    def _generate_hashtags(self, topic: str, language: str = None) -> str:
+        """Generate relevant hashtags for the post"""
+        return self.catalog.get(topic, language).hashtags
+
+    def _get_call_to_action(self, topic: str, language: str = None) -> str:
+        """Generate topic-specific call-to-action"""
+        return self.catalog.get(topic, language).cta
+
+    def _get_fallback_content(self, topic: str, post_type: str, reason: str = "error",
+                              language: str = None) -> Dict[str, str]:
+        """Fallback content when API is unavailable"""
+        metrics.FALLBACKS.inc(reason=reason)
+        return self._assemble_post(self.catalog.get(topic, language).fallback, topic, post_type, source="fallback",
+                                   language=language)
+
+    def generate_daily_content_batch(self, count: int = 4, concurrency: int = None) -> List[Dict[str, str]]:
+        """Generate multiple posts for the day, running completions concurrently"""
+        topics = self._pick_batch_topics(count)
+        workers = max(1, min(concurrency or self.concurrency, len(topics) or 1))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.generate_post_content, topic) for topic in topics]
+            posts = []
+            for topic, future in zip(topics, futures):
+                try:
+                    posts.append(future.result())
+                except Exception:
+                    posts.append(self._get_fallback_content(topic, random.choice(self.post_types)))
+        return posts
+
+    async def agenerate_localized_batch(self, topics: List[str], languages: List[List[str]],
+                                        concurrency: int = None,
+                                        charge_to: List[List[str]] = None) -> List[Dict[str, Dict[str, str]]]:
+        """Generate each topic in its list of languages concurrently; returns one {language: post} per topic
+
+        Topics needed only in the default language take the plain (streamed)
+        path; the rest are generated with one localized completion each.
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency or self.concurrency))
+        charge_to = charge_to or [None] * len(topics)
+
+        async def generate(topic, codes, channels):
+            async with semaphore:
+                if codes == [self.catalog.language]:
+                    return {codes[0]: await self.agenerate_post_content(topic, charge_to=channels)}
+                return await self.agenerate_localized(topic, languages=codes, charge_to=channels)
+
+        results = await asyncio.gather(*(generate(t, l, c) for t, l, c in zip(topics, languages, charge_to)),
+                                       return_exceptions=True)
+        variants = []
+        for topic, codes, result in zip(topics, languages, results):
+            if isinstance(result, BaseException):
+                if isinstance(result, asyncio.CancelledError):
+                    raise result
+                post_type = random.choice(self.post_types)
+                result = {code: self._get_fallback_content(topic, post_type, language=code) for code in codes}
+            variants.append(result)
+        return variants
+
+    def _pick_batch_topics(self, count: int, pool: List[str] = None, used: List[str] = None) -> List[str]:
+        """Pick topics for a batch, not repeating until all are used"""
+        pool = pool or self.content_topics
+        topics = []
+        used_topics = set(used or []) & set(pool)
         
         for _ in range(count):
             # Ensure variety by not repeating topics
-            available_topics = [t for t in self.content_topics if t not in used_topics]
+            available_topics = [t for t in pool if t not in used_topics]
             if not available_topics:
                 used_topics.clear()
-                available_topics = self.content_topics
+                available_topics = pool
             
             topic = random.choice(available_topics)
             used_topics.add(topic)
-            
-            post = self.generate_post_content(topic)
-            posts.append(post)
+            topics.append(topic)
         
+        return topics
+
+    async def agenerate_daily_content_batch(self, count: int = 4, concurrency: int = None) -> List[Dict[str, str]]:
+        """Generate multiple posts for the day concurrently, capped at `concurrency` in flight"""
+        return await self.agenerate_batch(self._pick_batch_topics(count), concurrency)
+
+    async def agenerate_batch(self, topics: List[str], concurrency: int = None,
+                              charge_to: List[List[str]] = None) -> List[Dict[str, str]]:
+        """Generate one post per topic concurrently, keeping the input order
+
+        `charge_to` lists the channels that will use each post, for the
+        spend ledger. A failed item falls back to canned content without
+        failing the batch.
+        """
+        semaphore = asyncio.Semaphore(max(1, concurrency or self.concurrency))
+        charge_to = charge_to or [None] * len(topics)
+
+        async def generate(topic, channels):
+            async with semaphore:
+                return await self.agenerate_post_content(topic, charge_to=channels)
+
+        results = await asyncio.gather(*(generate(t, c) for t, c in zip(topics, charge_to)), return_exceptions=True)
+        posts = []
+        for topic, result in zip(topics, results):
+            if isinstance(result, BaseException):
+                if isinstance(result, asyncio.CancelledError):
+                    raise result
+                result = self._get_fallback_content(topic, random.choice(self.post_types))
+            posts.append(result)
         return posts
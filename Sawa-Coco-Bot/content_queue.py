@@ -0,0 +1,257 @@
+import asyncio
+import logging
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+import metrics
+from channels import ChannelConfig
+from config import Config
+from content_generator import ContentGenerator
+from storage import DebouncedJsonWriter, read_json
+
+logger = logging.getLogger(__name__)
+
+def shared_topic_requests(plans: Dict[str, List[str]]) -> List[str]:
+    """Merge per-channel topic plans so each topic is generated as often as the most demanding channel needs it"""
+    needed = {}
+    for topics in plans.values():
+        for topic in set(topics):
+            needed[topic] = max(needed.get(topic, 0), topics.count(topic))
+    return [topic for topic, n in needed.items() for _ in range(n)]
+
+class ContentQueue:
+    """Persistent per-channel buffer of ready-to-send posts
+
+    A background worker keeps each channel between the low and high
+    watermarks by generating through ContentGenerator, so posting at fire
+    time is a pop instead of an OpenAI round-trip. Refills are deferred
+    while a posting slot is imminent unless the buffer is empty. Channels
+    refilled together share one generation per topic; each channel then
+    gets the body with its own CTA footer. Bulk-generated posts waiting in
+    the post store, then fresh completions made for other channels, are
+    used before any new completion is requested.
+    Changes are flushed to disk in batches off the event loop, at most
+    STATE_SAVE_DELAY seconds after they happen.
+    """
+
+    def __init__(self, content_generator: ContentGenerator, path: str = None,
+                 low_watermark: int = None, high_watermark: int = None,
+                 owns: Callable[[str], bool] = None):
+        self.content_generator = content_generator
+        # Only channels this replica is primary for are pre-generated
+        self.owns = owns or (lambda channel_id: True)
+        self.path = path or Config.CONTENT_QUEUE_FILE
+        self.low_watermark = Config.QUEUE_LOW_WATERMARK if low_watermark is None else low_watermark
+        self.high_watermark = Config.QUEUE_HIGH_WATERMARK if high_watermark is None else high_watermark
+        self.quiet_window = timedelta(minutes=Config.QUEUE_REFILL_QUIET_MINUTES)
+        self.check_interval = Config.QUEUE_CHECK_INTERVAL
+        self.queues: Dict[str, deque] = {}
+        self.channels: Dict[str, ChannelConfig] = {}
+        self._wakeup = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self._load()
+        self._saver = DebouncedJsonWriter(self.path, self._snapshot, Config.STATE_SAVE_DELAY)
+
+    def register_channel(self, channel: ChannelConfig):
+        """Track a channel and its topic subset and CTAs"""
+        self.queues.setdefault(channel.channel_id, deque())
+        self.channels[channel.channel_id] = channel
+
+    def size(self, channel_id: str) -> int:
+        """Number of ready posts buffered for a channel"""
+        return len(self.queues.get(str(channel_id), ()))
+
+    def peek(self, channel_id: str) -> List[Dict[str, str]]:
+        """Return the buffered posts for a channel without removing them"""
+        return list(self.queues.get(str(channel_id), ()))
+
+    def pop(self, channel_id: str) -> Optional[Dict[str, str]]:
+        """Take the next ready post for a channel, or None if the buffer is empty"""
+        queue = self.queues.get(str(channel_id))
+        if not queue:
+            return None
+        post = queue.popleft()
+        self._saver.mark_dirty()
+        if len(queue) < self.low_watermark:
+            self._wakeup.set()
+        return post
+
+    def push(self, channel_id: str, post: Dict[str, str]):
+        """Append a ready post to a channel's buffer"""
+        self.queues.setdefault(str(channel_id), deque()).append(post)
+        self._saver.mark_dirty()
+
+    def requeue(self, channel_id: str, post: Dict[str, str]):
+        """Put a popped post back at the front, e.g. when its send was interrupted"""
+        self.queues.setdefault(str(channel_id), deque()).appendleft(post)
+        self._saver.mark_dirty()
+
+    def release_unowned(self) -> int:
+        """Drop buffered posts of channels another replica now owns; returns how many were dropped
+
+        The owner posts those channels from its own queue. If this replica
+        later takes a slot over or regains the channel it generates fresh
+        posts instead of sending a buffer the owner has moved on from.
+        """
+        dropped = 0
+        for channel_id, queue in self.queues.items():
+            if queue and channel_id in self.channels and not self.owns(channel_id):
+                logger.info(f"{channel_id} is owned by another replica, dropping {len(queue)} buffered posts")
+                dropped += len(queue)
+                queue.clear()
+        if dropped:
+            self._saver.mark_dirty()
+        return dropped
+
+    async def refill(self, channel_id: str) -> int:
+        """Generate posts until the channel reaches the high watermark"""
+        return (await self.refill_many([channel_id])).get(str(channel_id), 0)
+
+    async def refill_many(self, channel_ids: List[str]) -> Dict[str, int]:
+        """Top up several channels, generating each overlapping topic only once
+
+        Channels in different languages still share a topic's generation:
+        one localized completion returns it in every language they need.
+        """
+        plans = {}
+        added = {}
+        generated_at = datetime.now(timezone.utc).isoformat()
+        for channel_id in map(str, channel_ids):
+            queue = self.queues.setdefault(channel_id, deque())
+            missing = self.high_watermark - len(queue)
+            if missing <= 0:
+                continue
+            channel = self.channels.get(channel_id)
+            pool = (channel and channel.topics) or self.content_generator.content_topics
+
+            # Bulk-generated posts and completions still within the cache TTL are already paid for
+            store = self.content_generator.post_store
+            language = self._language(channel_id)
+            # SQLite: off the event loop
+            stored = await asyncio.to_thread(store.take_unserved, channel_id, pool, missing, language=language)
+            cached = await asyncio.to_thread(store.take_unserved, channel_id, pool, missing - len(stored),
+                                             source='openai', language=language, fresh=True)
+            if cached:
+                metrics.POSTS_GENERATED.inc(len(cached), source="cache")
+                logger.info(f"Serving {len(cached)} cached posts to {channel_id}")
+            stored += cached
+            for post in stored:
+                post = self.content_generator.reassemble_post(post, channel.cta_for(post['topic']) if channel else None)
+                post['generated_at'] = generated_at
+                queue.append(post)
+            added[channel_id] = len(stored)
+            missing -= len(stored)
+            if missing <= 0:
+                continue
+            if self.content_generator.budget.exhausted(channel_id):
+                # Posts for it are drawn from stored or fallback content at send time
+                logger.warning(f"Spend cap reached for {channel_id}, not pre-generating")
+                continue
+
+            queued_topics = [post['topic'] for post in queue]
+            plans[channel_id] = self.content_generator._pick_batch_topics(missing, pool=pool, used=queued_topics)
+        if not plans:
+            if added:
+                self._saver.mark_dirty()
+            return added
+
+        # During an OpenAI outage keep what is buffered rather than filling the queue with fallbacks
+        if self.content_generator.router.unavailable():
+            logger.warning(f"OpenAI circuit is open, deferring refill for {len(plans)} channels")
+            if any(added.values()):
+                self._saver.mark_dirty()
+            return added
+
+        requests = shared_topic_requests(plans)
+        # The n-th generation of a topic is used by every channel that planned it at least n times
+        charge_to = []
+        languages = []
+        for index, topic in enumerate(requests):
+            occurrence = requests[:index].count(topic)
+            charge_to.append([c for c, topics in plans.items() if topics.count(topic) > occurrence])
+            languages.append(list(dict.fromkeys(self._language(c) for c in charge_to[-1])))
+        results = await self.content_generator.agenerate_localized_batch(requests, languages, charge_to=charge_to)
+        generated = {}
+        for topic, variants in zip(requests, results):
+            generated.setdefault(topic, []).append(variants)
+
+        served = []
+        for channel_id, topics in plans.items():
+            channel = self.channels.get(channel_id)
+            used = {}
+            for topic in topics:
+                index = used.get(topic, 0)
+                used[topic] = index + 1
+                post = generated[topic][index][self._language(channel_id)]
+                # Fallback text is cheap to produce at send time; only buffer real content
+                if post.get('source') == 'fallback':
+                    continue
+                if post.get('post_id'):
+                    served.append((post['post_id'], channel_id))
+                cta = channel.cta_for(topic) if channel else None
+                post = self.content_generator.reassemble_post(post, cta)
+                post['generated_at'] = generated_at
+                self.queues[channel_id].append(post)
+                added[channel_id] += 1
+            logger.info(f"Refilled content queue for {channel_id}: +{added[channel_id]} "
+                        f"(now {len(self.queues[channel_id])})")
+
+        if served:
+            await asyncio.to_thread(self.content_generator.post_store.mark_served_many, served)
+        self._saver.mark_dirty()
+        logger.info(f"Shared refill generated {len(requests)} posts for {len(plans)} channels")
+        return added
+
+    def _language(self, channel_id: str) -> str:
+        channel = self.channels.get(channel_id)
+        return channel.language if channel else Config.DEFAULT_LANGUAGE
+
+    def _needs_refill(self, channel_id: str, next_fire: Optional[datetime]) -> bool:
+        """Below the low watermark, and either empty or outside the pre-post quiet window"""
+        size = self.size(channel_id)
+        if size >= self.low_watermark:
+            return False
+        if size == 0 or next_fire is None:
+            return True
+        return next_fire - datetime.now(timezone.utc) > self.quiet_window
+
+    async def run(self, next_fire_time: Callable[[], Optional[datetime]] = None):
+        """Background worker that keeps every channel topped up"""
+        self._stopped.clear()
+        while not self._stopped.is_set():
+            self._wakeup.clear()
+            self.release_unowned()
+            next_fire = next_fire_time() if next_fire_time else None
+            due = [c for c in self.channels if self.owns(c) and self._needs_refill(c, next_fire)]
+            if due:
+                try:
+                    await self.refill_many(due)
+                except Exception as e:
+                    logger.error(f"Content queue refill failed for {due}: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.check_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        """Stop the refill worker"""
+        self._stopped.set()
+        self._wakeup.set()
+
+    async def close(self):
+        """Write buffered posts that are not on disk yet"""
+        await self._saver.close()
+
+    def _load(self):
+        """Load buffered posts from disk"""
+        data = read_json(self.path)
+        if data:
+            self.queues = {channel_id: deque(posts) for channel_id, posts in data.items()}
+            logger.info(f"Loaded content queue from {self.path}: "
+                        f"{ {c: len(q) for c, q in self.queues.items()} }")
+
+    def _snapshot(self) -> Dict[str, list]:
+        # Posts are never mutated once queued, so copying the deques is enough
+        return {c: list(q) for c, q in self.queues.items()}
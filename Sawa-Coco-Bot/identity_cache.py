@@ -0,0 +1,69 @@
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional
+
+from config import Config
+from storage import read_json, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+def token_fingerprint(token: str) -> str:
+    """Short hash identifying a bot token without storing it"""
+    return hashlib.sha256((token or "").encode("utf-8")).hexdigest()[:16]
+
+class IdentityCache:
+    """Bot and channel metadata confirmed by Telegram, reused across restarts until it expires
+
+    Entries are keyed to a fingerprint of the bot token, so switching tokens
+    starts from an empty cache. A fresh entry means the bot reached that chat
+    recently and startup can skip the get_me/get_chat round-trips.
+    """
+
+    def __init__(self, token: str, path: str = None, ttl_hours: float = None):
+        self.path = path or Config.IDENTITY_CACHE_FILE
+        self.ttl = timedelta(hours=Config.IDENTITY_CACHE_TTL_HOURS if ttl_hours is None else ttl_hours)
+        self.fingerprint = token_fingerprint(token)
+        data = read_json(self.path, {})
+        if data.get("token") != self.fingerprint:
+            data = {}
+        self.bot_info: Dict = data.get("bot", {})
+        self.chats: Dict[str, Dict] = data.get("chats", {})
+
+    def _fresh(self, entry: Optional[Dict]) -> Optional[Dict]:
+        if not entry:
+            return None
+        verified_at = datetime.fromisoformat(entry["verified_at"])
+        return entry if datetime.now(timezone.utc) - verified_at < self.ttl else None
+
+    def bot(self) -> Optional[Dict]:
+        """Cached bot identity ({"id", "username", "verified_at"}) if still fresh"""
+        return self._fresh(self.bot_info)
+
+    def chat(self, chat_id: str) -> Optional[Dict]:
+        """Cached chat metadata ({"title", "verified_at"}) if still fresh"""
+        return self._fresh(self.chats.get(str(chat_id)))
+
+    def is_fresh(self, chat_ids: Iterable[str]) -> bool:
+        """True if the bot and every given chat were verified within the TTL"""
+        return self.bot() is not None and all(self.chat(chat_id) for chat_id in chat_ids)
+
+    def record_bot(self, bot_id: int, username: str):
+        self.bot_info = {"id": bot_id, "username": username, "verified_at": self._now()}
+        self.save()
+
+    def record_chat(self, chat_id: str, title: str = None):
+        self.chats[str(chat_id)] = {"title": title, "verified_at": self._now()}
+        self.save()
+
+    def invalidate(self, chat_id: str):
+        """Forget a chat, e.g. after a send to it failed, so it is checked again"""
+        if self.chats.pop(str(chat_id), None) is not None:
+            self.save()
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.now(timezone.utc).isoformat()
+
+    def save(self):
+        write_json_atomic(self.path, {"token": self.fingerprint, "bot": self.bot_info, "chats": self.chats})
@@ -0,0 +1,136 @@
+"""
+Logging configuration for every entry point
+
+Records go through a bounded in-memory queue to a background thread that
+does the console and file I/O, so a slow disk never blocks the event loop.
+The log file rotates by size (or by time with LOG_ROTATE_WHEN) and rotated
+files are gzipped. LOG_FORMAT=json writes one JSON object per line,
+including the structured fields passed via `extra=` (see STRUCTURED_FIELDS).
+"""
+
+import atexit
+import copy
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+from datetime import datetime, timezone
+
+import metrics
+from config import Config
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Fields callers attach with logger.info(..., extra={...}) for later analysis; latency_ms is
+# generation time on "Generated ..." records and slot-to-delivery drift on "Posted ..." records
+STRUCTURED_FIELDS = (
+    "post_id", "channel", "topic", "post_type", "source", "slot", "outcome",
+    "latency_ms", "prompt_tokens", "completion_tokens"
+)
+
+_listener = None
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record: timestamp, level, logger, message and any structured fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the writer falls behind"""
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_RECORDS_DROPPED.inc()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Render the message now, keeping the traceback separate so JSON lines can carry it as a field
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def _gzip_rotator(source: str, dest: str):
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+def _file_handler(path: str) -> logging.Handler:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if Config.LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=Config.LOG_ROTATE_WHEN, backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8', utc=True)
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=Config.LOG_MAX_BYTES, backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8')
+    if Config.LOG_COMPRESS:
+        handler.namer = lambda name: f"{name}.gz"
+        handler.rotator = _gzip_rotator
+    return handler
+
+def setup_logging(level: str = None, log_file: str = None, log_format: str = None) -> logging.handlers.QueueListener:
+    """Route all logging through a background writer; safe to call again to reconfigure
+
+    `log_file=''` logs to the console only.
+    """
+    global _listener
+    shutdown_logging()
+
+    level = level or Config.LOG_LEVEL
+    log_file = Config.LOG_FILE if log_file is None else log_file
+    formatter = JSONFormatter() if (log_format or Config.LOG_FORMAT) == 'json' else logging.Formatter(TEXT_FORMAT)
+
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(_file_handler(log_file))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(_DroppingQueueHandler(log_queue))
+    root.setLevel(level)
+    # Request-level chatter from the HTTP clients would flood the queue
+    logging.getLogger('httpx').setLevel(max(logging.WARNING, root.level))
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+def shutdown_logging():
+    """Flush queued records and close the log files"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+atexit.register(shutdown_logging)
@@ -4,21 +4,16 @@ SawaCoco MCT Oil Telegram Bot - Main Entry Point
 Automated content posting bot for MCT Oil products
 """
 
+import argparse
 import asyncio
 import logging
 import signal
 import sys
-from telegram_bot import TelegramContentBot
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+import time
+from catalog import Catalog, CatalogError
+from config import Config
+from logging_setup import setup_logging
+from metrics import UP_SINCE, MetricsServer
 
 logger = logging.getLogger(__name__)
 
@@ -26,57 +21,134 @@ class BotManager:
     def __init__(self):
         self.bot = None
         self.running = False
+        self.metrics_server = None
+        self.stop_event = None
+        self._shutdown_done = False
+
+    def install_signal_handlers(self):
+        """Turn SIGINT/SIGTERM into a shutdown request on the running event loop"""
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, self.request_shutdown, signum)
+            except (NotImplementedError, RuntimeError):
+                # e.g. Windows: fall back to a plain handler that hops onto the loop
+                signal.signal(signum, lambda s, frame: loop.call_soon_threadsafe(self.request_shutdown, s))
 
     async def start(self):
         """Start the bot with proper error handling"""
+        self.stop_event = asyncio.Event()
+        self.install_signal_handlers()
         try:
-            self.bot = TelegramContentBot()
             self.running = True
+            self.start_metrics()
+            # Deferred so --help, --validate-catalog and /healthz do not wait for telegram/openai to import
+            from telegram_bot import TelegramContentBot
+            self.bot = TelegramContentBot()
             
             # Start the bot
             success = await self.bot.start_bot()
             
             if not success:
                 logger.error("Failed to start bot")
+                await self.shutdown()
                 return False
             
-            # Keep running
+            # Run until a signal arrives or the scheduler dies
             logger.info("Bot is now running. Press Ctrl+C to stop.")
-            while self.running:
-                await asyncio.sleep(1)
+            stop_wait = asyncio.create_task(self.stop_event.wait())
+            await asyncio.wait({stop_wait, self.bot.scheduler_task}, return_when=asyncio.FIRST_COMPLETED)
+            stop_wait.cancel()
+            if self.bot.scheduler_task.done() and not self.bot.scheduler_task.cancelled() and \
+                    self.bot.scheduler_task.exception():
+                raise self.bot.scheduler_task.exception()
                 
-        except KeyboardInterrupt:
-            logger.info("Received shutdown signal")
-            await self.shutdown()
         except Exception as e:
             logger.error(f"Bot crashed: {e}")
             await self.shutdown()
             return False
         
+        await self.shutdown()
         return True
 
+    def start_metrics(self):
+        """Expose Prometheus metrics unless METRICS_PORT is 0"""
+        UP_SINCE.set(time.time())
+        if not Config.METRICS_PORT:
+            return
+        try:
+            self.metrics_server = MetricsServer().start()
+        except OSError as e:
+            logger.error(f"Metrics endpoint unavailable on port {Config.METRICS_PORT}: {e}")
+
     async def shutdown(self):
-        """Graceful shutdown"""
+        """Graceful shutdown: drain in-flight posts, persist state, close connections"""
+        if self._shutdown_done:
+            return
+        self._shutdown_done = True
         logger.info("Shutting down bot...")
         self.running = False
+        if self.bot:
+            await self.bot.shutdown()
+        if self.metrics_server:
+            self.metrics_server.stop()
 
-    def handle_signal(self, signum, frame):
+    def request_shutdown(self, signum=None):
         """Handle system signals"""
-        logger.info(f"Received signal {signum}")
+        logger.info(f"Received signal {signum}, shutting down")
         self.running = False
+        if self.stop_event:
+            self.stop_event.set()
+
+def validate_catalog() -> int:
+    """Validate the content catalog and report topics missing coverage"""
+    try:
+        catalog = Catalog.load()
+    except CatalogError as e:
+        print(f"❌ {e}")
+        return 1
+    print(f"✅ Catalog {catalog.path}: {len(catalog.topics)} topics, {len(catalog.post_types)} post types")
+    for line in catalog.coverage_report():
+        print(line)
+    return 0
+
+async def self_test() -> int:
+    """Check the bot token and channel access, then publish the test post to the default channel"""
+    from telegram_bot import TelegramContentBot
+    bot = TelegramContentBot()
+    try:
+        if not await bot.test_connection():
+            print("❌ Connection test failed")
+            return 1
+        if not await bot.send_test_post():
+            print(f"❌ Test post to {bot.channel_id} failed")
+            return 1
+        print(f"✅ Bot and {len(bot.channels)} channels verified, test post sent to {bot.channel_id}")
+        return 0
+    finally:
+        await bot.shutdown(timeout=0)
 
 async def main():
     """Main entry point"""
     manager = BotManager()
     
-    # Setup signal handlers
-    signal.signal(signal.SIGINT, manager.handle_signal)
-    signal.signal(signal.SIGTERM, manager.handle_signal)
-    
-    # Start the bot
+    # Start the bot; signal handlers are installed on its event loop
     await manager.start()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SawaCoco MCT Oil Telegram Bot")
+    parser.add_argument('--validate-catalog', action='store_true',
+                        help="validate catalog.json, report topics missing coverage and exit")
+    parser.add_argument('--self-test', action='store_true',
+                        help="verify the bot and channels, send a test post to the default channel and exit")
+    args = parser.parse_args()
+    setup_logging()
+    
+    if args.validate_catalog:
+        sys.exit(validate_catalog())
+    if args.self_test:
+        sys.exit(asyncio.run(self_test()))
+    
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -0,0 +1,236 @@
+"""
+Local image library for media posts
+
+Source images live in MEDIA_SOURCE_DIR as `<topic>/<image>`, where the
+folder is a catalog topic or group. `python media_library.py ingest`
+resizes and recompresses each image to fit Telegram's photo limits once
+and records it in the index, so sending never needs Pillow. The first
+upload of an asset records the file_id Telegram returns; later sends to
+any channel pass that file_id instead of the bytes.
+"""
+
+import argparse
+import hashlib
+import io
+import logging
+import os
+import random
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Union
+
+from config import Config
+from identity_cache import token_fingerprint
+from storage import read_json, write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Telegram's sendPhoto limits
+PHOTO_MAX_BYTES = 10 * 1024 * 1024
+PHOTO_MAX_DIMENSIONS = 10000
+PHOTO_MAX_RATIO = 20
+
+class MediaError(ValueError):
+    """Raised for images that cannot be turned into a Telegram photo"""
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def prepare_image(source: str, max_side: int = None, quality: int = None) -> bytes:
+    """Source image as a JPEG within Telegram's photo limits"""
+    from PIL import Image, ImageOps
+
+    max_side = max_side or Config.MEDIA_MAX_SIDE
+    quality = quality or Config.MEDIA_JPEG_QUALITY
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        width, height = image.size
+        if max(width, height) / min(width, height) > PHOTO_MAX_RATIO:
+            raise MediaError(f"aspect ratio {width}x{height} exceeds {PHOTO_MAX_RATIO}:1")
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image.mode != 'RGB':
+            # Flatten transparency onto white rather than the black JPEG would give it
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            rgba = image.convert('RGBA')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            image = background
+        if sum(image.size) > PHOTO_MAX_DIMENSIONS:
+            raise MediaError(f"{image.size} exceeds {PHOTO_MAX_DIMENSIONS} total pixels of width and height")
+        while True:
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+            if buffer.tell() <= PHOTO_MAX_BYTES or quality <= 30:
+                break
+            quality -= 10
+    if buffer.tell() > PHOTO_MAX_BYTES:
+        raise MediaError(f"still {buffer.tell()} bytes at JPEG quality {quality}")
+    return buffer.getvalue()
+
+class MediaLibrary:
+    """Ingested images per topic and the Telegram file_id of each upload
+
+    file_ids belong to the bot that uploaded them, so they are stored under
+    a fingerprint of the bot token and a new token uploads again.
+    """
+
+    def __init__(self, token: str = None, index_path: str = None, source_dir: str = None, media_dir: str = None):
+        self.index_path = index_path or Config.MEDIA_INDEX_FILE
+        self.source_dir = source_dir or Config.MEDIA_SOURCE_DIR
+        self.media_dir = media_dir or Config.MEDIA_DIR
+        self.fingerprint = token_fingerprint(token if token is not None else Config.TELEGRAM_BOT_TOKEN)
+        self.assets: Dict[str, Dict] = read_json(self.index_path, {}).get("assets", {})
+        self._by_topic: Dict[str, List[str]] = {}
+        self._index_topics()
+
+    def _index_topics(self):
+        self._by_topic = {}
+        for asset_id, asset in sorted(self.assets.items()):
+            self._by_topic.setdefault(asset["topic"], []).append(asset_id)
+
+    def __len__(self):
+        return len(self.assets)
+
+    def topics(self) -> List[str]:
+        return sorted(self._by_topic)
+
+    def pick(self, topic: str, group: str = None, count: int = None) -> List[str]:
+        """Random assets for a topic, else for its catalog group; empty if there are none"""
+        count = Config.MEDIA_PER_POST if count is None else count
+        candidates = self._by_topic.get(topic) or self._by_topic.get(group) or []
+        # A media group holds at most 10 items
+        return random.sample(candidates, min(count, len(candidates), 10))
+
+    def file_id(self, asset_id: str) -> Optional[str]:
+        return self.assets[asset_id].get("file_ids", {}).get(self.fingerprint)
+
+    def input_for(self, asset_id: str) -> Union[str, bytes]:
+        """The cached file_id if Telegram already has the asset, otherwise its bytes to upload"""
+        file_id = self.file_id(asset_id)
+        if file_id:
+            return file_id
+        with open(self.assets[asset_id]["path"], 'rb') as f:
+            return f.read()
+
+    def record_file_id(self, asset_id: str, file_id: str):
+        if asset_id not in self.assets or self.file_id(asset_id) == file_id:
+            return
+        self.assets[asset_id].setdefault("file_ids", {})[self.fingerprint] = file_id
+        logger.info(f"Cached Telegram file_id for media {asset_id}")
+        self.save()
+
+    def forget(self, asset_ids: Iterable[str]) -> bool:
+        """Drop cached file_ids (e.g. after Telegram rejected one); True if any were dropped"""
+        dropped = False
+        for asset_id in asset_ids:
+            if self.assets.get(asset_id, {}).get("file_ids", {}).pop(self.fingerprint, None):
+                dropped = True
+        if dropped:
+            self.save()
+        return dropped
+
+    def ingest(self, known_topics: Iterable[str] = None) -> Dict[str, int]:
+        """Prepare new or changed source images and drop assets whose source is gone
+
+        Returns counts of added, unchanged, removed and failed images.
+        """
+        known = set(known_topics) if known_topics is not None else None
+        stats = {"added": 0, "unchanged": 0, "removed": 0, "failed": 0}
+        if not os.path.isdir(self.source_dir):
+            logger.warning(f"Media source directory {self.source_dir} does not exist")
+            return stats
+        os.makedirs(self.media_dir, exist_ok=True)
+
+        by_source = {asset["source"]: asset_id for asset_id, asset in self.assets.items()}
+        seen = set()
+        ids_seen = set()
+        for topic in sorted(os.listdir(self.source_dir)):
+            folder = os.path.join(self.source_dir, topic)
+            if not os.path.isdir(folder):
+                continue
+            if known is not None and topic not in known:
+                logger.warning(f"Media folder '{topic}' matches no catalog topic or group; its images are never picked")
+            for name in sorted(os.listdir(folder)):
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                source = os.path.join(folder, name)
+                seen.add(source)
+                sha = _sha256(source)
+                asset_id = sha[:16]
+                if asset_id in ids_seen:
+                    logger.warning(f"Skipping {source}: same image as {self.assets[asset_id]['source']}")
+                    continue
+                existing = by_source.get(source)
+                if existing == asset_id and os.path.exists(self.assets[asset_id]["path"]):
+                    ids_seen.add(asset_id)
+                    stats["unchanged"] += 1
+                    continue
+                try:
+                    data = prepare_image(source)
+                except Exception as e:
+                    logger.error(f"Skipping {source}: {e}")
+                    stats["failed"] += 1
+                    continue
+                if existing and existing != asset_id:
+                    self._remove(existing)
+                path = os.path.join(self.media_dir, f"{asset_id}.jpg")
+                with open(path, 'wb') as f:
+                    f.write(data)
+                self.assets[asset_id] = {
+                    "topic": topic,
+                    "source": source,
+                    "path": path,
+                    "bytes": len(data),
+                    "ingested_at": datetime.now(timezone.utc).isoformat(),
+                    # Same bytes, same file_id: keep any upload of an identical image
+                    "file_ids": self.assets.get(asset_id, {}).get("file_ids", {})
+                }
+                by_source[source] = asset_id
+                ids_seen.add(asset_id)
+                stats["added"] += 1
+                logger.info(f"Ingested {source} -> {path} ({len(data) // 1024} KB)")
+
+        for asset_id in [a for a, asset in self.assets.items() if asset["source"] not in seen]:
+            logger.info(f"Removing media {asset_id}: {self.assets[asset_id]['source']} is gone")
+            self._remove(asset_id)
+            stats["removed"] += 1
+
+        self._index_topics()
+        self.save()
+        return stats
+
+    def _remove(self, asset_id: str):
+        asset = self.assets.pop(asset_id)
+        if os.path.exists(asset["path"]):
+            os.remove(asset["path"])
+
+    def save(self):
+        write_json_atomic(self.index_path, {"assets": self.assets})
+
+def main():
+    parser = argparse.ArgumentParser(description="Prepare images for media posts")
+    parser.add_argument('command', choices=['ingest', 'list'])
+    args = parser.parse_args()
+
+    library = MediaLibrary()
+    if args.command == 'ingest':
+        from catalog import get_catalog
+        catalog = get_catalog()
+        known = set(catalog.topics) | {record.group for record in catalog.records.values()}
+        stats = library.ingest(known)
+        print(f"{stats['added']} added, {stats['unchanged']} unchanged, {stats['removed']} removed, "
+              f"{stats['failed']} failed; {len(library)} assets")
+    else:
+        for topic in library.topics():
+            assets = library._by_topic[topic]
+            uploaded = sum(1 for asset_id in assets if library.file_id(asset_id))
+            print(f"{topic}: {len(assets)} images, {uploaded} uploaded")
+
+if __name__ == "__main__":
+    from logging_setup import setup_logging
+    setup_logging(log_file='')
+    main()
@@ -0,0 +1,314 @@
+"""
+In-process metrics with a Prometheus text-format HTTP endpoint
+
+Counters, gauges and histograms live in one registry; the bot's modules
+record into the module-level metrics below and MetricsServer exposes them
+at http://METRICS_HOST:METRICS_PORT/metrics.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LATENESS_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 15, 60, 300, 900)
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Tuple = ()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], lock: threading.Lock):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = lock
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    """Monotonic count, optionally split by labels"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def total(self) -> float:
+        """Sum across all label values"""
+        with self._lock:
+            return sum(self._values.values())
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram with sum and count, as Prometheus expects"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str], lock: threading.Lock,
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames, lock)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the with-block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self, **labels) -> Tuple[int, float]:
+        """(count, sum) observed for these labels"""
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return (state[2], state[1]) if state else (0, 0.0)
+
+    def _render_value(self, key, state) -> List[str]:
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, (("le", _format_value(bound)),))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+class MetricsRegistry:
+    """Named metrics plus collector callbacks run just before each scrape"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.metrics: Dict[str, _Metric] = {}
+        self.collectors: List[Callable[[], None]] = []
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames, self._lock))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, self._lock))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, self._lock, buckets))
+
+    def add_collector(self, collector: Callable[[], None]):
+        """Register a callback that refreshes gauges before rendering"""
+        self.collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], None]):
+        if collector in self.collectors:
+            self.collectors.remove(collector)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        for collector in list(self.collectors):
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+# Generation
+GENERATION_SECONDS = REGISTRY.histogram(
+    "sawacoco_generation_duration_seconds", "End-to-end time to produce a post", ["source"])
+OPENAI_REQUEST_SECONDS = REGISTRY.histogram(
+    "sawacoco_openai_request_duration_seconds", "Latency of one chat completion request",
+    ["target", "mode", "outcome"])
+HEDGES = REGISTRY.counter(
+    "sawacoco_hedged_requests_total", "Hedged completions (fired, primary_won, hedge_won)", ["outcome"])
+POSTS_GENERATED = REGISTRY.counter(
+    "sawacoco_posts_generated_total", "Posts produced, by source (openai, cache, fallback)", ["source"])
+FALLBACKS = REGISTRY.counter(
+    "sawacoco_fallbacks_total", "Generated content replaced by canned fallback content", ["reason"])
+CONTENT_REJECTED = REGISTRY.counter(
+    "sawacoco_content_rejected_total", "Completions discarded by validation or dedup", ["reason"])
+TOKENS = REGISTRY.counter(
+    "sawacoco_openai_tokens_total", "OpenAI tokens used", ["kind"])
+COST = REGISTRY.counter(
+    "sawacoco_openai_cost_usd_total", "Estimated OpenAI spend in USD")
+BUDGET_REMAINING = REGISTRY.gauge(
+    "sawacoco_budget_remaining_usd", "OpenAI spend left under a channel's cap this UTC day or month",
+    ["channel", "period"])
+
+CIRCUIT_STATE = REGISTRY.gauge(
+    "sawacoco_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)", ["name"])
+CIRCUIT_TRANSITIONS = REGISTRY.counter(
+    "sawacoco_circuit_transitions_total", "Circuit breaker state changes", ["name", "state"])
+CIRCUIT_REJECTED = REGISTRY.counter(
+    "sawacoco_circuit_rejected_total", "Calls refused without being attempted", ["name"])
+
+# Delivery
+SEND_SECONDS = REGISTRY.histogram(
+    "sawacoco_send_duration_seconds", "Time to deliver a post including rate limiting and retries", ["outcome"])
+POSTS_SENT = REGISTRY.counter(
+    "sawacoco_posts_sent_total", "Send outcomes (delivered, failed, queued, unconfirmed)", ["outcome"])
+TELEGRAM_ERRORS = REGISTRY.counter(
+    "sawacoco_telegram_errors_total", "Telegram API errors by type", ["error"])
+RETRY_QUEUE_SIZE = REGISTRY.gauge(
+    "sawacoco_retry_queue_size", "Posts waiting in the retry queue")
+
+# Scheduling
+SCHEDULER_LATENESS = REGISTRY.histogram(
+    "sawacoco_scheduler_lateness_seconds", "How late a slot fired after its scheduled time", (),
+    LATENESS_BUCKETS)
+POST_DRIFT = REGISTRY.histogram(
+    "sawacoco_post_drift_seconds", "Delay between a posting slot and delivery of its post", (),
+    LATENESS_BUCKETS)
+MISSED_SLOTS = REGISTRY.counter(
+    "sawacoco_missed_slots_total", "Slots skipped because they were past the misfire grace")
+QUEUE_DEPTH = REGISTRY.gauge(
+    "sawacoco_content_queue_depth", "Pre-generated posts waiting per channel", ["channel"])
+UP_SINCE = REGISTRY.gauge(
+    "sawacoco_start_time_seconds", "Unix time the bot started")
+LOG_RECORDS_DROPPED = REGISTRY.counter(
+    "sawacoco_log_records_dropped_total", "Log records dropped because the log writer fell behind")
+
+# Admin commands
+WEBHOOK_UPDATES = REGISTRY.counter(
+    "sawacoco_webhook_updates_total",
+    "Webhook updates by outcome (queued, duplicate, busy, handled, ignored, unauthorized, failed)", ["outcome"])
+COMMAND_SECONDS = REGISTRY.histogram(
+    "sawacoco_command_duration_seconds", "Time to handle an admin command including its reply", ["command"])
+
+def record_usage(usage, model: str = None):
+    """Count prompt/completion tokens and their estimated cost"""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    TOKENS.inc(prompt_tokens, kind="prompt")
+    TOKENS.inc(completion_tokens, kind="completion")
+    COST.inc(prompt_tokens / 1000 * Config.OPENAI_PROMPT_PRICE_PER_1K +
+             completion_tokens / 1000 * Config.OPENAI_COMPLETION_PRICE_PER_1K)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/metrics':
+            body = self.server.registry.render().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            status = 200
+        elif path == '/healthz':
+            body, content_type, status = b'ok\n', 'text/plain', 200
+        else:
+            body, content_type, status = b'not found\n', 'text/plain', 404
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class MetricsServer:
+    """Serves /metrics from a background thread"""
+
+    def __init__(self, host: str = None, port: int = None, registry: MetricsRegistry = None):
+        self.host = host or Config.METRICS_HOST
+        self.port = Config.METRICS_PORT if port is None else port
+        self.registry = registry or REGISTRY
+        self.httpd = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = self.registry
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Metrics available at {self.url}")
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+"""
+Local stand-in servers for the external APIs the bot talks to
+
+MockOpenAIServer speaks enough of the OpenAI REST API (chat completions,
+streamed or not, files and batches) to run ContentGenerator and
+BatchGenerator without live keys. Point OPENAI_BASE_URL at
+`server.base_url` to use it.
+
+MockTelegramServer answers the Bot API methods the bot calls (getMe,
+getChat, sendMessage, sendPhoto, sendMediaGroup, setWebhook). Point
+TELEGRAM_BASE_URL at `server.base_url`. `send_command` plays a user
+sending a command: it posts the update to the registered webhook the way
+Telegram does.
+
+Both servers can add latency and inject errors and 429 rate limiting,
+which benchmark.py uses for load tests.
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Language keys of the JSON skeleton a localized prompt asks for
+_LANGUAGE_KEY_RE = re.compile(r'"([\w-]+)": "\.\.\."')
+
+_WORDS = (
+    "coconut oil energy focus keto morning coffee brain fuel clean farms thailand harvest shell charcoal "
+    "grill shisha heat ash quality powder smoothie recipe ketone metabolism routine workout recovery "
+    "lab tested pure sustainable palm free bulk supply brands manufacturers creamy tropical natural"
+).split()
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    """Request handler with JSON helpers; `self.server.app` holds the mock state"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    def _send(self, status: int, body: bytes, content_type: str = 'application/json', headers: dict = None):
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the request, e.g. a cancelled hedge
+            self.close_connection = True
+
+    def _json(self, payload, status: int = 200, headers: dict = None):
+        self._send(status, json.dumps(payload).encode('utf-8'), headers=headers)
+
+    def _stream(self, events):
+        """Send server-sent events, one `data:` line per JSON payload, then [DONE]"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        try:
+            for event in events:
+                self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cut the stream early
+            self.server.app.streams_cut += 1
+
+    def log_message(self, format, *args):
+        pass
+
+class _OpenAIHandler(_JSONHandler):
+    def do_POST(self):
+        app = self.server.app
+        body = self._read_body()
+        path = self.path.split('?', 1)[0]
+        fault = app.inject_fault() if path.endswith('/chat/completions') else None
+        if fault:
+            status, payload, headers = fault
+            self._json(payload, status, headers)
+        elif path.endswith('/chat/completions'):
+            request = json.loads(body)
+            if request.get('stream'):
+                self._stream(app.chat_completion_chunks(request))
+            else:
+                status, payload = app.chat_completion(request)
+                self._json(payload, status)
+        elif path.endswith('/files'):
+            self._json(app.upload_file(self.headers.get('Content-Type', ''), body))
+        elif path.endswith('/batches'):
+            self._json(app.create_batch(json.loads(body)))
+        else:
+            self._json({"error": {"message": f"Unknown endpoint {path}"}}, 404)
+
+    def do_GET(self):
+        app = self.server.app
+        path = self.path.split('?', 1)[0]
+        parts = path.rstrip('/').split('/')
+        if '/batches/' in path:
+            batch = app.get_batch(parts[-1])
+            self._json(batch if batch else {"error": {"message": "No such batch"}}, 200 if batch else 404)
+        elif path.endswith('/content') and '/files/' in path:
+            content = app.files.get(parts[-2])
+            if content is None:
+                self._json({"error": {"message": "No such file"}}, 404)
+            else:
+                self._send(200, content, 'application/octet-stream')
+        else:
+            self._json({"error": {"message": f"Unknown endpoint {path}"}}, 404)
+
+class _MockServer:
+    """Threaded HTTP server with latency and fault injection
+
+    Every injectable request sleeps `latency` ± `jitter` seconds, then
+    fails with probability `error_rate` (HTTP 500) or `rate_limit_rate`
+    (HTTP 429 with a `retry_after` hint).
+    """
+
+    handler = _JSONHandler
+    path_prefix = ''
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, rate_limit_rate: float = 0.0, retry_after: int = 1, seed: int = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self.handler)
+        self.httpd.daemon_threads = True
+        self.httpd.request_queue_size = 1024
+        self.httpd.app = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{self.path_prefix}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _delay(self):
+        delay = self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _roll_fault(self) -> str:
+        """Count the request and decide whether it fails: None, 'error' or 'rate_limit'"""
+        self._delay()
+        with self._lock:
+            self.requests += 1
+            roll = self.random.random()
+            if roll < self.rate_limit_rate:
+                self.rate_limited += 1
+                return 'rate_limit'
+            if roll < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+                return 'error'
+        return None
+
+    def stats(self) -> dict:
+        return {"requests": self.requests, "errors": self.errors, "rate_limited": self.rate_limited}
+
+class MockOpenAIServer(_MockServer):
+    """In-process OpenAI-compatible server with canned, unique completions
+
+    Batches complete after `batch_polls` status checks. Streamed
+    completions are sent a few characters per chunk, `stream_delay`
+    seconds apart.
+    """
+
+    handler = _OpenAIHandler
+    path_prefix = '/v1'
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, batch_polls: int = 2,
+                 stream_delay: float = 0.01, **faults):
+        super().__init__(host, port, **faults)
+        self.batch_polls = batch_polls
+        self.stream_delay = stream_delay
+        self.streams_cut = 0
+        self.files = {}
+        self.batches = {}
+
+    def inject_fault(self):
+        """(status, payload, headers) for a failed completion, or None to serve it"""
+        fault = self._roll_fault()
+        if fault == 'rate_limit':
+            return 429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                   "code": "rate_limit_exceeded"}}, {"Retry-After": str(self.retry_after)}
+        if fault == 'error':
+            return 500, {"error": {"message": "The server had an error", "type": "server_error"}}, None
+        return None
+
+    def _completion_text(self, request: dict) -> str:
+        prompt = request["messages"][-1]["content"]
+        if (request.get("response_format") or {}).get("type") == "json_object":
+            # Localized request: one post per language key in the prompt's skeleton
+            return json.dumps({code: self._post_text(prompt, code) for code in _LANGUAGE_KEY_RE.findall(prompt)},
+                              ensure_ascii=False)
+        return self._post_text(prompt)
+
+    def _post_text(self, prompt: str, language: str = None) -> str:
+        words = " ".join(self.random.choice(_WORDS) for _ in range(24))
+        tag = f" [{language}]" if language else ""
+        return (f"🥥{tag} {prompt.split('.')[0]}. {words.capitalize()}. "
+                f"Fresh take #{uuid.uuid4().hex[:12]} from Thailand's coconut farms! ✨")
+
+    def _completion(self, request: dict) -> dict:
+        text = self._completion_text(request)
+        prompt_tokens = sum(len(m["content"].split()) for m in request["messages"])
+        completion_tokens = len(text.split())
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": text}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        }
+
+    def chat_completion(self, request: dict):
+        return 200, self._completion(request)
+
+    def chat_completion_chunks(self, request: dict):
+        """Yield chat.completion.chunk payloads for a streamed completion"""
+        text = self._completion_text(request)
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        def chunk(delta: dict, finish_reason=None) -> dict:
+            return {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": request.get("model", "mock"),
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+        yield chunk({"role": "assistant", "content": ""})
+        for start in range(0, len(text), 8):
+            time.sleep(self.stream_delay)
+            yield chunk({"content": text[start:start + 8]})
+        yield chunk({}, "stop")
+        if (request.get("stream_options") or {}).get("include_usage"):
+            usage = self._completion(request)["usage"]
+            yield dict(chunk({}), choices=[], usage=usage)
+
+    def upload_file(self, content_type: str, body: bytes) -> dict:
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body
+        )
+        content = b''
+        for part in message.iter_parts():
+            if part.get_filename():
+                content = part.get_payload(decode=True)
+        file_id = f"file-{uuid.uuid4().hex[:12]}"
+        self.files[file_id] = content
+        return {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": "batch.jsonl", "purpose": "batch", "status": "processed"}
+
+    def create_batch(self, request: dict) -> dict:
+        lines = [json.loads(line) for line in self.files[request["input_file_id"]].decode('utf-8').splitlines()
+                 if line.strip()]
+        output = "\n".join(json.dumps({
+            "id": f"batch_req_{uuid.uuid4().hex[:12]}",
+            "custom_id": line["custom_id"],
+            "response": {"status_code": 200, "request_id": uuid.uuid4().hex, "body": self._completion(line["body"])},
+            "error": None
+        }) for line in lines)
+        output_file_id = f"file-{uuid.uuid4().hex[:12]}"
+        self.files[output_file_id] = output.encode('utf-8')
+
+        batch_id = f"batch_{uuid.uuid4().hex[:12]}"
+        self.batches[batch_id] = {
+            "batch": {
+                "id": batch_id, "object": "batch", "endpoint": request["endpoint"],
+                "input_file_id": request["input_file_id"], "completion_window": request["completion_window"],
+                "status": "in_progress", "created_at": int(time.time()), "output_file_id": None,
+                "request_counts": {"total": len(lines), "completed": 0, "failed": 0}
+            },
+            "output_file_id": output_file_id,
+            "polls": 0
+        }
+        return self.batches[batch_id]["batch"]
+
+    def get_batch(self, batch_id: str):
+        entry = self.batches.get(batch_id)
+        if entry is None:
+            return None
+        entry["polls"] += 1
+        batch = entry["batch"]
+        if entry["polls"] >= self.batch_polls and batch["status"] == "in_progress":
+            batch.update(status="completed", output_file_id=entry["output_file_id"],
+                         completed_at=int(time.time()))
+            batch["request_counts"]["completed"] = batch["request_counts"]["total"]
+        return batch
+
+class _TelegramHandler(_JSONHandler):
+    def do_POST(self):
+        app = self.server.app
+        body = self._read_body()
+        # /bot<token>/<method>
+        method = self.path.split('?', 1)[0].rstrip('/').rsplit('/', 1)[-1]
+        content_type = self.headers.get('Content-Type') or ''
+        files = {}
+        if 'json' in content_type:
+            params = json.loads(body or b'{}')
+        elif content_type.startswith('multipart/'):
+            params, files = self._multipart(content_type, body)
+        else:
+            params = {key: values[-1] for key, values in parse_qs(body.decode('utf-8')).items()}
+        status, payload = app.call(method, params, files)
+        self._json(payload, status)
+
+    @staticmethod
+    def _multipart(content_type: str, body: bytes):
+        """Form fields and uploaded files of a multipart/form-data body"""
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body
+        )
+        params, files = {}, {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True)
+            if part.get_filename():
+                files[name] = payload
+            else:
+                params[name] = payload.decode('utf-8')
+        return params, files
+
+    do_GET = do_POST
+
+class MockTelegramServer(_MockServer):
+    """In-process Telegram Bot API stand-in that accepts every message
+
+    Delivered messages are counted per chat in `sent` and their text kept
+    in `messages`. 429 responses carry
+    `parameters.retry_after` like the real flood control. Uploaded photos
+    get a file_id that later sends can pass instead of the bytes; `uploads`
+    and `uploaded_bytes` count what actually came over the wire.
+    """
+
+    handler = _TelegramHandler
+    path_prefix = '/bot'
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, **faults):
+        super().__init__(host, port, **faults)
+        self.sent = {}
+        self._message_id = 0
+        self.photos = {}
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.messages = {}
+        self.webhook = {}
+        self._update_id = 0
+
+    def _chat(self, chat_id: str) -> dict:
+        chat_id = str(chat_id)
+        numeric = int(chat_id) if chat_id.lstrip('-').isdigit() else -1000000000000 - abs(hash(chat_id)) % 10 ** 9
+        return {"id": numeric, "type": "channel", "title": f"Mock {chat_id}",
+                "username": chat_id.lstrip('@') if chat_id.startswith('@') else None}
+
+    def _photo(self, ref: str, files: dict, field: str = None):
+        """PhotoSize list for a sent photo (a file_id, an attach:// upload or one in `field`), or None"""
+        ref = str(ref or '')
+        data = files.get(ref[len('attach://'):] if ref.startswith('attach://') else field)
+        if data is None:
+            return self.photos.get(ref)
+        with self._lock:
+            self.uploads += 1
+            self.uploaded_bytes += len(data)
+        file_id = f"AgAC{uuid.uuid4().hex}"
+        self.photos[file_id] = [{"file_id": f"{file_id}_s", "file_unique_id": uuid.uuid4().hex[:12],
+                                 "width": 90, "height": 90, "file_size": len(data) // 20},
+                                {"file_id": file_id, "file_unique_id": uuid.uuid4().hex[:12],
+                                 "width": 1280, "height": 1280, "file_size": len(data)}]
+        return self.photos[file_id]
+
+    def _message(self, chat_id: str, **fields) -> dict:
+        with self._lock:
+            self._message_id += 1
+            message_id = self._message_id
+            self.sent[chat_id] = self.sent.get(chat_id, 0) + 1
+            self.messages.setdefault(chat_id, []).append(fields.get('text') or fields.get('caption'))
+        return dict({"message_id": message_id, "date": int(time.time()), "chat": self._chat(chat_id)}, **fields)
+
+    def call(self, method: str, params: dict, files: dict = None):
+        files = files or {}
+        if method == 'getMe':
+            return 200, {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Mock",
+                                                "username": "mock_bot"}}
+        if method == 'getChat':
+            return 200, {"ok": True, "result": self._chat(params.get('chat_id'))}
+        if method == 'setWebhook':
+            self.webhook = {"url": params.get('url', ''), "secret_token": params.get('secret_token')}
+            return 200, {"ok": True, "result": True, "description": "Webhook was set"}
+        if method == 'deleteWebhook':
+            self.webhook = {}
+            return 200, {"ok": True, "result": True, "description": "Webhook was deleted"}
+        if method == 'getWebhookInfo':
+            return 200, {"ok": True, "result": {"url": self.webhook.get("url", ""), "pending_update_count": 0,
+                                                "has_custom_certificate": False}}
+        if method not in ('sendMessage', 'sendPhoto', 'sendMediaGroup'):
+            return 404, {"ok": False, "error_code": 404, "description": f"Not Found: method {method} not found"}
+
+        fault = self._roll_fault()
+        if fault == 'rate_limit':
+            return 429, {"ok": False, "error_code": 429,
+                         "description": f"Too Many Requests: retry after {self.retry_after}",
+                         "parameters": {"retry_after": self.retry_after}}
+        if fault == 'error':
+            return 500, {"ok": False, "error_code": 500, "description": "Internal Server Error"}
+
+        chat_id = str(params.get('chat_id'))
+        bad_file = {"ok": False, "error_code": 400, "description": "Bad Request: wrong file identifier/HTTP URL specified"}
+        if method == 'sendPhoto':
+            photo = self._photo(params.get('photo'), files, 'photo')
+            if photo is None:
+                return 400, bad_file
+            return 200, {"ok": True, "result": self._message(chat_id, photo=photo, caption=params.get('caption'))}
+        if method == 'sendMediaGroup':
+            media = params.get('media')
+            media = json.loads(media) if isinstance(media, str) else media
+            photos = [self._photo(item.get('media'), files) for item in media]
+            if None in photos:
+                return 400, bad_file
+            return 200, {"ok": True, "result": [self._message(chat_id, photo=photo, caption=item.get('caption'))
+                                                for item, photo in zip(media, photos)]}
+        return 200, {"ok": True, "result": self._message(chat_id, text=params.get('text', ''))}
+
+    def deliver_update(self, update: dict) -> int:
+        """POST an update to the registered webhook like Telegram does; returns the HTTP status"""
+        if not self.webhook.get("url"):
+            raise RuntimeError("No webhook registered (setWebhook was not called)")
+        request = urllib.request.Request(self.webhook["url"], data=json.dumps(update).encode('utf-8'),
+                                         headers={"Content-Type": "application/json"})
+        if self.webhook.get("secret_token"):
+            request.add_header("X-Telegram-Bot-Api-Secret-Token", self.webhook["secret_token"])
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def send_command(self, text: str, user_id: int, chat_id: int = None, update_id: int = None):
+        """Deliver a private message from `user_id` to the webhook; returns (update_id, HTTP status)
+
+        Pass an earlier `update_id` to replay a redelivery.
+        """
+        if update_id is None:
+            with self._lock:
+                self._update_id += 1
+                update_id = self._update_id
+        chat_id = user_id if chat_id is None else chat_id
+        update = {"update_id": update_id, "message": {
+            "message_id": update_id, "date": int(time.time()), "text": text,
+            "from": {"id": user_id, "is_bot": False, "first_name": "Admin"},
+            "chat": {"id": chat_id, "type": "private"}
+        }}
+        return update_id, self.deliver_update(update)
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["delivered"] = sum(self.sent.values())
+        stats["uploads"] = self.uploads
+        stats["uploaded_bytes"] = self.uploaded_bytes
+        return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run local OpenAI and Telegram stand-in servers")
+    parser.add_argument('--port', type=int, default=8100, help="OpenAI port")
+    parser.add_argument('--telegram-port', type=int, default=8101)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    faults = dict(latency=args.latency, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate)
+    openai_server = MockOpenAIServer(port=args.port, **faults)
+    telegram_server = MockTelegramServer(port=args.telegram_port, **faults).start()
+    print(f"Mock OpenAI API listening on {openai_server.base_url}")
+    print(f"Mock Telegram Bot API listening on {telegram_server.base_url}")
+    try:
+        openai_server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        telegram_server.stop()
@@ -0,0 +1,296 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+from circuit_breaker import CircuitBreaker
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class NoProviderAvailable(Exception):
+    """Raised when every target in a route is refused by its circuit breaker"""
+
+class Provider:
+    """One OpenAI-compatible endpoint with its pooled clients and circuit breaker
+
+    Clients are created on first use so importing openai/httpx (about half a
+    second) stays off the startup path.
+    """
+
+    def __init__(self, name: str, base_url: str = None, api_key: str = None, timeout: float = None,
+                 max_connections: int = None):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout or Config.OPENAI_TIMEOUT
+        self.max_connections = max_connections or Config.OPENAI_MAX_CONNECTIONS
+        self._client = None
+        self._async_client = None
+        self.breaker = CircuitBreaker(name)
+
+    @property
+    def client(self):
+        if self._client is None:
+            import openai
+            self._client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url, timeout=self.timeout)
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            import httpx
+            import openai
+            # Async client shares one pooled keep-alive connection set across all coroutines
+            self._async_client = openai.AsyncOpenAI(
+                api_key=self.api_key,
+                base_url=self.base_url,
+                timeout=self.timeout,
+                max_retries=0,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=self.max_connections,
+                        max_keepalive_connections=self.max_connections,
+                        keepalive_expiry=60
+                    ),
+                    timeout=self.timeout
+                )
+            )
+        return self._async_client
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.close()
+        if self._client is not None:
+            self._client.close()
+
+class Target:
+    """A model on a provider, written "provider:model" in routes"""
+
+    def __init__(self, provider: Provider, model: str):
+        self.provider = provider
+        self.model = model
+        self.key = f"{provider.name}:{model}"
+        self.latencies = deque(maxlen=200)
+
+    def quantile(self, q: float) -> float:
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def __repr__(self):
+        return f"Target({self.key!r})"
+
+class ModelRouter:
+    """Per-topic model selection with ordered fallback chains and hedged requests
+
+    A route is an ordered list of targets. Each call goes to the first
+    target whose circuit breaker allows it; outages move on to the next.
+    If the chosen target has not answered within its observed p95 latency
+    (clamped to the hedge bounds), a second request goes to the next
+    target in the chain (or the same one if it is alone) and the first
+    answer wins; the other request is cancelled. Hedges are capped at a
+    share of all requests so the tail fix does not double the bill.
+    """
+
+    def __init__(self, providers: Dict[str, Provider], routes: Dict[str, List[str]], hedge: Dict = None):
+        self.providers = providers
+        self.targets: Dict[str, Target] = {}
+        self.routes: Dict[str, List[Target]] = {}
+        for name, chain in routes.items():
+            if not chain:
+                raise ValueError(f"Route '{name}' has no targets")
+            self.routes[name] = [self._target(spec) for spec in chain]
+        if "default" not in self.routes:
+            raise ValueError("Routes need a 'default' entry")
+
+        hedge = hedge or {}
+        self.hedge_enabled = hedge.get("enabled", Config.HEDGE_ENABLED)
+        self.hedge_quantile = hedge.get("quantile", Config.HEDGE_QUANTILE)
+        self.hedge_min_delay = hedge.get("min_delay", Config.HEDGE_MIN_DELAY)
+        self.hedge_max_delay = hedge.get("max_delay", Config.HEDGE_MAX_DELAY)
+        self.hedge_min_samples = hedge.get("min_samples", Config.HEDGE_MIN_SAMPLES)
+        self.hedge_max_ratio = hedge.get("max_ratio", Config.HEDGE_MAX_RATIO)
+        self.requests = 0
+        self.hedges = 0
+
+    def _target(self, spec: str) -> Target:
+        provider_name, _, model = spec.partition(":")
+        if provider_name not in self.providers or not model:
+            raise ValueError(f"Invalid route target '{spec}' (expected provider:model with a known provider)")
+        if spec not in self.targets:
+            self.targets[spec] = Target(self.providers[provider_name], model)
+        return self.targets[spec]
+
+    @classmethod
+    def from_config(cls) -> "ModelRouter":
+        """Single OpenAI provider with OPENAI_MODEL followed by OPENAI_FALLBACK_MODELS"""
+        provider = Provider("openai", Config.OPENAI_BASE_URL, Config.OPENAI_API_KEY)
+        models = [Config.OPENAI_MODEL] + [m for m in Config.OPENAI_FALLBACK_MODELS if m != Config.OPENAI_MODEL]
+        return cls({"openai": provider}, {"default": [f"openai:{m}" for m in models]})
+
+    @classmethod
+    def load(cls, path: str = None) -> "ModelRouter":
+        """Router from the providers file if present, otherwise from the OpenAI settings"""
+        path = path or Config.PROVIDERS_FILE
+        if not path or not os.path.exists(path):
+            return cls.from_config()
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        providers = {
+            name: Provider(
+                name,
+                base_url=entry.get("base_url") or None,
+                api_key=os.getenv(entry.get("api_key_env", "OPENAI_API_KEY")) or "unused",
+                timeout=entry.get("timeout"),
+                max_connections=entry.get("max_connections")
+            )
+            for name, entry in data["providers"].items()
+        }
+        router = cls(providers, data["routes"], data.get("hedge"))
+        logger.info(f"Loaded {len(providers)} providers and {len(router.routes)} routes from {path}")
+        return router
+
+    @property
+    def default_target(self) -> Target:
+        return self.routes["default"][0]
+
+    def chain(self, topic: str = None, group: str = None) -> List[Target]:
+        """Targets for a topic: its own route, else its catalog group's, else the default"""
+        return self.routes.get(topic) or self.routes.get(group) or self.routes["default"]
+
+    def unavailable(self, chain: List[Target] = None) -> bool:
+        """True when every target in the chain is refusing calls"""
+        return all(target.provider.breaker.is_open() for target in chain or self.routes["default"])
+
+    @staticmethod
+    def is_outage(error: Exception) -> bool:
+        """Errors that say a provider is down, overloaded or unreachable"""
+        import httpx
+        import openai
+        return isinstance(error, (openai.APIConnectionError, openai.InternalServerError, openai.RateLimitError,
+                                  asyncio.TimeoutError, httpx.TransportError))
+
+    @contextmanager
+    def track(self, target: Target, mode: str):
+        """Time one request and feed its outcome to metrics, the latency window and the breaker"""
+        breaker = target.provider.breaker
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            duration = time.perf_counter() - started
+            metrics.OPENAI_REQUEST_SECONDS.observe(duration, target=target.key, mode=mode, outcome="error")
+            if self.is_outage(e):
+                breaker.record_failure(type(e).__name__)
+            else:
+                # The API answered (e.g. 400), so the provider itself is healthy
+                breaker.record_success(duration)
+            raise
+        except BaseException:
+            # Cancelled, e.g. the losing side of a hedge
+            breaker.release()
+            raise
+        duration = time.perf_counter() - started
+        metrics.OPENAI_REQUEST_SECONDS.observe(duration, target=target.key, mode=mode, outcome="ok")
+        target.latencies.append(duration)
+        breaker.record_success(duration)
+
+    def hedge_delay(self, target: Target) -> Optional[float]:
+        """Seconds to wait before hedging a request to `target`, or None to not hedge"""
+        if not self.hedge_enabled or len(target.latencies) < self.hedge_min_samples:
+            return None
+        if self.hedges >= self.hedge_max_ratio * self.requests:
+            return None
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, target.quantile(self.hedge_quantile)))
+
+    def complete(self, request: Dict, chain: List[Target]):
+        """Blocking completion along the fallback chain (no hedging); returns (response, target)"""
+        error = None
+        for target in chain:
+            if not target.provider.breaker.allow():
+                continue
+            try:
+                with self.track(target, "complete"):
+                    return target.provider.client.chat.completions.create(**dict(request, model=target.model)), target
+            except Exception as e:
+                if not self.is_outage(e):
+                    raise
+                error = e
+                logger.warning(f"{target.key} failed ({type(e).__name__}), trying the next target")
+        raise error or NoProviderAvailable(f"No provider available for {[t.key for t in chain]}")
+
+    async def acomplete(self, request: Dict, chain: List[Target], timeout: float = None):
+        """Completion along the fallback chain with hedging; returns (response, target)"""
+        error = None
+        tried = set()
+        for index, target in enumerate(chain):
+            if target.key in tried or not target.provider.breaker.allow():
+                continue
+            tried.add(target.key)
+            hedge = next((t for t in chain[index + 1:] if t.key not in tried), target)
+            try:
+                return await self._hedged(request, target, hedge, timeout, tried)
+            except Exception as e:
+                if not self.is_outage(e):
+                    raise
+                error = e
+                logger.warning(f"{target.key} failed ({type(e).__name__}), trying the next target")
+        raise error or NoProviderAvailable(f"No provider available for {[t.key for t in chain]}")
+
+    async def _call(self, target: Target, request: Dict, timeout: float = None):
+        client = target.provider.async_client
+        if timeout is not None:
+            client = client.with_options(timeout=timeout)
+        with self.track(target, "complete"):
+            return await client.chat.completions.create(**dict(request, model=target.model))
+
+    async def _hedged(self, request: Dict, primary: Target, hedge: Target, timeout: float = None,
+                      tried: set = None) -> Tuple[object, Target]:
+        """Race `primary` against a delayed request to `hedge`; the first success wins
+
+        A fired hedge target is added to `tried` so the fallback chain does not repeat it.
+        """
+        self.requests += 1
+        first = asyncio.ensure_future(self._call(primary, request, timeout))
+        tasks = {first: primary}
+        try:
+            delay = self.hedge_delay(primary)
+            if delay is None:
+                return await first, primary
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done:
+                return first.result(), primary
+            if not hedge.provider.breaker.allow():
+                return await first, primary
+
+            self.hedges += 1
+            if tried is not None:
+                tried.add(hedge.key)
+            metrics.HEDGES.inc(outcome="fired")
+            logger.info(f"{primary.key} slower than {delay:.2f}s, hedging to {hedge.key}")
+            second = asyncio.ensure_future(self._call(hedge, request, timeout))
+            tasks[second] = hedge
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        metrics.HEDGES.inc(outcome="hedge_won" if task is second else "primary_won")
+                        return task.result(), tasks[task]
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def aclose(self):
+        """Close every provider's connections"""
+        for provider in self.providers.values():
+            await provider.aclose()
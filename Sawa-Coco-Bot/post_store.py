@@ -0,0 +1,237 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import struct
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Mersenne prime modulus for the MinHash permutations
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+# Inserts between trims to max_entries; the table may run this far over the cap
+EVICT_EVERY = 50
+
+def prompt_hash(request: Dict) -> str:
+    """Stable hash of a completion request (model, messages, sampling params)"""
+    return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+class MinHasher:
+    """MinHash signatures over word shingles, for local near-duplicate detection"""
+
+    def __init__(self, num_perm: int = 64, shingle_size: int = 3, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        # Deterministic (a, b) pairs so signatures stay comparable across restarts
+        self.permutations = []
+        for i in range(num_perm):
+            digest = hashlib.sha256(f"{seed}:{i}".encode()).digest()
+            a, b = struct.unpack('<QQ', digest[:16])
+            self.permutations.append((a % (_PRIME - 1) + 1, b % _PRIME))
+
+    def shingles(self, text: str) -> set:
+        """Lowercased word n-grams of the text"""
+        words = _WORD_RE.findall(text.lower())
+        if len(words) < self.shingle_size:
+            return {" ".join(words)} if words else set()
+        return {" ".join(words[i:i + self.shingle_size]) for i in range(len(words) - self.shingle_size + 1)}
+
+    def signature(self, text: str) -> List[int]:
+        """MinHash signature of the text's shingle set"""
+        hashes = [struct.unpack('<Q', hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest())[0]
+                  for s in self.shingles(text)]
+        if not hashes:
+            return [_MAX_HASH] * self.num_perm
+        return [min(((a * h + b) % _PRIME) & _MAX_HASH for h in hashes) for a, b in self.permutations]
+
+    @staticmethod
+    def similarity(sig_a: List[int], sig_b: List[int]) -> float:
+        """Estimated Jaccard similarity of two signatures"""
+        return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / len(sig_a)
+
+class PostStore:
+    """On-disk store of generated posts, used as a completion cache and dedup history
+
+    Posts are keyed by (topic, post_type, prompt hash). Cached completions
+    younger than the TTL can be served to channels that have not posted
+    them yet. New content is checked against the MinHash signatures of
+    recent posts so near-duplicates can be rejected before they are
+    accepted. The table is trimmed to `max_entries` by least recent use,
+    every EVICT_EVERY inserts. Methods block on SQLite, so async callers
+    run them in a worker thread; the dedup check only reads memory.
+    """
+
+    def __init__(self, path: str = None, ttl_hours: float = None, max_entries: int = None,
+                 dedup_threshold: float = None, dedup_window: int = None):
+        self.path = path or Config.POST_STORE_FILE
+        self.ttl = (ttl_hours if ttl_hours is not None else Config.POST_STORE_TTL_HOURS) * 3600
+        self.max_entries = Config.POST_STORE_MAX_ENTRIES if max_entries is None else max_entries
+        self.dedup_threshold = Config.DEDUP_THRESHOLD if dedup_threshold is None else dedup_threshold
+        self.dedup_window = Config.DEDUP_WINDOW if dedup_window is None else dedup_window
+        self.hasher = MinHasher()
+        self._lock = threading.Lock()
+        self._inserts = 0
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS posts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT NOT NULL,
+                post_type TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                body TEXT NOT NULL,
+                post_json TEXT NOT NULL,
+                signature TEXT NOT NULL,
+                served_to TEXT NOT NULL DEFAULT '[]',
+                source TEXT NOT NULL DEFAULT 'openai',
+                language TEXT NOT NULL DEFAULT '',
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._migrate()
+        self.conn.execute("CREATE INDEX IF NOT EXISTS posts_key ON posts (topic, post_type, prompt_hash)")
+        self.conn.commit()
+
+        # Recent signatures stay in memory so the similarity check never touches disk
+        rows = self.conn.execute(
+            "SELECT id, signature FROM posts ORDER BY id DESC LIMIT ?", (self.dedup_window,)
+        ).fetchall()
+        self.recent = [(row_id, json.loads(sig)) for row_id, sig in reversed(rows)]
+
+    def _migrate(self):
+        """Add columns introduced after a store file was first created"""
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(posts)")}
+        if 'source' not in columns:
+            self.conn.execute("ALTER TABLE posts ADD COLUMN source TEXT NOT NULL DEFAULT 'openai'")
+        if 'language' not in columns:
+            # Rows from before localized channels were all written in the default language
+            self.conn.execute("ALTER TABLE posts ADD COLUMN language TEXT NOT NULL DEFAULT ''")
+            self.conn.execute("UPDATE posts SET language = ?", (Config.DEFAULT_LANGUAGE,))
+
+    def find_near_duplicate(self, body: str) -> Optional[float]:
+        """Return the highest similarity to a recent post if it crosses the threshold"""
+        signature = self.hasher.signature(body)
+        # Copy: add() may trim the list from a worker thread
+        best = max((MinHasher.similarity(signature, sig) for _, sig in list(self.recent)), default=0.0)
+        return best if best >= self.dedup_threshold else None
+
+    def get_cached(self, topic: str, post_type: str, key_hash: str, channel_id: str) -> Optional[Dict]:
+        """A fresh cached post for this request that `channel_id` has not been served yet"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, post_json, served_to FROM posts "
+                "WHERE topic = ? AND post_type = ? AND prompt_hash = ? AND created_at >= ? "
+                "ORDER BY created_at DESC",
+                (topic, post_type, key_hash, cutoff)
+            ).fetchall()
+            for row_id, post_json, served_to in rows:
+                served_to = json.loads(served_to)
+                if channel_id not in served_to:
+                    self._mark_served(row_id, channel_id, served_to)
+                    self.conn.commit()
+                    return dict(json.loads(post_json), post_id=row_id)
+        return None
+
+    def add(self, post: Dict, key_hash: str, channel_id: str = None) -> int:
+        """Store an accepted post and return its id (also set as post['post_id'])"""
+        now = time.time()
+        signature = self.hasher.signature(post['body'])
+        # The row id is added back on read, so the post is written in a single INSERT
+        post.pop('post_id', None)
+        with self._lock:
+            cursor = self.conn.execute(
+                "INSERT INTO posts (topic, post_type, prompt_hash, body, post_json, signature, served_to, "
+                "source, language, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (post['topic'], post['post_type'], key_hash, post['body'], json.dumps(post, ensure_ascii=False),
+                 json.dumps(signature), json.dumps([channel_id] if channel_id else []),
+                 post.get('source', 'openai'), post.get('language', Config.DEFAULT_LANGUAGE), now, now)
+            )
+            post['post_id'] = cursor.lastrowid
+            self._inserts += 1
+            if self._inserts % EVICT_EVERY == 0:
+                self._evict()
+            self.conn.commit()
+            self.recent.append((cursor.lastrowid, signature))
+            del self.recent[:len(self.recent) - self.dedup_window]
+        return post['post_id']
+
+    def take_unserved(self, channel_id: str, topics: List[str], limit: int, source: str = 'batch',
+                      language: str = None, fresh: bool = False) -> List[Dict]:
+        """Claim up to `limit` stored posts on `topics` in `language` that `channel_id` has not posted
+
+        Bulk-generated posts are planned ahead, so they are not subject to the
+        cache TTL; `fresh` limits the claim to posts younger than it.
+        """
+        if limit <= 0:
+            return []
+        placeholders = ",".join("?" * len(topics))
+        cutoff = time.time() - self.ttl if fresh else 0
+        posts = []
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT id, post_json, served_to FROM posts WHERE source = ? AND language = ? "
+                f"AND topic IN ({placeholders}) AND created_at >= ? ORDER BY id ASC",
+                (source, language or Config.DEFAULT_LANGUAGE, *topics, cutoff)
+            ).fetchall()
+            for row_id, post_json, served_to in rows:
+                served_to = json.loads(served_to)
+                if channel_id in served_to:
+                    continue
+                self._mark_served(row_id, channel_id, served_to)
+                posts.append(dict(json.loads(post_json), post_id=row_id))
+                if len(posts) >= limit:
+                    break
+            if posts:
+                self.conn.commit()
+        return posts
+
+    def mark_served(self, post_id: int, channel_id: str):
+        """Record that a post went to a channel so it is not served there again"""
+        self.mark_served_many([(post_id, channel_id)])
+
+    def mark_served_many(self, served: List[tuple]):
+        """`mark_served` for several (post_id, channel_id) pairs in one transaction"""
+        with self._lock:
+            for post_id, channel_id in served:
+                self._mark_served(post_id, channel_id)
+            self.conn.commit()
+
+    def _mark_served(self, post_id: int, channel_id: str, served_to: List[str] = None):
+        """Add a channel to a post's served_to; the caller commits"""
+        if served_to is None:
+            row = self.conn.execute("SELECT served_to FROM posts WHERE id = ?", (post_id,)).fetchone()
+            if row is None:
+                return
+            served_to = json.loads(row[0])
+        if channel_id not in served_to:
+            served_to.append(channel_id)
+        self.conn.execute("UPDATE posts SET served_to = ?, last_used = ? WHERE id = ?",
+                          (json.dumps(served_to), time.time(), post_id))
+
+    def _evict(self):
+        """Trim the table to max_entries, dropping least recently used rows"""
+        (count,) = self.conn.execute("SELECT COUNT(*) FROM posts").fetchone()
+        excess = count - self.max_entries
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM posts WHERE id IN (SELECT id FROM posts ORDER BY last_used ASC LIMIT ?)",
+                (excess,)
+            )
+            logger.info(f"Evicted {excess} posts from {self.path}")
+
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
@@ -0,0 +1,294 @@
+"""
+Slot leases and channel sharding across bot replicas
+
+Every scheduled post is claimed as a lease on (channel, slot) before it is
+generated or sent, so when several replicas run at once (rolling deploys,
+`numReplicas` > 1) exactly one of them posts each slot. Replicas heartbeat
+into the same store; each channel's primary is picked by rendezvous hashing
+over the live replicas, and the others act as hot spares that only claim a
+slot once its primary has had `standby_delay` seconds to do so.
+
+The default store is a SQLite file (replicas sharing a volume or host);
+LEASE_STORE_URL=redis://... uses Redis or any server speaking its protocol,
+which needs the optional `redis` package.
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class SQLiteLeaseStore:
+    """Leases in a SQLite table; atomic across processes that share the file"""
+
+    def __init__(self, path: str = None):
+        self.path = path or Config.LEASE_STORE_FILE
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                done INTEGER NOT NULL DEFAULT 0,
+                expires_at REAL NOT NULL
+            )
+        """)
+
+    def claim(self, key: str, owner: str, ttl: float) -> bool:
+        """Take the lease unless someone else holds it or it is done"""
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute(
+                    "SELECT owner, done, expires_at FROM leases WHERE key = ?", (key,)
+                ).fetchone()
+                if row and row[2] > now and (row[1] or row[0] != owner):
+                    self.conn.execute("ROLLBACK")
+                    return False
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO leases (key, owner, done, expires_at) VALUES (?, ?, 0, ?)",
+                    (key, owner, now + ttl)
+                )
+                self.conn.execute("COMMIT")
+                return True
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def is_done(self, key: str) -> bool:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM leases WHERE key = ? AND done = 1 AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row is not None
+
+    def complete(self, key: str, owner: str, keep: float):
+        """Mark a held lease done so nobody claims it again for `keep` seconds"""
+        with self._lock:
+            self.conn.execute(
+                "UPDATE leases SET done = 1, expires_at = ? WHERE key = ? AND owner = ?",
+                (time.time() + keep, key, owner)
+            )
+
+    def release(self, key: str, owner: str):
+        """Give up a held lease that was not completed so another replica can take it"""
+        with self._lock:
+            self.conn.execute("DELETE FROM leases WHERE key = ? AND owner = ? AND done = 0", (key, owner))
+
+    def heartbeat(self, member: str, ttl: float):
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO leases (key, owner, done, expires_at) VALUES (?, ?, 0, ?)",
+                (f"member:{member}", member, now + ttl)
+            )
+            self.conn.execute("DELETE FROM leases WHERE expires_at < ?", (now,))
+
+    def leave(self, member: str):
+        with self._lock:
+            self.conn.execute("DELETE FROM leases WHERE key = ?", (f"member:{member}",))
+
+    def members(self) -> List[str]:
+        """Replicas with a live heartbeat"""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT owner FROM leases WHERE key LIKE 'member:%' AND expires_at > ?", (time.time(),)
+            ).fetchall()
+        return sorted(row[0] for row in rows)
+
+    def close(self):
+        self.conn.close()
+
+class RedisLeaseStore:
+    """Leases as Redis keys with expiry; shared by replicas on different hosts"""
+
+    # Compare-and-set on the owner so a replica never touches a lease it lost
+    _COMPLETE = ("if redis.call('get', KEYS[1]) == ARGV[1] then "
+                 "return redis.call('set', KEYS[1], 'done', 'PX', ARGV[2]) end")
+    _RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end"
+
+    def __init__(self, url: str, prefix: str = "sawacoco:"):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("LEASE_STORE_URL points at Redis but the 'redis' package is not installed "
+                               "(pip install redis)") from e
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+
+    def claim(self, key: str, owner: str, ttl: float) -> bool:
+        key = self.prefix + key
+        if self.client.set(key, owner, nx=True, px=int(ttl * 1000)):
+            return True
+        # Re-claiming our own unfinished lease (e.g. a retried slot) refreshes it
+        return self.client.get(key) == owner and bool(self.client.pexpire(key, int(ttl * 1000)))
+
+    def is_done(self, key: str) -> bool:
+        return self.client.get(self.prefix + key) == "done"
+
+    def complete(self, key: str, owner: str, keep: float):
+        self.client.eval(self._COMPLETE, 1, self.prefix + key, owner, int(keep * 1000))
+
+    def release(self, key: str, owner: str):
+        self.client.eval(self._RELEASE, 1, self.prefix + key, owner)
+
+    def heartbeat(self, member: str, ttl: float):
+        now = time.time()
+        members = self.prefix + "members"
+        pipe = self.client.pipeline()
+        pipe.zadd(members, {member: now + ttl})
+        pipe.zremrangebyscore(members, 0, now)
+        pipe.execute()
+
+    def leave(self, member: str):
+        self.client.zrem(self.prefix + "members", member)
+
+    def members(self) -> List[str]:
+        return sorted(self.client.zrangebyscore(self.prefix + "members", time.time(), "+inf"))
+
+    def close(self):
+        self.client.close()
+
+def make_lease_store(url: str = None):
+    """Store for LEASE_STORE_URL: redis:// or rediss:// for Redis, a file path (or empty) for SQLite"""
+    url = Config.LEASE_STORE_URL if url is None else url
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisLeaseStore(url)
+    return SQLiteLeaseStore(url or None)
+
+def default_replica_id() -> str:
+    return os.getenv('RAILWAY_REPLICA_ID') or f"{socket.gethostname()}-{os.getpid()}"
+
+class ReplicaCoordinator:
+    """Shards channels across live replicas and makes each (channel, slot) post exactly once
+
+    Store calls are blocking (SQLite file locks, Redis round-trips), so they
+    run in a worker thread.
+    """
+
+    def __init__(self, store=None, replica_id: str = None, lease_seconds: float = None,
+                 standby_delay: float = None, heartbeat_interval: float = None):
+        self.store = store or make_lease_store()
+        self.replica_id = replica_id or Config.REPLICA_ID or default_replica_id()
+        self.lease_seconds = lease_seconds or Config.POST_LEASE_SECONDS
+        self.standby_delay = Config.STANDBY_DELAY_SECONDS if standby_delay is None else standby_delay
+        self.heartbeat_interval = heartbeat_interval or Config.REPLICA_HEARTBEAT_SECONDS
+        # A done lease outlives any catch-up window so a restarted replica never reposts the slot
+        self.done_keep = max(2 * 86400, Config.CATCHUP_WINDOW_MINUTES * 60 * 2)
+        self.members: List[str] = [self.replica_id]
+        self._stopped = asyncio.Event()
+        self._run_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def slot_key(channel_id: str, slot: datetime) -> str:
+        return f"post:{channel_id}:{slot.astimezone(timezone.utc).isoformat()}"
+
+    def _rank(self, channel_id: str) -> List[str]:
+        """Live replicas in preference order for a channel (rendezvous hashing)"""
+        def weight(member: str) -> bytes:
+            return hashlib.sha256(f"{member}|{channel_id}".encode('utf-8')).digest()
+        return sorted(self.members, key=weight, reverse=True)
+
+    def owns(self, channel_id: str) -> bool:
+        """Whether this replica is the channel's primary (generates and posts it first)"""
+        return self._rank(str(channel_id))[0] == self.replica_id
+
+    def standby_rank(self, channel_id: str) -> int:
+        """0 for the primary, 1 for the first spare, and so on"""
+        ranked = self._rank(str(channel_id))
+        return ranked.index(self.replica_id) if self.replica_id in ranked else len(ranked)
+
+    async def heartbeat(self):
+        """Announce this replica and refresh the member list"""
+        await asyncio.to_thread(self.store.heartbeat, self.replica_id, self.heartbeat_interval * 3)
+        members = await asyncio.to_thread(self.store.members)
+        if self.replica_id not in members:
+            members = sorted(members + [self.replica_id])
+        if members != self.members:
+            logger.info(f"Replicas now {members} (this is {self.replica_id})")
+        self.members = members
+
+    async def run(self):
+        """Heartbeat until stopped; `stop` then leaves so spares take over right away"""
+        self._run_task = asyncio.current_task()
+        self._stopped.clear()
+        while not self._stopped.is_set():
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                logger.error(f"Replica heartbeat failed: {e}")
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=self.heartbeat_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def claim(self, channel_id: str, slot: datetime) -> bool:
+        """Claim a channel's slot; False means another replica posted or is posting it
+
+        The primary tries once. Spares wait `standby_delay` per rank, then keep
+        polling while the slot is held but not done, so they take over if the
+        primary releases it or dies and its lease runs out.
+        """
+        key = self.slot_key(channel_id, slot)
+        rank = self.standby_rank(channel_id)
+        if rank:
+            await asyncio.sleep(self.standby_delay * rank)
+        deadline = time.monotonic() + self.lease_seconds
+        while True:
+            if await asyncio.to_thread(self.store.claim, key, self.replica_id, self.lease_seconds):
+                if rank:
+                    logger.warning(f"Standby {self.replica_id} took over {channel_id} for slot {slot.isoformat()}")
+                return True
+            if not rank or time.monotonic() > deadline or await asyncio.to_thread(self.store.is_done, key):
+                return False
+            await asyncio.sleep(self.standby_delay)
+
+    async def complete(self, channel_id: str, slot: datetime):
+        await asyncio.to_thread(self.store.complete, self.slot_key(channel_id, slot), self.replica_id,
+                                self.done_keep)
+
+    async def release(self, channel_id: str, slot: datetime):
+        await asyncio.to_thread(self.store.release, self.slot_key(channel_id, slot), self.replica_id)
+
+    async def claim_update(self, update_id: int) -> bool:
+        """Take a Telegram update for this replica only; False if a replica already took it
+
+        The lease is marked done at once, so a redelivered update is never
+        handled twice even if its handler failed.
+        """
+        key = f"update:{update_id}"
+        if not await asyncio.to_thread(self.store.claim, key, self.replica_id, self.lease_seconds):
+            return False
+        await asyncio.to_thread(self.store.complete, key, self.replica_id, self.done_keep)
+        return True
+
+    async def stop(self, timeout: float = 15):
+        self._stopped.set()
+        # Let a heartbeat in progress finish first: its worker thread cannot be
+        # cancelled and would otherwise re-register this replica after it left
+        task = self._run_task
+        if task and not task.done() and task is not asyncio.current_task():
+            _, pending = await asyncio.wait({task}, timeout=timeout)
+            if pending:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        try:
+            await asyncio.to_thread(self.store.leave, self.replica_id)
+        except Exception as e:
+            logger.warning(f"Could not deregister replica {self.replica_id}: {e}")
+        self.store.close()
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+import metrics
+from config import Config
+from storage import DebouncedJsonWriter, read_json
+
+logger = logging.getLogger(__name__)
+
+CATCHUP_POLICIES = ("skip", "latest", "all")
+
+def parse_posting_times(posting_times: List[str]) -> List[Tuple[int, int]]:
+    """Parse "HH:MM" (or bare "HH") strings into sorted (hour, minute) pairs"""
+    slots = set()
+    for time_str in posting_times:
+        time_str = time_str.strip()
+        if not time_str:
+            continue
+        hour, _, minute = time_str.partition(':')
+        hour, minute = int(hour), int(minute or 0)
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(f"Invalid posting time: {time_str}")
+        slots.add((hour, minute))
+    return sorted(slots)
+
+class SchedulerState:
+    """Durable record of the last fired slot per schedule and the last posted slot per channel
+
+    Lets a restarted bot tell which slots were missed while it was down and
+    which channels never got the post of a slot that was interrupted.
+    Changes are written off the event loop, batched over STATE_SAVE_DELAY.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or Config.SCHEDULER_STATE_FILE
+        data = read_json(self.path, {})
+        self.fired: Dict[str, str] = data.get("fired", {})
+        self.posted: Dict[str, str] = data.get("posted", {})
+        self._saver = DebouncedJsonWriter(self.path, self._snapshot, Config.STATE_SAVE_DELAY)
+
+    def last_fired(self, key: str) -> Optional[datetime]:
+        value = self.fired.get(key)
+        return datetime.fromisoformat(value) if value else None
+
+    def last_posted(self, channel_id: str) -> Optional[datetime]:
+        value = self.posted.get(str(channel_id))
+        return datetime.fromisoformat(value) if value else None
+
+    def record_fired(self, key: str, slot: datetime):
+        self.fired[key] = slot.astimezone(timezone.utc).isoformat()
+        self._saver.mark_dirty()
+
+    def record_posted(self, channel_id: str, slot: datetime):
+        """The channel's post for `slot` was sent or handed to the retry queue"""
+        self.posted[str(channel_id)] = slot.astimezone(timezone.utc).isoformat()
+        self._saver.mark_dirty()
+
+    async def close(self):
+        """Write changes that are not on disk yet"""
+        await self._saver.close()
+
+    def _snapshot(self) -> Dict[str, Dict[str, str]]:
+        return {"fired": dict(self.fired), "posted": dict(self.posted)}
+
+class PostScheduler:
+    """Fires a coroutine at fixed local times of day inside the running event loop
+
+    Each wait sleeps until the next due slot instead of polling. Slots are
+    computed in the configured timezone and converted to UTC, so DST shifts
+    are handled by zoneinfo: a slot inside a spring-forward gap fires right
+    after the gap and an ambiguous fall-back slot fires once. Long waits are
+    split into `max_sleep` chunks so wall-clock jumps are noticed.
+
+    With a `state`, the last fired slot survives restarts. Slots missed
+    while the bot was down are handled by `catchup`: "skip" drops them,
+    "latest" fires only the most recent one and "all" fires each of them,
+    in both cases only if they are at most `catchup_window` seconds old.
+    """
+
+    def __init__(self, posting_times: List[str], callback: Callable[[datetime], Awaitable],
+                 tz: str = 'UTC', max_sleep: float = 3600, misfire_grace: float = 300,
+                 state: SchedulerState = None, state_key: str = None, catchup: str = None,
+                 catchup_window: float = None):
+        self.slots = parse_posting_times(posting_times)
+        if not self.slots:
+            raise ValueError("No posting times configured")
+        self.callback = callback
+        self.tz = ZoneInfo(tz)
+        self.max_sleep = max_sleep
+        self.misfire_grace = misfire_grace
+        self.state = state
+        self.state_key = state_key
+        self.catchup = catchup or Config.CATCHUP_POLICY
+        if self.catchup not in CATCHUP_POLICIES:
+            raise ValueError(f"Unknown catch-up policy {self.catchup!r} (expected one of {CATCHUP_POLICIES})")
+        self.catchup_window = Config.CATCHUP_WINDOW_MINUTES * 60 if catchup_window is None else catchup_window
+        self.last_fired = state.last_fired(state_key) if state and state_key else None
+        self._stopped = asyncio.Event()
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self) -> Set[asyncio.Task]:
+        """Posts fired by this scheduler that have not finished yet"""
+        return set(self._tasks)
+
+    def _slot_instant(self, day, hour: int, minute: int) -> datetime:
+        """Resolve a local wall-clock slot on `day` to a UTC instant"""
+        local = datetime(day.year, day.month, day.day, hour, minute, tzinfo=self.tz)
+        return local.astimezone(timezone.utc)
+
+    def next_fire_times(self, count: int = 1, after: datetime = None) -> List[datetime]:
+        """Return the next `count` fire times strictly after `after` (default: now), in local time"""
+        if after is None:
+            after = datetime.now(timezone.utc)
+        day = after.astimezone(self.tz).date() - timedelta(days=1)
+        fire_times = []
+        while len(fire_times) < count:
+            for hour, minute in self.slots:
+                instant = self._slot_instant(day, hour, minute)
+                if instant > after and instant not in fire_times:
+                    fire_times.append(instant)
+            day += timedelta(days=1)
+        fire_times.sort()
+        return [t.astimezone(self.tz) for t in fire_times[:count]]
+
+    def _advance(self, slot: datetime):
+        """Move the cursor past a slot and persist it"""
+        self.last_fired = slot
+        if self.state and self.state_key:
+            self.state.record_fired(self.state_key, slot)
+
+    def _fire(self, slot: datetime):
+        task = asyncio.create_task(self.callback(slot))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _catch_up(self, now: datetime):
+        """Apply the catch-up policy to slots that passed while the scheduler was not running"""
+        if self.last_fired is None:
+            return
+        window_start = now - timedelta(seconds=self.catchup_window)
+        missed = []
+        cursor = max(self.last_fired, window_start)
+        while True:
+            slot = self.next_fire_times(1, after=cursor)[0].astimezone(timezone.utc)
+            if slot > now:
+                break
+            missed.append(slot)
+            cursor = slot
+        older = self.next_fire_times(1, after=self.last_fired)[0].astimezone(timezone.utc) < window_start
+
+        if self.catchup == "all":
+            due = missed
+        elif self.catchup == "latest":
+            due = missed[-1:]
+        else:
+            due = []
+        if missed or older:
+            logger.warning(f"Missed slots while stopped ({'including some older than the catch-up window, ' if older else ''}"
+                           f"{len(missed)} within it); policy '{self.catchup}' fires {[s.isoformat() for s in due]}")
+        for slot in due:
+            logger.info(f"Catching up slot {slot.isoformat()} ({(now - slot).total_seconds():.0f}s late)")
+            self._fire(slot)
+        if missed:
+            self._advance(missed[-1])
+        elif older:
+            self._advance(window_start)
+
+    async def run(self):
+        """Sleep until each due slot and fire the callback, until stopped"""
+        self._stopped.clear()
+        started_at = datetime.now(timezone.utc)
+        self._catch_up(started_at)
+        logger.info(f"Scheduler running in {self.tz.key}, next posts at: "
+                    f"{[t.isoformat() for t in self.next_fire_times(len(self.slots))]}")
+
+        while not self._stopped.is_set():
+            now = datetime.now(timezone.utc)
+            next_fire = self.next_fire_times(1, after=self.last_fired or started_at)[0]
+            delay = (next_fire - now).total_seconds()
+
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), timeout=min(delay, self.max_sleep))
+                except asyncio.TimeoutError:
+                    pass
+                # Re-evaluate against the wall clock after every wake-up
+                continue
+
+            self._advance(next_fire)
+            if -delay > self.misfire_grace:
+                logger.warning(f"Skipping missed slot {next_fire.isoformat()} ({-delay:.0f}s late)")
+                metrics.MISSED_SLOTS.inc()
+                continue
+
+            logger.info(f"Firing slot {next_fire.isoformat()} ({-delay:.3f}s late)")
+            metrics.SCHEDULER_LATENESS.observe(-delay)
+            self._fire(next_fire)
+
+    def stop(self):
+        """Stop the scheduler loop; already fired posts keep running"""
+        self._stopped.set()
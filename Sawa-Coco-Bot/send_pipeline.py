@@ -0,0 +1,334 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+import httpx
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError, TimedOut
+
+import metrics
+from config import Config
+from storage import DebouncedJsonWriter, read_json
+
+logger = logging.getLogger(__name__)
+
+# Captions are capped at 1024 characters, counted in UTF-16 code units like message text
+CAPTION_MAX_LENGTH = 1024
+
+# Timeouts raised before Telegram could have received the whole request; anything else may have gone through
+_UNSENT_TIMEOUTS = (httpx.ConnectTimeout, httpx.PoolTimeout, httpx.WriteTimeout)
+
+def telegram_length(text: str) -> int:
+    """Length of text as Telegram counts it (UTF-16 code units)"""
+    return len(text.encode('utf-16-le')) // 2
+
+class TokenBucket:
+    """Token bucket that hands out reservations instead of blocking
+
+    Each reservation takes a token immediately and returns how long the
+    caller must wait for it, so concurrent callers queue up in order
+    without a lock. `pause` blocks the bucket, e.g. for a flood-control
+    retry_after.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self) -> float:
+        """Take one token and return the seconds to wait before using it"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def pause(self, seconds: float):
+        """Hand out no tokens for the next `seconds`"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class SendRateLimiter:
+    """Per-chat and global token buckets tuned to Telegram's documented limits"""
+
+    def __init__(self, global_rate: float = None, chat_rate_per_minute: float = None, chat_burst: float = None):
+        self.global_bucket = TokenBucket(global_rate or Config.TELEGRAM_GLOBAL_RATE,
+                                         global_rate or Config.TELEGRAM_GLOBAL_RATE)
+        self.chat_rate = (chat_rate_per_minute or Config.TELEGRAM_CHAT_RATE_PER_MINUTE) / 60
+        self.chat_burst = chat_burst or Config.TELEGRAM_CHAT_BURST
+        self.chat_buckets: Dict[str, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: str) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def acquire(self, chat_id: str):
+        """Wait until both the chat and the global budget allow one more message"""
+        bucket = self._chat_bucket(chat_id)
+        wait = max(bucket.reserve(), self.global_bucket.reserve())
+        while wait > 0:
+            await asyncio.sleep(wait)
+            # A retry_after may have paused the chat while this reservation waited
+            wait = bucket.blocked_until - time.monotonic()
+
+    def pause_chat(self, chat_id: str, seconds: float):
+        """Back off a chat after a flood-control response"""
+        self._chat_bucket(chat_id).pause(seconds)
+
+class RetryQueue:
+    """Durable queue of posts that could not be delivered, retried in the background
+
+    Changes are written off the event loop, batched over STATE_SAVE_DELAY.
+    """
+
+    def __init__(self, path: str = None, max_age_hours: float = None):
+        self.path = path or Config.RETRY_QUEUE_FILE
+        self.max_age = timedelta(hours=max_age_hours or Config.RETRY_QUEUE_MAX_AGE_HOURS)
+        self.entries: List[Dict] = read_json(self.path, [])
+        self._saver = DebouncedJsonWriter(self.path, lambda: list(self.entries), Config.STATE_SAVE_DELAY)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, chat_id: str, text: str, error: str, attempts: int, failed_at: str = None,
+            media: List[str] = None):
+        """Record an undeliverable post; `media` lists media library assets still to send with it"""
+        entry = {
+            "chat_id": chat_id,
+            "text": text,
+            "error": error,
+            "attempts": attempts,
+            "failed_at": failed_at or datetime.now(timezone.utc).isoformat()
+        }
+        if media:
+            entry["media"] = list(media)
+        self.entries.append(entry)
+        self._saver.mark_dirty()
+
+    def take_all(self) -> List[Dict]:
+        """Remove and return every entry still young enough to be worth sending"""
+        cutoff = datetime.now(timezone.utc) - self.max_age
+        entries, self.entries = self.entries, []
+        fresh = [e for e in entries if datetime.fromisoformat(e['failed_at']) >= cutoff]
+        if len(fresh) < len(entries):
+            logger.warning(f"Dropping {len(entries) - len(fresh)} expired posts from retry queue")
+        self._saver.mark_dirty()
+        return fresh
+
+    async def close(self):
+        """Write changes that are not on disk yet"""
+        await self._saver.close()
+
+class SendPipeline:
+    """Rate-limited Telegram sender with backoff, retry_after handling and a retry queue
+
+    Posts with media go out as a photo (or album) with the text as its
+    caption when it fits, otherwise as the photos followed by the text.
+    Images come from the media library and are sent by cached file_id once
+    Telegram has them.
+    """
+
+    def __init__(self, bot, limiter: SendRateLimiter = None, retry_queue: RetryQueue = None,
+                 max_attempts: int = None, base_delay: float = None, max_delay: float = None,
+                 media_library=None):
+        self.bot = bot
+        self.media_library = media_library
+        self._upload_lock = asyncio.Lock()
+        self.limiter = limiter or SendRateLimiter()
+        self.retry_queue = retry_queue or RetryQueue()
+        self.max_attempts = max_attempts or Config.SEND_MAX_ATTEMPTS
+        self.base_delay = base_delay or Config.SEND_BACKOFF_BASE
+        self.max_delay = max_delay or Config.SEND_BACKOFF_MAX
+        self._stopped = asyncio.Event()
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def send(self, chat_id: str, text: str, queue_on_failure: bool = True, media: List[str] = None) -> bool:
+        """Send a message (with media library assets if given), retrying transient failures
+
+        Returns True on delivery. A call that timed out after Telegram may
+        have received it is not resent, since that could post twice; it
+        counts as unconfirmed.
+        """
+        chat_id = str(chat_id)
+        on_give_up = None
+        if queue_on_failure:
+            def on_give_up(error: str, unsent_media: Optional[List[str]]):
+                self.retry_queue.add(chat_id, text, error, self.max_attempts, media=unsent_media)
+        return await self._deliver(chat_id, text, media or [], on_give_up) == "delivered"
+
+    async def _deliver(self, chat_id: str, text: str, media: List[str],
+                       on_give_up: Callable[[str, Optional[List[str]]], None] = None) -> str:
+        """`_send` with send metrics; returns the outcome"""
+        started = time.perf_counter()
+        outcome = "failed"
+        try:
+            outcome = await self._send(chat_id, text, media, on_give_up)
+        finally:
+            metrics.SEND_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+            metrics.POSTS_SENT.inc(outcome=outcome)
+        return outcome
+
+    def _steps(self, chat_id: str, text: str, media: List[str]) -> List:
+        """API calls that make up one post, in order"""
+        if media and self.media_library is None:
+            logger.warning(f"No media library configured, sending the post to {chat_id} as text")
+            media = []
+        elif media:
+            # Assets removed by a later ingest are skipped
+            media = [asset_id for asset_id in media if asset_id in self.media_library.assets]
+        if not media:
+            return [lambda: self._send_text(chat_id, text)]
+        if telegram_length(text) <= CAPTION_MAX_LENGTH:
+            return [lambda: self._send_media(chat_id, media, caption=text)]
+        return [lambda: self._send_media(chat_id, media), lambda: self._send_text(chat_id, text)]
+
+    async def _send_text(self, chat_id: str, text: str):
+        await self.bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            parse_mode='HTML',
+            disable_web_page_preview=False
+        )
+
+    async def _send_media(self, chat_id: str, media: List[str], caption: str = None):
+        """Send assets as a photo or album; a rejected cached file_id is dropped and the bytes uploaded"""
+        library = self.media_library
+        if all(library.file_id(asset_id) for asset_id in media):
+            try:
+                return await self._send_photos(chat_id, media, caption)
+            except BadRequest as e:
+                # e.g. "wrong file identifier"; other bad requests are not the cache's fault
+                if 'file' not in str(e).lower() or not library.forget(media):
+                    raise
+                logger.warning(f"Telegram rejected a cached file_id for {chat_id} ({e}), uploading again")
+        # One upload at a time, so channels posting the same new image at once upload it only once
+        async with self._upload_lock:
+            return await self._send_photos(chat_id, media, caption)
+
+    async def _send_photos(self, chat_id: str, media: List[str], caption: str = None):
+        library = self.media_library
+        parse_mode = 'HTML' if caption else None
+        if len(media) == 1:
+            messages = [await self.bot.send_photo(chat_id=chat_id, photo=library.input_for(media[0]),
+                                                  caption=caption, parse_mode=parse_mode)]
+        else:
+            album = [InputMediaPhoto(library.input_for(asset_id), caption=caption if i == 0 else None,
+                                     parse_mode=parse_mode if i == 0 else None)
+                     for i, asset_id in enumerate(media)]
+            messages = await self.bot.send_media_group(chat_id=chat_id, media=album)
+        for asset_id, message in zip(media, messages):
+            if message.photo:
+                # The largest size is the one Telegram stored from our upload
+                library.record_file_id(asset_id, message.photo[-1].file_id)
+
+    async def _send(self, chat_id: str, text: str, media: List[str] = None,
+                    on_give_up: Callable[[str, Optional[List[str]]], None] = None) -> str:
+        """Delivery loop behind `send`; returns delivered, failed, queued or unconfirmed
+
+        When transient errors outlast every attempt, `on_give_up` is called
+        with the error and the media still unsent and the post counts as
+        queued; without it the post has failed. Retries resume at the first call that has not gone through, so photos
+        already posted are not sent twice when only the text failed.
+        """
+        steps = self._steps(chat_id, text, media or [])
+        step = 0
+        error = None
+        for attempt in range(self.max_attempts):
+            try:
+                while step < len(steps):
+                    await self.limiter.acquire(chat_id)
+                    await steps[step]()
+                    step += 1
+                return "delivered"
+            except RetryAfter as e:
+                error = e
+                metrics.TELEGRAM_ERRORS.inc(error="retry_after")
+                retry_after = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else e.retry_after
+                logger.warning(f"Flood control for {chat_id}: retrying after {retry_after}s")
+                self.limiter.pause_chat(chat_id, retry_after)
+            except (BadRequest, Forbidden) as e:
+                # Malformed content or missing permissions will not fix themselves
+                metrics.TELEGRAM_ERRORS.inc(error=type(e).__name__.lower())
+                logger.error(f"Permanent send failure to {chat_id}: {e}")
+                return "failed"
+            except TelegramError as e:
+                error = e
+                metrics.TELEGRAM_ERRORS.inc(error=type(e).__name__.lower())
+                if isinstance(e, TimedOut) and not isinstance(e.__cause__, _UNSENT_TIMEOUTS):
+                    # The response was lost, not necessarily the request; resending could duplicate the post
+                    logger.error(f"Send to {chat_id} timed out waiting for Telegram; it may have been delivered, "
+                                 f"not resending: {e}")
+                    return "unconfirmed"
+                logger.warning(f"Send to {chat_id} failed (attempt {attempt + 1}/{self.max_attempts}): {e}")
+                if attempt + 1 < self.max_attempts:
+                    await asyncio.sleep(self._backoff(attempt))
+            except Exception as e:
+                metrics.TELEGRAM_ERRORS.inc(error="unexpected")
+                logger.error(f"Unexpected error sending post to {chat_id}: {e}")
+                return "failed"
+
+        logger.error(f"Giving up on send to {chat_id} after {self.max_attempts} attempts: {error}")
+        if on_give_up:
+            on_give_up(str(error), media if step == 0 else None)
+            return "queued"
+        return "failed"
+
+    async def drain_retry_queue(self) -> int:
+        """Try to deliver every queued post once more; returns how many went out
+
+        Only posts that hit transient errors again go back in the queue. A
+        permanent rejection or a timeout that may have posted it drops the
+        entry, so a post is never sent twice from here.
+        """
+        entries = self.retry_queue.take_all()
+        if not entries:
+            return 0
+        outcomes = {}
+
+        async def redeliver(index: int, entry: Dict):
+            def requeue(error: str, unsent_media: Optional[List[str]]):
+                self.retry_queue.add(entry['chat_id'], entry['text'], error, entry['attempts'] + self.max_attempts,
+                                     entry['failed_at'], unsent_media)
+            outcome = await self._deliver(entry['chat_id'], entry['text'], entry.get('media') or [], requeue)
+            outcomes[index] = outcome
+            if outcome in ("failed", "unconfirmed"):
+                logger.warning(f"Dropping post for {entry['chat_id']} from the retry queue ({outcome})")
+
+        try:
+            await asyncio.gather(*(redeliver(i, e) for i, e in enumerate(entries)))
+        finally:
+            # Runs on cancellation too, so a shutdown mid-drain keeps the posts without an outcome
+            for index, entry in enumerate(entries):
+                if index not in outcomes:
+                    self.retry_queue.add(entry['chat_id'], entry['text'], entry['error'], entry['attempts'],
+                                         entry['failed_at'], entry.get('media'))
+        delivered = sum(outcome == "delivered" for outcome in outcomes.values())
+        logger.info(f"Retry queue: delivered {delivered}/{len(entries)}")
+        return delivered
+
+    async def run_retry_worker(self, interval: float = None):
+        """Periodically redeliver posts from the retry queue until stopped"""
+        interval = interval or Config.RETRY_QUEUE_INTERVAL
+        self._stopped.clear()
+        while not self._stopped.is_set():
+            try:
+                await asyncio.wait_for(self._stopped.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+            if len(self.retry_queue) and not self._stopped.is_set():
+                await self.drain_retry_queue()
+
+    def stop(self):
+        """Stop the retry worker"""
+        self._stopped.set()
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+def read_json(path: str, default=None):
+    """Read a JSON file, returning `default` if it is missing or unreadable"""
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read {path}: {e}")
+        return default
+
+def write_json_atomic(path: str, data):
+    """Write JSON via a temp file and rename so readers never see a partial file"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def lock_directory(directory: str):
+    """Lock `directory` for the life of this process; returns the open lock file, or None if another process has it"""
+    os.makedirs(directory, exist_ok=True)
+    handle = open(os.path.join(directory, '.lock'), 'a')
+    try:
+        import fcntl
+    except ImportError:
+        # No flock on Windows; distinct REPLICA_ID values have to keep processes apart there
+        return handle
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+class DebouncedJsonWriter:
+    """Writes `snapshot()` to `path` in a worker thread, at most `delay` seconds after a change
+
+    `mark_dirty` is cheap enough to call on every change from the event
+    loop; without a running loop (CLI scripts) it writes right away. Writes
+    are serialized and an older snapshot never replaces a newer one.
+    """
+
+    def __init__(self, path: str, snapshot: Callable[[], object], delay: float):
+        self.path = path
+        self.snapshot = snapshot
+        self.delay = delay
+        self._version = 0
+        self._saved_version = 0
+        self._write_lock = threading.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def mark_dirty(self):
+        """Record a change and schedule a flush"""
+        self._version += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        await self.aflush()
+
+    async def aflush(self):
+        """Write pending changes in a worker thread"""
+        if self._version == self._saved_version:
+            return
+        version, data = self._version, self.snapshot()
+        try:
+            await asyncio.to_thread(self._write, version, data)
+        except OSError as e:
+            logger.error(f"Could not save {self.path}: {e}")
+
+    def flush(self):
+        """Write pending changes on the calling thread"""
+        if self._version != self._saved_version:
+            self._write(self._version, self.snapshot())
+
+    async def close(self):
+        """Cancel the pending flush timer and write whatever is still unsaved"""
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        await self.aflush()
+
+    def _write(self, version: int, data):
+        with self._write_lock:
+            if version <= self._saved_version:
+                return
+            write_json_atomic(self.path, data)
+            self._saved_version = version
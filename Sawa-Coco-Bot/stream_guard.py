@@ -0,0 +1,177 @@
+import re
+from typing import List
+
+# Telegram counts message length in UTF-16 code units
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Tags Telegram accepts with parse_mode='HTML'
+ALLOWED_TAGS = {
+    "b", "strong", "i", "em", "u", "ins", "s", "strike", "del", "span", "tg-spoiler",
+    "a", "code", "pre", "blockquote", "tg-emoji"
+}
+
+_TAG_RE = re.compile(r"^<\s*(/?)\s*([a-zA-Z][a-zA-Z0-9-]*)([^<>]*)>$")
+# What an allowed tag can look like before its closing ">" has arrived
+_PARTIAL_TAG_RE = re.compile(r"<[ \t]*/?[ \t]*(?:([a-zA-Z][a-zA-Z0-9-]*)([^<>\n]*))?")
+_MAX_TAG_LENGTH = 200
+# Text outside tags; Telegram's HTML parser needs these escaped
+_ESCAPES = {"<": "&lt;", ">": "&gt;"}
+_BARE_AMP_RE = re.compile(r"&(?!#\d+;|#x[0-9a-fA-F]+;|[a-zA-Z]+;)")
+_SENTENCE_END = ".!?…"
+# Full-width stops end a Chinese sentence without a following space
+_CJK_SENTENCE_END = "。！？"
+
+DEFAULT_BLOCKED_PHRASES = (
+    "as an ai",
+    "i'm sorry, but",
+    "i cannot help",
+    "i can't help",
+    "language model"
+)
+
+def telegram_length(text: str) -> int:
+    """Length of text as Telegram measures it (UTF-16 code units)"""
+    return len(text.encode("utf-16-le")) // 2
+
+class StreamRejected(Exception):
+    """Raised when streamed content violates policy and cannot be salvaged"""
+
+class StreamGuard:
+    """Incremental validator for a streamed completion
+
+    `feed` is called with each delta and returns False as soon as the
+    stream should be cut: the text would no longer fit in a Telegram
+    message next to the footer, the post has reached its word budget at a
+    sentence boundary, the output is repeating itself, or it contains a
+    blocked phrase or HTML that Telegram would refuse. `result` then
+    returns the usable text or raises StreamRejected.
+    """
+
+    def __init__(self, max_length: int, max_words: int = 250, blocked_phrases: List[str] = None,
+                 repeat_window: int = 60, repeat_limit: int = 3):
+        self.max_length = max_length
+        self.max_words = max_words
+        self.blocked_phrases = tuple(p.lower() for p in (blocked_phrases or DEFAULT_BLOCKED_PHRASES))
+        self.repeat_window = repeat_window
+        self.repeat_limit = repeat_limit
+        self.text = ""
+        self.length = 0
+        self.words = 0
+        self.stop_reason = None
+        self.violation = None
+        self._open_tags: List[str] = []
+        self._pending_tag = ""
+        self._last_boundary = 0
+
+    def feed(self, delta: str) -> bool:
+        """Consume one streamed delta; False means stop reading"""
+        if self.stop_reason:
+            return False
+        for char in delta:
+            if not self._feed_char(char):
+                return False
+        return True
+
+    def _feed_char(self, char: str) -> bool:
+        # HTML: collect tags as they arrive and check them once closed.
+        # A "<" that cannot start an allowed tag ("<3", "<5g carbs") is text
+        if self._pending_tag or char == "<":
+            if char == "<" and self._pending_tag and not self._flush_pending():
+                return False
+            self._pending_tag += char
+            if char == ">":
+                match = _TAG_RE.match(self._pending_tag)
+                if not match or match.group(2).lower() not in ALLOWED_TAGS:
+                    return self._flush_pending()
+                tag, self._pending_tag = self._pending_tag, ""
+                if not self._check_tag(tag):
+                    return False
+                self.text += tag
+            elif not self._could_be_tag():
+                return self._flush_pending()
+            return True
+        return self._feed_text(char)
+
+    def _could_be_tag(self, final: bool = False) -> bool:
+        """Whether the pending "<..." can still become an allowed tag; `final` once nothing more will follow"""
+        match = _PARTIAL_TAG_RE.fullmatch(self._pending_tag)
+        if not match or len(self._pending_tag) > _MAX_TAG_LENGTH:
+            return False
+        name, rest = match.groups()
+        if name is None:
+            return not final
+        name = name.lower()
+        if rest or final:
+            return name in ALLOWED_TAGS
+        return any(tag.startswith(name) for tag in ALLOWED_TAGS)
+
+    def _flush_pending(self) -> bool:
+        """Emit a pending "<..." that turned out not to be a tag as escaped text"""
+        pending, self._pending_tag = self._pending_tag, ""
+        return all(self._feed_text(char) for char in pending)
+
+    def _feed_text(self, char: str) -> bool:
+        if telegram_length(char) + self.length > self.max_length:
+            self.stop_reason = "length"
+            return False
+
+        self.text += _ESCAPES.get(char, char)
+        self.length += telegram_length(char)
+        if char.isspace() and self.text[-2:-1] and not self.text[-2].isspace():
+            self.words += 1
+
+        if char == "\n" or char in _CJK_SENTENCE_END or (char.isspace() and self.text[-2:-1] in tuple(_SENTENCE_END)):
+            self._last_boundary = len(self.text)
+            if self.words >= self.max_words:
+                self.stop_reason = "word_budget"
+                return False
+            if not self._check_policy():
+                return False
+        return True
+
+    def _check_tag(self, tag: str) -> bool:
+        closing, name, _ = _TAG_RE.match(tag).groups()
+        name = name.lower()
+        if closing:
+            if not self._open_tags or self._open_tags[-1] != name:
+                return self._reject(f"unbalanced closing tag </{name}>")
+            self._open_tags.pop()
+        else:
+            self._open_tags.append(name)
+        return True
+
+    def _check_policy(self) -> bool:
+        """Checks run at sentence boundaries: blocked phrases and repetition"""
+        lowered = self.text.lower()
+        for phrase in self.blocked_phrases:
+            if phrase in lowered:
+                return self._reject(f"blocked phrase {phrase!r}")
+        window = self.text[-self.repeat_window:].strip()
+        if len(window) >= 20 and self.text.count(window) >= self.repeat_limit:
+            return self._reject("repetitive output")
+        return True
+
+    def _reject(self, reason: str) -> bool:
+        self.violation = reason
+        self.stop_reason = "violation"
+        return False
+
+    def result(self) -> str:
+        """Final text, trimmed to the last sentence boundary if the stream was cut"""
+        if self.violation:
+            raise StreamRejected(self.violation)
+        if self._pending_tag:
+            if self._could_be_tag(final=True):
+                raise StreamRejected(f"unterminated HTML tag {self._pending_tag[:40]!r}")
+            self._flush_pending()
+        if self._open_tags:
+            raise StreamRejected(f"unclosed HTML tag(s) {', '.join(self._open_tags)}")
+
+        text = self.text
+        if self.stop_reason == "length" and self._last_boundary:
+            text = text[:self._last_boundary]
+        # Bare ampersands would break parse_mode='HTML'
+        text = _BARE_AMP_RE.sub("&amp;", text).strip()
+        if not text:
+            raise StreamRejected("empty completion")
+        return text
@@ -1,98 +1,264 @@
 import asyncio
 import logging
-from datetime import datetime, time
+import random
+from datetime import datetime, timezone
+from typing import Dict, List
 from telegram import Bot
 from telegram.error import TelegramError
+from telegram.request import HTTPXRequest
+from channels import ChannelConfig, load_channels
 from content_generator import ContentGenerator
+from content_queue import ContentQueue
 from config import Config
-import schedule
-import time as time_module
-import threading
-
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+from identity_cache import IdentityCache
+from media_library import MediaLibrary
+from posting_lock import ReplicaCoordinator
+import metrics
+from scheduler import PostScheduler, SchedulerState
+from send_pipeline import SendPipeline
+from storage import lock_directory
+from webhook import UpdateDispatcher, WebhookServer
+
 logger = logging.getLogger(__name__)
 
 class TelegramContentBot:
     def __init__(self):
         Config.validate_config()
-        self.bot = Bot(token=Config.TELEGRAM_BOT_TOKEN)
-        self.channel_id = Config.TELEGRAM_CHANNEL_ID
+        # The default request object has a single connection, which serialises channel fan-out
+        self.request = HTTPXRequest(connection_pool_size=Config.TELEGRAM_MAX_CONNECTIONS, pool_timeout=30)
+        self.bot = Bot(token=Config.TELEGRAM_BOT_TOKEN, base_url=Config.TELEGRAM_BASE_URL, request=self.request)
+        self.identity = IdentityCache(Config.TELEGRAM_BOT_TOKEN)
         self.content_generator = ContentGenerator()
+        self.channels: Dict[str, ChannelConfig] = {
+            c.channel_id: c for c in load_channels(known_topics=self.content_generator.content_topics,
+                                                   known_languages=list(self.content_generator.catalog.languages))
+        }
+        # The first channel is the default target for test and manual posts
+        self.channel_id = next(iter(self.channels))
+        self.coordinator = ReplicaCoordinator()
+        self.coordinator_task = None
+        self.data_dir_lock = None
+        self.content_queue = ContentQueue(self.content_generator, owns=self.coordinator.owns)
+        for channel in self.channels.values():
+            self.content_queue.register_channel(channel)
+            self.content_generator.budget.register_channel(channel)
+        self.queue_task = None
         self.posting_times = Config.POSTING_HOURS
         self.posts_per_day = Config.POSTS_PER_DAY
+        self.schedulers: List[PostScheduler] = []
+        self.scheduler_task = None
+        self.scheduler_state = SchedulerState()
+        self.scheduler_channels: Dict[str, List[str]] = {}
+        self.resume_task = None
+        self.media_library = MediaLibrary(Config.TELEGRAM_BOT_TOKEN)
+        self.send_pipeline = SendPipeline(self.bot, media_library=self.media_library)
+        self.retry_task = None
+        self.dispatcher = None
+        self.dispatcher_task = None
+        self.webhook_server = None
+        metrics.REGISTRY.add_collector(self.collect_metrics)
         
-    async def send_post(self, content: str) -> bool:
-        """Send a post to the Telegram channel"""
-        try:
-            await self.bot.send_message(
-                chat_id=self.channel_id,
-                text=content,
-                parse_mode='HTML',
-                disable_web_page_preview=False
-            )
-            logger.info(f"Successfully sent post to {self.channel_id}")
-            return True
-            
-        except TelegramError as e:
-            logger.error(f"Failed to send post: {e}")
-            return False
-        except Exception as e:
-            logger.error(f"Unexpected error sending post: {e}")
-            return False
+    def collect_metrics(self):
+        """Refresh queue and budget gauges before a metrics scrape"""
+        budget = self.content_generator.budget
+        for channel_id in self.channels:
+            metrics.QUEUE_DEPTH.set(self.content_queue.size(channel_id), channel=channel_id)
+            for cap, period in zip(budget.caps_for(channel_id), ('day', 'month')):
+                if cap:
+                    metrics.BUDGET_REMAINING.set(cap - budget.spent(channel_id, period), channel=channel_id, period=period)
+        metrics.RETRY_QUEUE_SIZE.set(len(self.send_pipeline.retry_queue))
 
-    async def send_scheduled_post(self):
-        """Generate and send a scheduled post"""
-        logger.info("Generating scheduled post...")
+    def pick_media(self, topic: str) -> List[str]:
+        """Media library images for a post about `topic` (none if the library has no match)"""
+        return self.media_library.pick(topic, self.content_generator.catalog.get(topic).group)
+
+    async def send_post(self, content: str, chat_id: str = None, media: List[str] = None) -> bool:
+        """Send a post with optional media library images to a channel (the default channel if not given)"""
+        chat_id = str(chat_id or self.channel_id)
+        if not self.identity.chat(chat_id):
+            # Lazy connectivity check: only chats without a fresh cache entry pay the extra round-trip
+            await self.verify_chat(chat_id)
+        success = await self.send_pipeline.send(chat_id, content, media=media)
+        if success:
+            logger.info(f"Successfully sent post to {chat_id}")
+        else:
+            logger.error(f"Failed to send post to {chat_id}")
+            self.identity.invalidate(chat_id)
+        return success
+
+    async def send_scheduled_post(self, slot: datetime = None, channel_ids: List[str] = None):
+        """Send the scheduled post for a slot to each channel concurrently"""
+        channel_ids = channel_ids or list(self.channels)
+        logger.info(f"Sending scheduled post for slot {slot} to {len(channel_ids)} channels...")
         
+        results = await asyncio.gather(
+            *(self._send_channel_post(channel_id, slot) for channel_id in channel_ids),
+            return_exceptions=True
+        )
+        for channel_id, result in zip(channel_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error in scheduled posting to {channel_id}: {result}")
+        return results
+
+    async def _send_channel_post(self, channel_id: str, slot: datetime = None) -> bool:
+        """Send the next buffered post to one channel"""
+        # Another replica may own this slot; claim it before spending a post or an OpenAI call
+        if slot and not await self.coordinator.claim(channel_id, slot):
+            logger.info(f"Slot {slot.isoformat()} for {channel_id} is handled by another replica")
+            self.scheduler_state.record_posted(channel_id, slot)
+            return False
+        
+        post_data = None
         try:
-            # Generate content
-            post_data = self.content_generator.generate_post_content()
-            content = post_data['content']
+            # Take pre-generated content, generating live only if the buffer ran dry; a standby
+            # taking the slot over generates too, since only the channel's owner keeps its buffer current
+            post_data = self.content_queue.pop(channel_id) if self.coordinator.owns(channel_id) else None
+            if post_data is None:
+                logger.warning(f"No buffered post for {channel_id}, generating live")
+                post_data = await self._generate_for_channel(channel_id)
             
             # Send the post
-            success = await self.send_post(content)
-            
-            if success:
-                logger.info(f"Posted content about: {post_data['topic']} ({post_data['post_type']})")
-            else:
-                logger.error("Failed to send scheduled post")
-                
-        except Exception as e:
-            logger.error(f"Error in scheduled posting: {e}")
+            success = await self.send_post(post_data['content'], channel_id, self.pick_media(post_data['topic']))
+        except BaseException:
+            if slot:
+                # Let a standby replica take the slot
+                await asyncio.shield(self.coordinator.release(channel_id, slot))
+            if post_data is not None:
+                # e.g. shutdown deadline hit mid-send; keep the post for the next slot
+                self.content_queue.requeue(channel_id, post_data)
+            raise
+        if slot:
+            # Failed sends are in the retry queue, so the slot counts as handled either way
+            await self.coordinator.complete(channel_id, slot)
+            self.scheduler_state.record_posted(channel_id, slot)
+        
+        drift = (datetime.now(timezone.utc) - slot).total_seconds() if slot else None
+        if success and slot:
+            metrics.POST_DRIFT.observe(drift)
+        fields = {
+            "post_id": post_data.get('post_id'), "channel": channel_id, "topic": post_data['topic'],
+            "post_type": post_data['post_type'], "slot": slot.isoformat() if slot else None,
+            "outcome": "delivered" if success else "failed",
+            "latency_ms": round(drift * 1000) if drift is not None else None
+        }
+        if success:
+            logger.info(f"Posted content to {channel_id} about: {post_data['topic']} ({post_data['post_type']})",
+                        extra=fields)
+        else:
+            logger.error(f"Failed to send scheduled post to {channel_id}", extra=fields)
+        return success
+
+    async def _generate_for_channel(self, channel_id: str, topic: str = None, post_type: str = None,
+                                    stream: bool = None) -> Dict[str, str]:
+        """Generate a post live from the channel's topics with its CTA"""
+        channel = self.channels.get(str(channel_id))
+        if channel and not topic and channel.topics:
+            topic = random.choice(channel.topics)
+        if channel and channel.language != Config.DEFAULT_LANGUAGE:
+            posts = await self.content_generator.agenerate_localized(topic, post_type, [channel.language],
+                                                                     channel_id=channel_id)
+            post_data = posts[channel.language]
+        else:
+            post_data = await self.content_generator.agenerate_post_content(topic, post_type, channel_id=channel_id,
+                                                                            stream=stream)
+        cta = channel.cta_for(post_data['topic']) if channel else None
+        if cta:
+            post_data = self.content_generator.reassemble_post(post_data, cta)
+        return post_data
 
     def schedule_posts(self):
-        """Schedule posts for specific times"""
-        logger.info(f"Scheduling posts for times: {self.posting_times}")
+        """Schedule posts for specific times, one scheduler per distinct channel schedule"""
+        groups: Dict[tuple, List[str]] = {}
+        for channel in self.channels.values():
+            groups.setdefault(channel.schedule_key(), []).append(channel.channel_id)
         
-        for time_str in self.posting_times:
-            schedule.every().day.at(time_str).do(
-                lambda: asyncio.create_task(self.send_scheduled_post())
-            )
-            logger.info(f"Scheduled post for {time_str}")
+        self.schedulers = []
+        self.scheduler_channels = {}
+        for (hours, tz), channel_ids in groups.items():
+            logger.info(f"Scheduling posts for times: {list(hours)} ({tz}) -> {channel_ids}")
+            state_key = f"{','.join(hours)}@{tz}"
+            self.scheduler_channels[state_key] = channel_ids
+            self.schedulers.append(PostScheduler(
+                list(hours),
+                lambda slot, ids=channel_ids: self.send_scheduled_post(slot, ids),
+                tz=tz,
+                state=self.scheduler_state,
+                state_key=state_key
+            ))
+
+    def interrupted_posts(self) -> Dict[datetime, List[str]]:
+        """Channels that never got the post of the last fired slot, e.g. after a crash mid-slot
+
+        Only slots inside the catch-up window count, and only while no later
+        slot has passed (those are the catch-up policy's job). Channels that
+        have never posted are left out so a new channel is not sent an old slot.
+        Must run before the schedulers start, as catch-up moves `last_fired`.
+        """
+        now = datetime.now(timezone.utc)
+        interrupted: Dict[datetime, List[str]] = {}
+        for scheduler in self.schedulers:
+            slot = scheduler.last_fired
+            if slot is None or scheduler.catchup == "skip" or \
+                    (now - slot).total_seconds() > scheduler.catchup_window or \
+                    scheduler.next_fire_times(1, after=slot)[0] <= now:
+                continue
+            for channel_id in self.scheduler_channels[scheduler.state_key]:
+                posted = self.scheduler_state.last_posted(channel_id)
+                if posted is not None and posted < slot:
+                    interrupted.setdefault(slot, []).append(channel_id)
+        return interrupted
+
+    async def resume_interrupted_posts(self, interrupted: Dict[datetime, List[str]]):
+        """Finish slots that were cut short by the previous shutdown"""
+        for slot, channel_ids in interrupted.items():
+            logger.warning(f"Slot {slot.isoformat()} was interrupted, posting to {channel_ids}")
+        await asyncio.gather(*(self.send_scheduled_post(slot, ids) for slot, ids in interrupted.items()))
+
+    def next_post_times(self, count: int = None) -> List[datetime]:
+        """Return the upcoming scheduled post times across all channels"""
+        times = []
+        for scheduler in self.schedulers:
+            times.extend(scheduler.next_fire_times(count or len(scheduler.slots)))
+        times.sort()
+        return times[:count] if count else times
 
     async def test_connection(self) -> bool:
-        """Test bot connection and permissions"""
+        """Test bot connection and permissions, refreshing the identity cache"""
         try:
             bot_info = await self.bot.get_me()
             logger.info(f"Bot connected successfully: @{bot_info.username}")
+            self.identity.record_bot(bot_info.id, bot_info.username)
             
             # Test channel access
-            try:
-                chat_info = await self.bot.get_chat(self.channel_id)
-                logger.info(f"Channel access confirmed: {chat_info.title}")
-                return True
-            except TelegramError as e:
-                logger.error(f"Cannot access channel {self.channel_id}: {e}")
-                return False
+            for channel_id in self.channels:
+                try:
+                    chat_info = await self.bot.get_chat(channel_id)
+                    logger.info(f"Channel access confirmed: {chat_info.title}")
+                    self.identity.record_chat(channel_id, chat_info.title)
+                except TelegramError as e:
+                    logger.error(f"Cannot access channel {channel_id}: {e}")
+                    return False
+            return True
                 
         except TelegramError as e:
             logger.error(f"Bot connection failed: {e}")
             return False
 
+    async def verify_chat(self, chat_id: str) -> bool:
+        """Check that the bot can reach one chat and cache the result"""
+        try:
+            if not self.identity.bot():
+                bot_info = await self.bot.get_me()
+                logger.info(f"Bot connected successfully: @{bot_info.username}")
+                self.identity.record_bot(bot_info.id, bot_info.username)
+            chat_info = await self.bot.get_chat(chat_id)
+        except TelegramError as e:
+            logger.error(f"Cannot access channel {chat_id}: {e}")
+            return False
+        logger.info(f"Channel access confirmed: {chat_info.title}")
+        self.identity.record_chat(chat_id, chat_info.title)
+        return True
+
     async def send_test_post(self):
         """Send a test post to verify everything works"""
         test_content = """🧪 **Test Post - @sawacoco_bot is LIVE!**
@@ -116,69 +282,162 @@ https://www.sawa-coco.com"""
             logger.info("Test post sent successfully!")
         return success
 
-    def run_scheduler(self):
-        """Run the scheduler in a separate thread"""
-        while True:
-            schedule.run_pending()
-            time_module.sleep(60)  # Check every minute
+    async def run_scheduler(self):
+        """Run the schedulers in the bot's event loop until stopped"""
+        await asyncio.gather(*(scheduler.run() for scheduler in self.schedulers))
+
+    def stop_scheduler(self):
+        """Stop scheduled posting and the content queue refill worker"""
+        for scheduler in self.schedulers:
+            scheduler.stop()
+        self.content_queue.stop()
+        self.send_pipeline.stop()
+
+    async def shutdown(self, timeout: float = None):
+        """Stop taking new work, let in-flight posts finish within `timeout`, then persist and close
+
+        Posts still sending at the deadline are cancelled and put back in the
+        content queue; the queue, retry queue and scheduler state are on disk
+        when this returns.
+        """
+        timeout = Config.SHUTDOWN_TIMEOUT if timeout is None else timeout
+        self.stop_scheduler()
+        await self.stop_webhook()
+        in_flight = {task for scheduler in self.schedulers for task in scheduler.in_flight}
+        in_flight |= {task for task in (self.scheduler_task, self.queue_task, self.retry_task, self.resume_task,
+                                        self.dispatcher_task)
+                      if task and not task.done()}
+        if in_flight:
+            logger.info(f"Waiting up to {timeout:.0f}s for {len(in_flight)} in-flight tasks")
+            _, pending = await asyncio.wait(in_flight, timeout=timeout)
+            if pending:
+                logger.warning(f"Cancelling {len(pending)} tasks still running after {timeout:.0f}s")
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        # Leave the replica set last, once no post of ours still holds a lease
+        await self.coordinator.stop()
+        if self.coordinator_task:
+            await asyncio.gather(self.coordinator_task, return_exceptions=True)
+
+        await self.content_queue.close()
+        await self.scheduler_state.close()
+        await self.send_pipeline.retry_queue.close()
+        if self.data_dir_lock:
+            self.data_dir_lock.close()
+        await self.content_generator.aclose()
+        await self.bot.shutdown()
+        # The bot is never initialize()d on a warm start, so close its connection pool directly
+        await self.request.shutdown()
+        logger.info("Shutdown complete: queue, retry queue and scheduler state saved")
+
+    async def start_webhook(self):
+        """Take admin commands from the webhook; registers it with Telegram when WEBHOOK_URL is set"""
+        self.dispatcher = UpdateDispatcher(self)
+        try:
+            self.webhook_server = WebhookServer(self.dispatcher, asyncio.get_running_loop()).start()
+        except (OSError, ValueError) as e:
+            logger.error(f"Webhook unavailable on port {Config.WEBHOOK_PORT}: {e}")
+            return
+        self.dispatcher_task = asyncio.create_task(self.dispatcher.run())
+        if Config.WEBHOOK_URL:
+            try:
+                await self.bot.set_webhook(Config.WEBHOOK_URL, allowed_updates=["message"],
+                                           secret_token=self.webhook_server.secret_token)
+                logger.info(f"Registered webhook {Config.WEBHOOK_URL} with Telegram")
+            except TelegramError as e:
+                logger.error(f"Could not register webhook {Config.WEBHOOK_URL}: {e}")
+
+    async def stop_webhook(self):
+        """Stop receiving updates; commands already running finish during shutdown
+
+        The webhook stays registered with Telegram so another replica (or the
+        next deploy) keeps receiving updates.
+        """
+        if self.webhook_server:
+            await self.webhook_server.stop()
+        if self.dispatcher:
+            self.dispatcher.stop()
+
+    def _next_fire_time(self):
+        """Next scheduled post time, used to keep refills off-peak"""
+        upcoming = self.next_post_times(1)
+        return upcoming[0] if upcoming else None
 
     async def start_bot(self):
         """Start the bot and begin scheduled posting"""
         logger.info("Starting SawaCoco MCT Oil Telegram Bot...")
         
-        # Test connection
-        if not await self.test_connection():
-            logger.error("Bot startup failed - connection test failed")
+        # Test connection (the test post only goes out via `main.py --self-test`)
+        if Config.STARTUP_CHECK == 'eager':
+            if not await self.test_connection():
+                logger.error("Bot startup failed - connection test failed")
+                return False
+        elif self.identity.is_fresh(self.channels):
+            logger.info(f"Using cached identity @{self.identity.bot()['username']} for {len(self.channels)} channels")
+        else:
+            logger.info("No fresh identity cache; channels are checked on their first send")
+        
+        # Two processes sharing one replica data dir would overwrite each other's queue and state
+        self.data_dir_lock = lock_directory(Config.REPLICA_DATA_DIR)
+        if self.data_dir_lock is None:
+            logger.error(f"Bot startup failed - {Config.REPLICA_DATA_DIR} is in use by another process on this "
+                         f"host; give each replica its own REPLICA_ID")
             return False
         
-        # Send test post
-        logger.info("Sending test post...")
-        await self.send_test_post()
+        await self.content_generator.warm_up()
+        
+        # Join the replica set before anything is scheduled so channel ownership is known
+        await self.coordinator.heartbeat()
+        self.coordinator_task = asyncio.create_task(self.coordinator.run())
         
         # Schedule posts
         self.schedule_posts()
+        interrupted = self.interrupted_posts()
         
-        # Start scheduler in background thread
-        scheduler_thread = threading.Thread(target=self.run_scheduler, daemon=True)
-        scheduler_thread.start()
+        # Start scheduler and content queue refill as tasks in this event loop
+        self.scheduler_task = asyncio.create_task(self.run_scheduler())
+        self.queue_task = asyncio.create_task(self.content_queue.run(self._next_fire_time))
+        self.retry_task = asyncio.create_task(self.send_pipeline.run_retry_worker())
+        self.resume_task = asyncio.create_task(self.resume_interrupted_posts(interrupted))
+        if Config.WEBHOOK_PORT:
+            await self.start_webhook()
         
         logger.info("Bot started successfully! Scheduled posting is now active.")
-        logger.info(f"Posts will be sent at: {self.posting_times}")
+        logger.info(f"Next posts at: {[t.isoformat() for t in self.next_post_times()]}")
         
         return True
 
-    async def manual_post(self, topic: str = None, post_type: str = None):
-        """Manually trigger a post with optional topic/type"""
-        logger.info(f"Manual post requested - Topic: {topic}, Type: {post_type}")
+    async def manual_post(self, topic: str = None, post_type: str = None, channel_id: str = None):
+        """Manually trigger a post with optional topic/type/channel"""
+        channel_id = channel_id or self.channel_id
+        logger.info(f"Manual post requested - Topic: {topic}, Type: {post_type}, Channel: {channel_id}")
         
-        post_data = self.content_generator.generate_post_content(topic, post_type)
-        success = await self.send_post(post_data['content'])
+        post_data = await self._generate_for_channel(channel_id, topic, post_type, stream=True)
+        success = await self.send_post(post_data['content'], channel_id, self.pick_media(post_data['topic']))
         
         if success:
             logger.info(f"Manual post sent successfully: {post_data['topic']} ({post_data['post_type']})")
         
         return success
 
-# Async wrapper for schedule
-def async_job(coro):
-    """Wrapper to run async functions with schedule"""
-    def wrapper():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(coro)
-        loop.close()
-    return wrapper
+async def _run_forever(bot: TelegramContentBot):
+    """Start the bot and keep the scheduler running"""
+    try:
+        if await bot.start_bot():
+            await bot.scheduler_task
+    finally:
+        await bot.shutdown()
 
 if __name__ == "__main__":
+    from logging_setup import setup_logging
+    setup_logging()
     bot = TelegramContentBot()
     
     # Run the bot
     try:
-        asyncio.run(bot.start_bot())
-        
-        # Keep the main thread alive
-        while True:
-            time_module.sleep(1)
+        asyncio.run(_run_forever(bot))
             
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import unittest
+
+import httpx
+from telegram.error import BadRequest, NetworkError, TimedOut
+
+from send_pipeline import RetryQueue, SendPipeline
+
+def timed_out(cause: Exception) -> TimedOut:
+    error = TimedOut()
+    error.__cause__ = cause
+    return error
+
+class FakeBot:
+    """Records send_message calls and raises the queued errors in order"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+        if self.errors:
+            raise self.errors.pop(0)
+
+class DrainRetryQueueTest(unittest.IsolatedAsyncioTestCase):
+    def pipeline(self, bot):
+        path = os.path.join(tempfile.mkdtemp(), "retry_queue.json")
+        pipeline = SendPipeline(bot, retry_queue=RetryQueue(path), max_attempts=2, base_delay=0.001, max_delay=0.001)
+        pipeline.retry_queue.add("@chan", "post", "earlier failure", 2)
+        return pipeline
+
+    async def test_ambiguous_timeout_is_not_resent(self):
+        bot = FakeBot(timed_out(httpx.ReadTimeout("read")))
+        pipeline = self.pipeline(bot)
+        for _ in range(3):
+            await pipeline.drain_retry_queue()
+        self.assertEqual(len(bot.sent), 1)
+        self.assertEqual(len(pipeline.retry_queue), 0)
+
+    async def test_permanent_failure_is_dropped(self):
+        bot = FakeBot(BadRequest("can't parse entities"))
+        pipeline = self.pipeline(bot)
+        await pipeline.drain_retry_queue()
+        await pipeline.drain_retry_queue()
+        self.assertEqual(len(bot.sent), 1)
+        self.assertEqual(len(pipeline.retry_queue), 0)
+
+    async def test_transient_failure_is_requeued(self):
+        bot = FakeBot(NetworkError("reset"), timed_out(httpx.ConnectTimeout("connect")))
+        pipeline = self.pipeline(bot)
+        self.assertEqual(await pipeline.drain_retry_queue(), 0)
+        self.assertEqual(len(pipeline.retry_queue), 1)
+        self.assertEqual(pipeline.retry_queue.entries[0]["attempts"], 4)
+        self.assertEqual(await pipeline.drain_retry_queue(), 1)
+        self.assertEqual(len(pipeline.retry_queue), 0)
+
+if __name__ == "__main__":
+    unittest.main()
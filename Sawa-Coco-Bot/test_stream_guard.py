@@ -0,0 +1,40 @@
+import unittest
+
+from stream_guard import StreamGuard, StreamRejected
+
+def guarded(*deltas: str) -> str:
+    guard = StreamGuard(max_length=4096)
+    for delta in deltas:
+        guard.feed(delta)
+    return guard.result()
+
+class AngleBracketTest(unittest.TestCase):
+    def test_less_than_in_text_is_escaped(self):
+        self.assertEqual(guarded("Only <5g carbs per serving."), "Only &lt;5g carbs per serving.")
+        self.assertEqual(guarded("We <3 coconut charcoal"), "We &lt;3 coconut charcoal")
+        self.assertEqual(guarded("Burns 2 < 3 hours"), "Burns 2 &lt; 3 hours")
+
+    def test_stray_greater_than_is_escaped(self):
+        self.assertEqual(guarded("Heat -> ash"), "Heat -&gt; ash")
+        self.assertEqual(guarded("<>"), "&lt;&gt;")
+
+    def test_bracket_split_across_deltas(self):
+        self.assertEqual(guarded("Only <", "5g carbs"), "Only &lt;5g carbs")
+        self.assertEqual(guarded("<", "b>Bold</", "b> <", "3"), "<b>Bold</b> &lt;3")
+
+    def test_unknown_tag_names_are_text(self):
+        self.assertEqual(guarded("x<y and <div>"), "x&lt;y and &lt;div&gt;")
+        self.assertEqual(guarded("ends with <"), "ends with &lt;")
+
+    def test_allowed_tags_pass_through(self):
+        text = '<b>MCT</b> oil and <a href="https://example.com">more</a>'
+        self.assertEqual(guarded(text), text)
+
+    def test_unbalanced_or_unterminated_tags_are_rejected(self):
+        with self.assertRaises(StreamRejected):
+            guarded("<b>bold</i>")
+        with self.assertRaises(StreamRejected):
+            guarded('<a href="https://example.com"')
+
+if __name__ == "__main__":
+    unittest.main()
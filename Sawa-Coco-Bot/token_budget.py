@@ -0,0 +1,340 @@
+"""
+Token counting, spend caps and spend reports for OpenAI completions
+
+Each completion is priced before it is sent. Prompts are counted locally
+(with tiktoken when it is installed, otherwise a conservative estimate)
+and `max_tokens` is sized so the post plus its footer fits one Telegram
+message. Actual usage goes into a SQLite ledger by channel and topic. A
+channel past its daily or monthly cap gets cached or fallback content
+instead of a new completion. Cap checks use running totals kept in
+memory; the ledger is only read at startup and when a UTC day begins.
+"""
+
+import argparse
+import asyncio
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Posts run about 1.4 tokens per word once emoji and hashtags are counted
+TOKENS_PER_WORD = 1.4
+CHARS_PER_TOKEN = 4
+# Chat formatting adds a few tokens per message and primes the reply with a few more
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+# Batch API completions are billed at half price
+BATCH_PRICE_FACTOR = 0.5
+LEDGER_RETENTION_DAYS = 400
+
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+_encodings: Dict[str, object] = {}
+
+def _encoding(model: str):
+    """tiktoken encoding for a model, or None to use the estimate"""
+    if model not in _encodings:
+        try:
+            import tiktoken
+            try:
+                _encodings[model] = tiktoken.encoding_for_model(model)
+            except KeyError:
+                _encodings[model] = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # Not installed, or its vocabulary file cannot be fetched
+            _encodings[model] = None
+    return _encodings[model]
+
+def estimate_tokens(text: str) -> int:
+    """Tokenizer-free count that errs high: ~4 characters per token for Latin words, more for the rest"""
+    tokens = 0
+    for piece in _PIECE_RE.findall(text):
+        if piece.isascii():
+            tokens += math.ceil(len(piece) / CHARS_PER_TOKEN)
+        else:
+            # Emoji and non-Latin scripts come out at about one token per two UTF-8 bytes
+            tokens += max(1, len(piece.encode('utf-8')) // 2)
+    return tokens
+
+def count_tokens(text: str, model: str = None) -> int:
+    encoding = _encoding(model or Config.OPENAI_MODEL)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+def count_message_tokens(messages: List[Dict], model: str = None) -> int:
+    """Prompt tokens of a chat completion request"""
+    return sum(MESSAGE_OVERHEAD_TOKENS + count_tokens(m["content"], model) for m in messages) + REPLY_PRIMING_TOKENS
+
+def completion_cost(prompt_tokens: float, completion_tokens: float) -> float:
+    return (prompt_tokens / 1000 * Config.OPENAI_PROMPT_PRICE_PER_1K +
+            completion_tokens / 1000 * Config.OPENAI_COMPLETION_PRICE_PER_1K)
+
+def max_tokens_for(available_chars: int, max_words: int = None) -> int:
+    """Completion tokens for a post of up to `max_words` words that fits in `available_chars`"""
+    by_words = math.ceil((max_words or Config.STREAM_MAX_WORDS) * TOKENS_PER_WORD)
+    return max(Config.BUDGET_MIN_COMPLETION_TOKENS, min(by_words, available_chars // CHARS_PER_TOKEN))
+
+class BudgetHold:
+    """Spend reserved for one completion until its usage is known
+
+    `request` is the request to send, with `max_tokens` lowered if the
+    budget could not cover the full size.
+    """
+
+    def __init__(self, budget: "TokenBudget", channels: List[str], topic: str, request: Dict, estimate: float):
+        self.budget = budget
+        self.channels = channels
+        self.topic = topic
+        self.request = request
+        self.estimate = estimate
+        self.released = False
+
+    def charge(self, usage):
+        """Write a completion's actual usage to the ledger"""
+        self.budget.record(self.channels, self.topic, usage)
+
+    def release(self):
+        """Drop the reservation; call once the completion has been charged or has failed"""
+        if not self.released:
+            self.released = True
+            self.budget._unreserve(self)
+
+class TokenBudget:
+    """Daily and monthly spend caps, overall and per channel, over a SQLite ledger
+
+    A completion shared by several channels is charged to each of them in
+    equal parts. Caps of 0 mean no cap. Periods are UTC calendar days and
+    months, like the OpenAI bill.
+    """
+
+    def __init__(self, path: str = None, daily: float = None, monthly: float = None):
+        self.path = path or Config.BUDGET_LEDGER_FILE
+        self.daily = Config.BUDGET_DAILY_USD if daily is None else daily
+        self.monthly = Config.BUDGET_MONTHLY_USD if monthly is None else monthly
+        self.caps: Dict[str, tuple] = {}
+        # USD held by completions in flight, per channel and overall (None)
+        self.reserved: Dict[Optional[str], float] = {}
+        # Reentrant: spent() locks on its own and also runs under reserve()
+        self._lock = threading.RLock()
+        # The connection has its own lock so a slow ledger write never holds up a cap check
+        self._db_lock = threading.Lock()
+        self._writes = set()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS spend (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL NOT NULL,
+                day TEXT NOT NULL,
+                month TEXT NOT NULL,
+                channel TEXT NOT NULL,
+                topic TEXT NOT NULL,
+                share REAL NOT NULL,
+                prompt_tokens REAL NOT NULL,
+                completion_tokens REAL NOT NULL,
+                cost REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS spend_channel_day ON spend (channel, day)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS spend_month ON spend (month)")
+        self.conn.execute("DELETE FROM spend WHERE ts < ?", (time.time() - LEDGER_RETENTION_DAYS * 86400,))
+        self.conn.commit()
+        self._totals_periods = self._periods()
+        self._totals = self._load_totals(*self._totals_periods)
+
+    def register_channel(self, channel):
+        """Use a channel's own caps from channels.json instead of the defaults"""
+        self.caps[channel.channel_id] = (channel.daily_budget_usd, channel.monthly_budget_usd)
+
+    def caps_for(self, channel_id: str) -> tuple:
+        """(daily, monthly) cap in USD for a channel"""
+        return self.caps.get(str(channel_id), (Config.BUDGET_CHANNEL_DAILY_USD, Config.BUDGET_CHANNEL_MONTHLY_USD))
+
+    @staticmethod
+    def _periods() -> tuple:
+        now = datetime.now(timezone.utc)
+        return now.strftime('%Y-%m-%d'), now.strftime('%Y-%m')
+
+    def _load_totals(self, day: str, month: str) -> Dict[str, Dict[Optional[str], float]]:
+        """Ledger spend of a day and a month per channel and overall (None)"""
+        totals = {'day': {}, 'month': {}}
+        with self._db_lock:
+            for period, value in (('day', day), ('month', month)):
+                rows = self.conn.execute(
+                    f"SELECT channel, SUM(cost) FROM spend WHERE {period} = ? GROUP BY channel", (value,)
+                ).fetchall()
+                totals[period] = dict(rows)
+                totals[period][None] = sum(cost for _, cost in rows)
+        return totals
+
+    def _current_totals(self) -> Dict[str, Dict[Optional[str], float]]:
+        """Running totals, reloaded from the ledger when a new UTC day starts; call under the lock"""
+        periods = self._periods()
+        if periods != self._totals_periods:
+            self._totals = self._load_totals(*periods)
+            self._totals_periods = periods
+        return self._totals
+
+    def spent(self, channel_id: str = None, period: str = 'day') -> float:
+        """USD recorded this UTC day or month, for one channel or overall"""
+        key = str(channel_id) if channel_id is not None else None
+        with self._lock:
+            return self._current_totals()['day' if period == 'day' else 'month'].get(key, 0.0)
+
+    def headroom(self, channel_id: str = None) -> float:
+        """USD left under the tightest cap after in-flight reservations; inf when uncapped"""
+        daily, monthly = self.caps_for(channel_id) if channel_id is not None else (self.daily, self.monthly)
+        key = str(channel_id) if channel_id is not None else None
+        left = math.inf
+        for cap, period in ((daily, 'day'), (monthly, 'month')):
+            if cap:
+                left = min(left, cap - self.spent(channel_id, period) - self.reserved.get(key, 0.0))
+        return left
+
+    def exhausted(self, channel_id: str) -> bool:
+        """True when a channel cannot afford even a minimal completion"""
+        minimum = completion_cost(0, Config.BUDGET_MIN_COMPLETION_TOKENS)
+        with self._lock:
+            return min(self.headroom(channel_id), self.headroom()) < minimum
+
+    def reserve(self, channels: List[str], topic: str, request: Dict) -> Optional[BudgetHold]:
+        """Hold the worst-case cost of a completion, or return None when a cap cannot cover it
+
+        If the full `max_tokens` does not fit but a post of at least
+        BUDGET_MIN_COMPLETION_TOKENS does, the hold's request asks for less.
+        """
+        channels = [str(c) for c in channels]
+        share = 1 / len(channels) if channels else 1.0
+        prompt_tokens = count_message_tokens(request["messages"], request.get("model"))
+        max_tokens = request["max_tokens"]
+        with self._lock:
+            # The whole completion's worth of headroom, from the channel that can afford the least of it
+            headroom = min([self.headroom(c) / share for c in channels] + [self.headroom()])
+            if headroom < math.inf:
+                price = Config.OPENAI_COMPLETION_PRICE_PER_1K / 1000
+                affordable = (headroom - completion_cost(prompt_tokens, 0)) / price if price else max_tokens
+                if affordable < min(max_tokens, Config.BUDGET_MIN_COMPLETION_TOKENS):
+                    return None
+                max_tokens = min(max_tokens, int(affordable))
+            estimate = completion_cost(prompt_tokens, max_tokens)
+            for channel_id in channels:
+                self.reserved[channel_id] = self.reserved.get(channel_id, 0.0) + estimate * share
+            self.reserved[None] = self.reserved.get(None, 0.0) + estimate
+        if max_tokens < request["max_tokens"]:
+            logger.info(f"Budget nearly spent for {channels or 'all channels'}: "
+                        f"max_tokens {request['max_tokens']} -> {max_tokens}")
+            request = dict(request, max_tokens=max_tokens)
+        return BudgetHold(self, channels, topic, request, estimate)
+
+    def _unreserve(self, hold: BudgetHold):
+        share = 1 / len(hold.channels) if hold.channels else 1.0
+        with self._lock:
+            for key, amount in [(c, hold.estimate * share) for c in hold.channels] + [(None, hold.estimate)]:
+                self.reserved[key] = max(0.0, self.reserved.get(key, 0.0) - amount)
+
+    def record(self, channels: List[str], topic: str, usage, price_factor: float = 1.0):
+        """Add a completion's usage to the running totals and the ledger, split across the channels it was made for
+
+        On an event loop the ledger row is written in a worker thread; the
+        totals that cap checks read are updated right away.
+        """
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        cost = completion_cost(prompt_tokens, completion_tokens) * price_factor
+        channels = [str(c) for c in channels] or ['']
+        share = 1 / len(channels)
+        now = time.time()
+        with self._lock:
+            totals = self._current_totals()
+            day, month = self._totals_periods
+            for period in ('day', 'month'):
+                for key in channels + [None]:
+                    amount = cost if key is None else cost * share
+                    totals[period][key] = totals[period].get(key, 0.0) + amount
+        rows = [(now, day, month, channel_id, topic, share, prompt_tokens * share, completion_tokens * share,
+                 cost * share) for channel_id in channels]
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._append(rows)
+            return
+        task = loop.create_task(asyncio.to_thread(self._append, rows))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    def _append(self, rows: List[tuple]):
+        try:
+            with self._db_lock:
+                self.conn.executemany(
+                    "INSERT INTO spend (ts, day, month, channel, topic, share, prompt_tokens, completion_tokens, cost) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+                )
+                self.conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Could not write {len(rows)} spend rows to {self.path}: {e}")
+
+    async def flush(self):
+        """Wait for ledger writes still in flight"""
+        if self._writes:
+            await asyncio.gather(*list(self._writes))
+
+    def report(self, days: int = 30, by: str = 'topic') -> List[Dict]:
+        """Completions, tokens and USD over the last `days` days grouped by topic, channel or day"""
+        column = {'topic': 'topic', 'channel': 'channel', 'day': 'day'}[by]
+        with self._db_lock:
+            rows = self.conn.execute(
+                f"SELECT {column}, SUM(share), SUM(prompt_tokens), SUM(completion_tokens), SUM(cost) FROM spend "
+                f"WHERE ts >= ? GROUP BY {column} ORDER BY SUM(cost) DESC",
+                (time.time() - days * 86400,)
+            ).fetchall()
+        return [{by: key or '(shared)', "completions": round(completions, 2), "prompt_tokens": round(prompt),
+                 "completion_tokens": round(completion), "cost": cost}
+                for key, completions, prompt, completion, cost in rows]
+
+    def close(self):
+        self.conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI spend per topic, channel or day, and budget status")
+    parser.add_argument('command', choices=['report', 'status'])
+    parser.add_argument('--days', type=int, default=30, help="report window")
+    parser.add_argument('--by', choices=['topic', 'channel', 'day'], default='topic')
+    args = parser.parse_args()
+
+    budget = TokenBudget()
+    if args.command == 'report':
+        rows = budget.report(args.days, args.by)
+        print(f"{args.by:<28} {'completions':>11} {'prompt':>10} {'completion':>10} {'USD':>10}")
+        for row in rows:
+            print(f"{row[args.by]:<28} {row['completions']:>11} {row['prompt_tokens']:>10} "
+                  f"{row['completion_tokens']:>10} {row['cost']:>10.4f}")
+        print(f"{'total':<28} {'':>11} {'':>10} {'':>10} {sum(r['cost'] for r in rows):>10.4f}")
+        return
+
+    from channels import load_channels
+    for channel in load_channels():
+        budget.register_channel(channel)
+        daily, monthly = budget.caps_for(channel.channel_id)
+        print(f"{channel.name}: today ${budget.spent(channel.channel_id, 'day'):.4f}"
+              f"{f' of ${daily:.4f}' if daily else ''}, this month ${budget.spent(channel.channel_id, 'month'):.4f}"
+              f"{f' of ${monthly:.4f}' if monthly else ''}")
+    print(f"All channels: today ${budget.spent(period='day'):.4f}{f' of ${budget.daily:.4f}' if budget.daily else ''}, "
+          f"this month ${budget.spent(period='month'):.4f}{f' of ${budget.monthly:.4f}' if budget.monthly else ''}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""
+Admin commands over a Telegram webhook
+
+WebhookServer receives updates on WEBHOOK_PATH in a background thread and
+hands them to UpdateDispatcher on the bot's event loop. Updates are
+acknowledged as soon as they are queued; a fixed pool of
+WEBHOOK_CONCURRENCY workers runs the commands, so a slow /post generation
+never holds up receipt of other updates. When the queue is full the
+webhook answers 503 and Telegram delivers the update again later.
+
+Each update is handled once: ids this process has seen are dropped, and
+the update is claimed in the replica lease store so replicas behind the
+same webhook URL never both act on a redelivery.
+
+Commands (only from ADMIN_USER_IDS):
+  /post [topic] [post_type] [channel]   generate and send a post now
+  /queue                                buffered posts per channel
+  /skip [channel]                       drop a channel's next buffered post
+  /stats                                delivery, generation and spend figures
+"""
+
+import asyncio
+import hmac
+import html
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Telegram updates are a few KB; anything far larger is not from Telegram
+MAX_UPDATE_BYTES = 1024 * 1024
+# What Telegram accepts as a webhook secret_token
+SECRET_TOKEN_RE = re.compile(r'[A-Za-z0-9_-]{1,256}')
+
+HELP_TEXT = ("Commands:\n"
+             "/post [topic] [post_type] [channel] - generate and send a post now\n"
+             "/queue - buffered posts per channel\n"
+             "/skip [channel] - drop a channel's next buffered post\n"
+             "/stats - delivery, generation and spend figures")
+
+class UpdateDispatcher:
+    """Deduplicates Telegram updates and runs their commands on a bounded pool of workers"""
+
+    def __init__(self, bot, concurrency: int = None, queue_size: int = None, dedup_size: int = None,
+                 admins: List[int] = None):
+        self.bot = bot
+        self.concurrency = max(1, concurrency or Config.WEBHOOK_CONCURRENCY)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size or Config.WEBHOOK_QUEUE_SIZE)
+        self.dedup_size = dedup_size or Config.WEBHOOK_DEDUP_SIZE
+        self.admins = set(Config.ADMIN_USER_IDS if admins is None else admins)
+        self.seen: "OrderedDict[int, None]" = OrderedDict()
+        self.commands = {
+            "post": self.cmd_post,
+            "queue": self.cmd_queue,
+            "skip": self.cmd_skip,
+            "stats": self.cmd_stats
+        }
+        self.workers: List[asyncio.Task] = []
+        self._idle = set()
+        self._stopped = False
+
+    def submit(self, update: Dict) -> bool:
+        """Queue an update for the workers; False only when the queue is full
+
+        Must run on the event loop. Updates without an id or already seen
+        count as accepted so Telegram does not deliver them again.
+        """
+        update_id = update.get("update_id") if isinstance(update, dict) else None
+        if not isinstance(update_id, int):
+            metrics.WEBHOOK_UPDATES.inc(outcome="ignored")
+            return True
+        if update_id in self.seen:
+            metrics.WEBHOOK_UPDATES.inc(outcome="duplicate")
+            logger.info(f"Dropping duplicate update {update_id}")
+            return True
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            metrics.WEBHOOK_UPDATES.inc(outcome="busy")
+            logger.warning(f"Update queue full ({self.queue.maxsize}), asking Telegram to redeliver {update_id}")
+            return False
+        self.seen[update_id] = None
+        while len(self.seen) > self.dedup_size:
+            self.seen.popitem(last=False)
+        metrics.WEBHOOK_UPDATES.inc(outcome="queued")
+        return True
+
+    async def asubmit(self, update: Dict) -> bool:
+        return self.submit(update)
+
+    async def run(self):
+        """Run the workers until stop()"""
+        self._stopped = False
+        if not self.admins:
+            logger.warning("ADMIN_USER_IDS is empty; every admin command will be refused")
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    def stop(self):
+        """Let commands in flight finish and stop taking new ones; queued updates are dropped"""
+        self._stopped = True
+        if not self.queue.empty():
+            logger.warning(f"Dropping {self.queue.qsize()} queued updates on shutdown")
+        for worker in self._idle:
+            worker.cancel()
+
+    async def _worker(self):
+        task = asyncio.current_task()
+        while not self._stopped:
+            self._idle.add(task)
+            try:
+                update = await self.queue.get()
+            finally:
+                self._idle.discard(task)
+            try:
+                await self.handle(update)
+            except Exception as e:
+                metrics.WEBHOOK_UPDATES.inc(outcome="failed")
+                logger.error(f"Update {update.get('update_id')} failed: {e}")
+
+    @staticmethod
+    def parse_command(text: str, username: str = None) -> Optional[tuple]:
+        """(command, args) of a message like "/post recipes tips", or None if it is not a command for us
+
+        "/cmd@OtherBot" in a group is meant for another bot.
+        """
+        parts = (text or "").split()
+        if not parts or not parts[0].startswith("/"):
+            return None
+        command, _, mention = parts[0][1:].partition("@")
+        if mention and username and mention.lower() != username.lower():
+            return None
+        return command.lower(), parts[1:]
+
+    async def handle(self, update: Dict):
+        """Check the sender, claim the update across replicas and run its command"""
+        message = update.get("message") or {}
+        bot_identity = self.bot.identity.bot() or {}
+        parsed = self.parse_command(message.get("text"), bot_identity.get("username"))
+        if parsed is None:
+            metrics.WEBHOOK_UPDATES.inc(outcome="ignored")
+            return
+        command, args = parsed
+        user_id = (message.get("from") or {}).get("id")
+        chat_id = message["chat"]["id"]
+        if user_id not in self.admins:
+            metrics.WEBHOOK_UPDATES.inc(outcome="unauthorized")
+            logger.warning(f"Refused /{command} from user {user_id} in chat {chat_id}")
+            return
+        if not await self.bot.coordinator.claim_update(update["update_id"]):
+            metrics.WEBHOOK_UPDATES.inc(outcome="duplicate")
+            logger.info(f"Update {update['update_id']} was handled by another replica")
+            return
+
+        handler = self.commands.get(command)
+        started = time.perf_counter()
+        logger.info(f"Admin command /{command} {' '.join(args)} from user {user_id}")
+        reply = await handler(args) if handler else html.escape(HELP_TEXT)
+        await self.bot.send_pipeline.send(str(chat_id), reply, queue_on_failure=False)
+        metrics.COMMAND_SECONDS.observe(time.perf_counter() - started, command=command if handler else "help")
+        metrics.WEBHOOK_UPDATES.inc(outcome="handled")
+
+    def _split_channel(self, args: List[str]) -> Tuple[str, List[str]]:
+        """The channel named in the arguments by id (else the default channel) and the other arguments"""
+        for index, arg in enumerate(args):
+            if arg in self.bot.channels:
+                return arg, args[:index] + args[index + 1:]
+        return self.bot.channel_id, args
+
+    async def cmd_post(self, args: List[str]) -> str:
+        generator = self.bot.content_generator
+        channel_id, args = self._split_channel(args)
+        topic = args[0] if args else None
+        post_type = args[1] if len(args) > 1 else None
+        if topic and topic not in generator.content_topics:
+            return (f"❌ Unknown topic <code>{html.escape(topic)}</code>. "
+                    f"Topics: {html.escape(', '.join(generator.content_topics))}")
+        if post_type and post_type not in generator.post_types:
+            return (f"❌ Unknown post type <code>{html.escape(post_type)}</code>. "
+                    f"Types: {html.escape(', '.join(generator.post_types))}")
+        success = await self.bot.manual_post(topic, post_type, channel_id)
+        what = html.escape(f"{topic or 'random topic'} ({post_type or 'random type'})")
+        if success:
+            return f"✅ Posted {what} to {html.escape(channel_id)}"
+        return f"❌ Could not post {what} to {html.escape(channel_id)}; see the logs"
+
+    async def cmd_queue(self, args: List[str]) -> str:
+        lines = []
+        for channel_id, channel in self.bot.channels.items():
+            posts = self.bot.content_queue.peek(channel_id)
+            upcoming = ", ".join(post["topic"] for post in posts[:3]) or "empty"
+            lines.append(f"<b>{html.escape(channel.name)}</b> ({html.escape(channel_id)}): "
+                         f"{len(posts)} ready - {html.escape(upcoming)}")
+        return "\n".join(lines)
+
+    async def cmd_skip(self, args: List[str]) -> str:
+        channel_id, rest = self._split_channel(args)
+        if rest:
+            return f"❌ Unknown channel <code>{html.escape(rest[0])}</code>"
+        post = self.bot.content_queue.pop(channel_id)
+        if post is None:
+            return f"Queue for {html.escape(channel_id)} is empty"
+        logger.info(f"Skipped queued post {post.get('post_id')} ({post['topic']}) for {channel_id}")
+        return (f"⏭ Skipped {html.escape(post['topic'])} ({html.escape(post['post_type'])}) for "
+                f"{html.escape(channel_id)}; {self.bot.content_queue.size(channel_id)} left")
+
+    async def cmd_stats(self, args: List[str]) -> str:
+        budget = self.bot.content_generator.budget
+        sent = {outcome: int(metrics.POSTS_SENT.value(outcome=outcome))
+                for outcome in ("delivered", "failed", "queued")}
+        generated = {source: int(metrics.POSTS_GENERATED.value(source=source))
+                     for source in ("openai", "batch", "cache", "fallback")}
+        uptime = time.time() - metrics.UP_SINCE.value() if metrics.UP_SINCE.value() else 0
+        queued = sum(self.bot.content_queue.size(channel_id) for channel_id in self.bot.channels)
+        spent_day, spent_month = budget.spent(None, 'day'), budget.spent(None, 'month')
+        return "\n".join([
+            f"⏱ Up {uptime / 3600:.1f}h, replica {html.escape(self.bot.coordinator.replica_id)}",
+            f"📤 Sent: {sent['delivered']} delivered, {sent['failed']} failed, {sent['queued']} queued for retry "
+            f"({len(self.bot.send_pipeline.retry_queue)} waiting)",
+            f"✍️ Generated: {generated['openai']} OpenAI, {generated['batch']} batch, {generated['cache']} cached, "
+            f"{generated['fallback']} fallback",
+            f"📦 Content queue: {queued} posts across {len(self.bot.channels)} channels",
+            f"💵 OpenAI spend: ${spent_day:.4f} today, ${spent_month:.4f} this month"
+        ])
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        server = self.server
+        if self.path.split('?', 1)[0] != server.webhook_path:
+            return self._reply(404)
+        if not hmac.compare_digest(
+                self.headers.get('X-Telegram-Bot-Api-Secret-Token', '').encode(), server.secret_token.encode()):
+            metrics.WEBHOOK_UPDATES.inc(outcome="unauthorized")
+            return self._reply(403)
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_UPDATE_BYTES:
+            return self._reply(413)
+        try:
+            update = json.loads(self.rfile.read(length))
+        except ValueError:
+            return self._reply(400)
+        # The dispatcher lives on the event loop; queueing there is quick, handling happens later
+        future = asyncio.run_coroutine_threadsafe(server.dispatcher.asubmit(update), server.loop)
+        try:
+            accepted = future.result(timeout=10)
+        except Exception as e:
+            logger.error(f"Could not queue webhook update: {e}")
+            accepted = False
+        self._reply(200 if accepted else 503)
+
+    def _reply(self, status: int):
+        body = b'{}' if status == 200 else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class WebhookServer:
+    """Receives Telegram updates on WEBHOOK_PATH from a background thread"""
+
+    def __init__(self, dispatcher: UpdateDispatcher, loop: asyncio.AbstractEventLoop, host: str = None,
+                 port: int = None, path: str = None, secret_token: str = None):
+        self.dispatcher = dispatcher
+        self.loop = loop
+        self.host = host or Config.WEBHOOK_HOST
+        self.port = Config.WEBHOOK_PORT if port is None else port
+        self.path = path or Config.WEBHOOK_PATH
+        self.secret_token = Config.WEBHOOK_SECRET_TOKEN if secret_token is None else secret_token
+        self.httpd = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{self.path}"
+
+    def start(self):
+        if not SECRET_TOKEN_RE.fullmatch(self.secret_token or ''):
+            raise ValueError("WEBHOOK_SECRET_TOKEN must be 1-256 characters of A-Z, a-z, 0-9, _ and -")
+        self.httpd = ThreadingHTTPServer((self.host, self.port), _WebhookHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.dispatcher = self.dispatcher
+        self.httpd.loop = self.loop
+        self.httpd.webhook_path = self.path
+        self.httpd.secret_token = self.secret_token
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"Webhook listening on {self.url}")
+        return self
+
+    async def stop(self):
+        if self.httpd:
+            # shutdown() waits for the serving thread's next poll (up to 0.5s); not on the event loop
+            await asyncio.to_thread(self.httpd.shutdown)
+            self.httpd.server_close()
+            self.httpd = None